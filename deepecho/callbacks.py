@@ -0,0 +1,187 @@
+"""Callbacks to control the training loops of the DeepEcho models.
+
+Callbacks are passed to ``fit``, ``fit_sequences`` or ``partial_fit`` and
+are notified at the beginning and end of the training and after computing the
+loss of each epoch. If any of them asks to stop, the training stops after the
+current epoch.
+
+For ``PARModel`` the loss is the negative log likelihood of the sequences, and
+for ``BasicGANModel`` it is the estimate of the Wasserstein distance between
+the real and generated sequences made by the discriminator. In both cases,
+lower is better.
+"""
+
+import math
+import time
+
+import pandas as pd
+
+
+class Callback:
+    """Base class of the training callbacks, which does nothing."""
+
+    def on_train_begin(self, model):
+        """Prepare for a new training run of the given model."""
+
+    def on_epoch_end(self, model, epoch, loss):
+        """Handle the loss of an epoch.
+
+        It is called before the weights are updated, so the weights of the
+        model are the ones that produced ``loss``.
+
+        Args:
+            model (deepecho.models.base.DeepEcho):
+                Model being trained.
+            epoch (int):
+                Number of the epoch, starting at 0.
+            loss (float):
+                Loss of the epoch.
+
+        Returns:
+            bool:
+                Whether to stop the training after this epoch.
+        """
+        return False
+
+    def on_train_end(self, model):
+        """Finish the training run of the given model."""
+
+
+class EarlyStopping(Callback):
+    """Stop the training when the loss has not improved for a number of epochs.
+
+    Args:
+        patience (int):
+            Number of epochs without improvement after which the training
+            is stopped. Defaults to 10.
+        min_delta (float):
+            Minimum decrease of the loss that counts as an improvement.
+            Defaults to 0.
+        restore_best_weights (bool):
+            Whether to restore, at the end of the training, the weights of the
+            epoch with the lowest loss, even if the training was stopped for
+            another reason. The rest of the training state of that epoch, like
+            the optimizers and the discriminator of ``BasicGANModel``, is also
+            restored, so that ``partial_fit`` resumes from it. Defaults to ``True``.
+    """
+
+    def __init__(self, patience=10, min_delta=0.0, restore_best_weights=True):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.restore_best_weights = restore_best_weights
+        self.best_loss = None
+        self.best_epoch = None
+        self.stopped_epoch = None
+        self._best_weights = None
+        self._wait = 0
+
+    def on_train_begin(self, model):
+        """Reset the best loss."""
+        self.best_loss = math.inf
+        self.best_epoch = None
+        self.stopped_epoch = None
+        self._best_weights = None
+        self._wait = 0
+
+    def on_epoch_end(self, model, epoch, loss):
+        """Keep track of the best loss and stop if it has not improved for too long."""
+        if loss < self.best_loss - self.min_delta:
+            self.best_loss = loss
+            self.best_epoch = epoch
+            self._wait = 0
+            if self.restore_best_weights:
+                self._best_weights = model._get_module_states()
+
+            return False
+
+        self._wait += 1
+        if self._wait >= self.patience:
+            self.stopped_epoch = epoch
+            return True
+
+        return False
+
+    def on_train_end(self, model):
+        """Restore the weights of the best epoch, if required."""
+        if self._best_weights is not None:
+            model._set_module_states(self._best_weights)
+            self._best_weights = None
+
+
+class TimeBudget(Callback):
+    """Stop the training once it has run for a given amount of time.
+
+    The epoch that is running when the time is over is completed.
+
+    Args:
+        max_time (float, str or pandas.Timedelta):
+            Maximum training time, either as a number of seconds or as a
+            ``pandas.Timedelta`` or its string representation, like ``'20min'``.
+    """
+
+    def __init__(self, max_time):
+        if isinstance(max_time, (int, float)):
+            self.max_time = float(max_time)
+        else:
+            self.max_time = pd.to_timedelta(max_time).total_seconds()
+
+        self._start = None
+
+    def on_train_begin(self, model):
+        """Start counting the time."""
+        self._start = time.perf_counter()
+
+    def on_epoch_end(self, model, epoch, loss):
+        """Stop if the time is over."""
+        return time.perf_counter() - self._start >= self.max_time
+
+
+class TargetLoss(Callback):
+    """Stop the training once the loss reaches the given value.
+
+    Args:
+        target (float):
+            The training stops after the first epoch with a loss lower than
+            or equal to this value.
+    """
+
+    def __init__(self, target):
+        self.target = target
+
+    def on_epoch_end(self, model, epoch, loss):
+        """Stop if the loss has reached the target."""
+        return loss <= self.target
+
+
+class CallbackList:
+    """Notify several callbacks at once.
+
+    Args:
+        callbacks (list[Callback]):
+            The callbacks to notify. ``None`` means no callbacks.
+    """
+
+    def __init__(self, callbacks=None):
+        self.callbacks = list(callbacks or [])
+
+    def __bool__(self):
+        return bool(self.callbacks)
+
+    def on_train_begin(self, model):
+        """Notify all the callbacks."""
+        for callback in self.callbacks:
+            callback.on_train_begin(model)
+
+    def on_epoch_end(self, model, epoch, loss):
+        """Notify all the callbacks and tell whether any of them asks to stop."""
+        loss = float(loss)
+        stop = False
+        for callback in self.callbacks:
+            stop = callback.on_epoch_end(model, epoch, loss) or stop
+
+        return stop
+
+    def on_train_end(self, model):
+        """Notify all the callbacks."""
+        for callback in self.callbacks:
+            callback.on_train_end(model)
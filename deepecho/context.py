@@ -0,0 +1,195 @@
+"""Compact storage of the context values used to sample new entities."""
+
+import numpy as np
+import pandas as pd
+
+from deepecho.sequences import _entity_ids
+
+
+def _alias_table(weights):
+    """Build the tables of the alias method to draw indices with the given weights.
+
+    Uses Vose's algorithm, which builds the tables in linear time.
+
+    Returns:
+        tuple[numpy.ndarray, numpy.ndarray]:
+            The probability of keeping each drawn index and the alias to use otherwise.
+    """
+    num_values = len(weights)
+    probabilities = np.asarray(weights, dtype=np.float64) * num_values / np.sum(weights)
+    aliases = np.arange(num_values)
+    small = list(np.flatnonzero(probabilities < 1.0))
+    large = list(np.flatnonzero(probabilities >= 1.0))
+    while small and large:
+        less = small.pop()
+        more = large.pop()
+        aliases[less] = more
+        probabilities[more] += probabilities[less] - 1.0
+        if probabilities[more] < 1.0:
+            small.append(more)
+        else:
+            large.append(more)
+
+    # Leftovers only differ from 1.0 due to rounding errors
+    probabilities[small + large] = 1.0
+    return probabilities, aliases
+
+
+class ContextStore:
+    """Unique context values and the number of entities that have each one of them.
+
+    Each column is stored as an array of integer codes, one per unique context,
+    plus the array of the distinct values of the column. Missing values have
+    code ``-1``.
+
+    Args:
+        columns (list):
+            Names of the context columns.
+        codes (numpy.ndarray):
+            2D array with the codes of each unique context, one column per context column.
+        categories (list[numpy.ndarray]):
+            The distinct values of each context column.
+        counts (numpy.ndarray):
+            Number of entities that have each unique context.
+    """
+
+    def __init__(self, columns, codes, categories, counts):
+        self.columns = list(columns)
+        self.codes = codes
+        self.categories = categories
+        self.counts = counts
+        self._alias = None
+
+    @classmethod
+    def from_frame(cls, frame, counts=None):
+        """Build the store from a DataFrame with one row per entity.
+
+        Args:
+            frame (pandas.DataFrame):
+                Context values of each entity.
+            counts (numpy.ndarray):
+                Number of entities represented by each row. Defaults to one per row.
+        """
+        if counts is None:
+            counts = np.ones(len(frame), dtype=np.int64)
+
+        columns = list(frame.columns)
+        if not columns:
+            return cls(columns, np.zeros((1, 0), dtype=np.int64), [], np.array([counts.sum()]))
+
+        codes = []
+        categories = []
+        for _, values in frame.items():
+            column_codes, column_categories = pd.factorize(values)
+            codes.append(column_codes)
+            categories.append(np.asarray(column_categories))
+
+        codes, inverse = np.unique(np.column_stack(codes), axis=0, return_inverse=True)
+        unique_counts = np.bincount(inverse.ravel(), weights=counts, minlength=len(codes))
+        return cls(columns, codes, categories, unique_counts.astype(np.int64))
+
+    @classmethod
+    def from_data(cls, data, entity_columns, context_columns):
+        """Build the store from the training data.
+
+        Each entity is counted once, regardless of its number of rows. If there
+        are no entity columns, each row is counted once.
+        """
+        context = data[context_columns]
+        if entity_columns:
+            entity_ids = _entity_ids(data, entity_columns)
+            _, first_rows = np.unique(entity_ids, return_index=True)
+            first_rows = first_rows[entity_ids[first_rows] >= 0]
+            context = context.take(first_rows)
+
+        return cls.from_frame(context)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def to_frame(self, indices=None):
+        """Get the unique contexts, or the ones at the given indices, as a DataFrame."""
+        codes = self.codes if indices is None else self.codes[indices]
+        output = {}
+        for column, column_codes, categories in zip(self.columns, codes.T, self.categories):
+            if (column_codes < 0).any():
+                # Add the missing value at the end of the categories, where code -1 points
+                kind = categories.dtype.kind
+                if kind in 'iu':
+                    categories = categories.astype(np.float64)
+                elif kind not in 'fcmM':
+                    categories = categories.astype(object)
+
+                missing = {'m': np.timedelta64('NaT'), 'M': np.datetime64('NaT')}.get(
+                    kind, None if categories.dtype.kind == 'O' else np.nan)
+                missing = np.array([missing], dtype=categories.dtype)
+                categories = np.concatenate([categories, missing])
+
+            output[column] = categories[column_codes]
+
+        return pd.DataFrame(output, columns=self.columns, index=pd.RangeIndex(len(codes)))
+
+    def sample(self, size, random_state=None):
+        """Draw contexts of entities, weighted by the number of entities that have them.
+
+        Args:
+            size (int):
+                Number of contexts to draw.
+            random_state (numpy.random.RandomState):
+                Random state to use. Defaults to the global numpy random state.
+
+        Returns:
+            pandas.DataFrame
+        """
+        if self._alias is None:
+            self._alias = _alias_table(self.counts)
+
+        probabilities, aliases = self._alias
+        random_state = np.random if random_state is None else random_state
+        indices = random_state.randint(len(self), size=size)
+        keep = random_state.random_sample(size) < probabilities[indices]
+        return self.to_frame(np.where(keep, indices, aliases[indices]))
+
+    def merge(self, other):
+        """Get a store with the contexts and entity counts of this and another store."""
+        frame = pd.concat([self.to_frame(), other.to_frame()], ignore_index=True)
+        counts = np.concatenate([self.counts, other.counts])
+        return ContextStore.from_frame(frame, counts)
+
+    def to_arrays(self):
+        """Convert the store to a JSON serializable header and a dict of arrays.
+
+        The categories of columns that cannot be stored as arrays, like strings,
+        are stored in the header.
+        """
+        arrays = {'context_codes': self.codes, 'context_counts': self.counts}
+        header = {'columns': self.columns, 'categories': []}
+        for index, categories in enumerate(self.categories):
+            if categories.dtype.kind in 'biufmM':
+                arrays['context_categories_{}'.format(index)] = categories
+                header['categories'].append(None)
+            else:
+                header['categories'].append(list(categories))
+
+        return header, arrays
+
+    @classmethod
+    def from_arrays(cls, header, arrays):
+        """Rebuild a store converted with ``to_arrays``."""
+        categories = []
+        for index, column_categories in enumerate(header['categories']):
+            if column_categories is None:
+                column_categories = np.asarray(arrays['context_categories_{}'.format(index)])
+            else:
+                values = column_categories
+                column_categories = np.empty(len(values), dtype=object)
+                column_categories[:] = values
+
+            categories.append(column_categories)
+
+        return cls(
+            header['columns'],
+            np.asarray(arrays['context_codes']),
+            categories,
+            np.asarray(arrays['context_counts']),
+        )
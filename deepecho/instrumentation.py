@@ -0,0 +1,163 @@
+"""Instrumentation of the stages of fitting and sampling DeepEcho models.
+
+Models report each stage of their work, like the assembly of the sequences,
+each training epoch or each sampled chunk, to an ``Instrumentation`` object
+set with ``DeepEcho.set_instrumentation``. The default one discards them
+without taking any measurement, while ``EventLog`` records, for each stage,
+an event like::
+
+    {
+        "stage": "epoch",
+        "start": 1602151426.51,
+        "wall_time": 0.0123,
+        "cpu_time": 0.0241,
+        "peak_rss": 201527296,
+        "epoch": 3,
+        "loss": 1.28
+    }
+
+where ``start`` is a UNIX timestamp, ``wall_time`` and ``cpu_time`` are
+given in seconds and ``peak_rss`` is the highest resident memory of the
+process so far, in bytes. The CPU time covers all the threads of the process.
+"""
+
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _peak_rss():
+    """Get the peak resident memory of the process in bytes, if available."""
+    if resource is None:
+        return None
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+class _NullStage:
+    """Stage which is not measured."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def update(self, **fields):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    """Stage which measures its duration and reports an event when it ends."""
+
+    def __init__(self, instrumentation, name, fields):
+        self._instrumentation = instrumentation
+        self._name = name
+        self._fields = fields
+
+    def __enter__(self):
+        self._start = time.time()
+        self._wall_time = time.perf_counter()
+        self._cpu_time = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        event = {
+            'stage': self._name,
+            'start': self._start,
+            'wall_time': time.perf_counter() - self._wall_time,
+            'cpu_time': time.process_time() - self._cpu_time,
+            'peak_rss': _peak_rss(),
+        }
+        for name, value in self._fields.items():
+            # Tensors and numpy scalars are only converted here, when enabled
+            event[name] = value.item() if hasattr(value, 'item') else value
+
+        if exc_type is not None:
+            event['error'] = exc_type.__name__
+
+        self._instrumentation.on_event(event)
+        return False
+
+    def update(self, **fields):
+        """Add fields to the event of the stage."""
+        self._fields.update(fields)
+
+
+class Instrumentation:
+    """Receive the events of the stages of fitting and sampling a model.
+
+    This class discards all the events, and measures nothing. Subclasses
+    set ``enabled`` to ``True`` and handle the events in ``on_event``.
+    """
+
+    enabled = False
+
+    def stage(self, name, **fields):
+        """Get a context manager that measures a stage and reports it when it ends.
+
+        Args:
+            name (str):
+                Name of the stage.
+            **fields:
+                Additional values to add to the event, like the epoch number.
+                More values can be added with the ``update`` method of the
+                context manager.
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+
+        return _Stage(self, name, fields)
+
+    def on_event(self, event):
+        """Handle the event of a stage which has ended.
+
+        Args:
+            event (dict):
+                Measurements and fields of the stage.
+        """
+
+
+NULL_INSTRUMENTATION = Instrumentation()
+
+
+class EventLog(Instrumentation):
+    """Keep the events in memory and optionally append them to a JSON lines file.
+
+    Stages run in sampling worker processes are recorded in the memory of the
+    worker, so they can only be collected from the file.
+
+    Args:
+        path (str):
+            If given, append each event to this file as a JSON line as soon
+            as its stage ends.
+    """
+
+    enabled = True
+
+    def __init__(self, path=None):
+        self.path = path
+        self.events = []
+
+    def on_event(self, event):
+        """Record the event."""
+        self.events.append(event)
+        if self.path is not None:
+            with open(self.path, 'a') as log_file:
+                log_file.write(json.dumps(event) + '\n')
+
+    def to_json_lines(self, path):
+        """Write all the recorded events to the given file, one JSON object per line."""
+        with open(path, 'w') as log_file:
+            for event in self.events:
+                log_file.write(json.dumps(event) + '\n')
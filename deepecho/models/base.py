@@ -1,25 +1,105 @@
 """Base DeepEcho class."""
 
+import copy
+import importlib
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import numpy as np
 import pandas as pd
+import torch
 import tqdm
 
-from deepecho.sequences import assemble_sequences
+from deepecho import storage
+from deepecho.context import ContextStore
+from deepecho.instrumentation import NULL_INSTRUMENTATION
+from deepecho.sequences import SequenceBatch, _is_number, assemble_batch
+
+DTYPES = frozenset(['continuous', 'categorical', 'ordinal', 'count', 'datetime'])
+
+# Arguments shared with the sampling worker processes, which inherit them when forked.
+_WORKER_ARGUMENTS = {}
+
+
+def _init_sample_worker(arguments):
+    # Each worker samples a single chunk at a time, so avoid competing for the CPUs.
+    torch.set_num_threads(1)
+    _WORKER_ARGUMENTS.update(arguments)
+
+
+def _sample_worker_chunk(task):
+    arguments = _WORKER_ARGUMENTS.copy()
+    model = arguments.pop('model')
+    return model._sample_chunk(*task, **arguments)
 
 
 class DeepEcho():
     """The base class for DeepEcho models."""
 
     _verbose = True
+    _instrumentation = NULL_INSTRUMENTATION
     _output_columns = None
     _data_columns = None
     _entity_columns = None
     _context_columns = None
-    _context_values = None
+    _context_store = None
+    _context_types = None
+    _data_types = None
+    _segment_size = None
+    _segment_stride = None
+    _sequence_index = None
+
+    # Names of the attributes computed by ``_encode_sequences``.
+    _ENCODING_ATTRIBUTES = ()
+
+    # Names of the attributes that hold the torch modules needed to sample.
+    _MODULES = ()
+
+    # Names of the attributes that hold the other torch modules and the optimizers
+    # used to train, which are part of the training state with the ``_MODULES``.
+    _TRAINING_MODULES = ()
+
+    # Whether the mini-batches group sequences of similar lengths, see ``_batch_indices``.
+    _BUCKET_BY_LENGTH = False
+
+    # Number of mini-batches whose sequences are sorted together by length.
+    _BUCKET_POOL_SIZE = 50
+    _SCHEMA_ATTRIBUTES = (
+        '_output_columns',
+        '_data_columns',
+        '_entity_columns',
+        '_context_columns',
+        '_context_types',
+        '_data_types',
+        '_segment_size',
+        '_segment_stride',
+        '_sequence_index',
+    )
+
+    # Stored context arrays which have not been loaded yet. See ``load``.
+    _stored_context = None
+
+    def set_instrumentation(self, instrumentation=None):
+        """Set the object that receives the events of the stages of fit and sample.
+
+        Args:
+            instrumentation (deepecho.instrumentation.Instrumentation):
+                Object that measures the stages and handles their events, such as
+                a ``deepecho.instrumentation.EventLog``. If ``None``, stop
+                measuring the stages.
+        """
+        self._instrumentation = instrumentation or NULL_INSTRUMENTATION
 
     @staticmethod
     def _validate(sequences, context_types, data_types):
         """Validate the model input.
 
+        All the sequences are checked at once, and a single error that lists
+        every offending sequence is raised.
+
         Args:
             sequences:
                 See `fit`.
@@ -27,18 +107,71 @@ class DeepEcho():
                 See `fit`.
             data_types:
                 See `fit`.
+
+        Raises:
+            ValueError:
+                If any of the types is not valid or any of the sequences does not
+                match them.
         """
-        dtypes = set(['continuous', 'categorical', 'ordinal', 'count', 'datetime'])
-        assert all(dtype in dtypes for dtype in context_types)
-        assert all(dtype in dtypes for dtype in data_types)
+        invalid_types = sorted(set(list(context_types) + list(data_types)) - DTYPES)
+        if invalid_types:
+            raise ValueError('Invalid data types: {}'.format(invalid_types))
+
+        num_context_types = len(context_types)
+        num_data_types = len(data_types)
+        errors = []
+        if isinstance(sequences, SequenceBatch):
+            if sequences.context.shape[1] != num_context_types:
+                errors.append('the sequences have {} context values instead of {}'.format(
+                    sequences.context.shape[1], num_context_types))
+            if len(sequences.data) != num_data_types:
+                errors.append('the sequences have {} data columns instead of {}'.format(
+                    len(sequences.data), num_data_types))
 
-        for sequence in sequences:
-            assert len(sequence['context']) == len(context_types)
-            assert len(sequence['data']) == len(data_types)
-            lengths = [len(x) for x in sequence['data']]
-            assert len(set(lengths)) == 1
+            invalid = np.flatnonzero(sequences.lengths < 0)
+            if len(invalid):
+                errors.append('sequences {} end before they start'.format(invalid.tolist()))
 
-    def fit_sequences(self, sequences, context_types, data_types):
+        else:
+            num_sequences = len(sequences)
+            num_context = np.fromiter(
+                (len(sequence['context']) for sequence in sequences),
+                dtype=np.int64, count=num_sequences
+            )
+            num_data = np.fromiter(
+                (len(sequence['data']) for sequence in sequences),
+                dtype=np.int64, count=num_sequences
+            )
+            lengths = np.fromiter(
+                (len(values) for sequence in sequences for values in sequence['data']),
+                dtype=np.int64, count=num_data.sum()
+            )
+
+            # Compare the length of each data column with the first one of its sequence
+            first = np.cumsum(num_data) - num_data
+            has_data = num_data > 0
+            first_lengths = np.repeat(lengths[first[has_data]], num_data[has_data])
+            sequence_ids = np.repeat(np.arange(num_sequences), num_data)
+            different_lengths = np.unique(sequence_ids[lengths != first_lengths])
+
+            invalid = np.flatnonzero(num_context != num_context_types)
+            if len(invalid):
+                errors.append('sequences {} do not have {} context values'.format(
+                    invalid.tolist(), num_context_types))
+
+            invalid = np.flatnonzero(num_data != num_data_types)
+            if len(invalid):
+                errors.append('sequences {} do not have {} data columns'.format(
+                    invalid.tolist(), num_data_types))
+
+            if len(different_lengths):
+                errors.append('sequences {} have data columns of different lengths'.format(
+                    different_lengths.tolist()))
+
+        if errors:
+            raise ValueError('Invalid sequences: {}.'.format('; '.join(errors)))
+
+    def fit_sequences(self, sequences, context_types, data_types, callbacks=None):
         """Fit a model to the specified sequences.
 
         Args:
@@ -64,6 +197,10 @@ class DeepEcho():
                 to the actual time series data such that `data[i][j]` contains
                 the value at the jth time step of the ith channel of the
                 multivariate time series.
+
+                Both the "context" and each one of the "data" lists can also
+                be given as ``numpy.ndarray`` objects, and the whole list of
+                sequences can be given as a ``deepecho.sequences.SequenceBatch``.
             context_types:
                 List of strings indicating the type of each value in context.
                 he value at `context[i]` must match the type specified by
@@ -73,9 +210,298 @@ class DeepEcho():
                 List of strings indicating the type of each channel in data.
                 Each value in the list at data[i] must match the type specified by
                 `data_types[i]`. The valid types are the same as for `context_types`.
+            callbacks (list[deepecho.callbacks.Callback]):
+                Callbacks notified during the training, which can stop it early.
+        """
+        raise NotImplementedError()
+
+    def _encode_sequences(self, sequences, context_types, data_types):
+        """Analyze the sequences and encode them as a dict of ``numpy.ndarray``.
+
+        The outcome of the analysis must be stored in the attributes listed
+        in ``_ENCODING_ATTRIBUTES``.
+
+        Args:
+            sequences:
+                See `fit_sequences`.
+            context_types:
+                See `fit_sequences`.
+            data_types:
+                See `fit_sequences`.
+
+        Returns:
+            dict[str, numpy.ndarray]
+        """
+        raise NotImplementedError()
+
+    def _analyze_sequences(self, sequences, context_types, data_types):
+        """Analyze the sequences and store the outcome in the ``_ENCODING_ATTRIBUTES``.
+
+        Args:
+            sequences (deepecho.sequences.SequenceBatch):
+                Sequences to analyze, which may be stored on disk.
+            context_types:
+                See `fit_sequences`.
+            data_types:
+                See `fit_sequences`.
+        """
+        raise NotImplementedError()
+
+    def _encode_batch(self, sequences):
+        """Encode the given sequences with the outcome of ``_analyze_sequences``.
+
+        Args:
+            sequences (deepecho.sequences.SequenceBatch):
+                Sequences to encode.
+
+        Returns:
+            dict[str, numpy.ndarray]
+        """
+        raise NotImplementedError()
+
+    def _to_tensors(self, arrays):
+        """Convert the arrays returned by ``_encode_batch`` to the batch used in ``_train``."""
+        raise NotImplementedError()
+
+    def _train(self, batches, epochs, callbacks=None):
+        """Train the model for the given epochs.
+
+        Args:
+            batches (callable):
+                Function that is called at the beginning of each epoch, and gives an
+                iterable of the batches of the epoch. Each batch is given as a tuple
+                with the output of ``_to_tensors`` and whether it is the last batch
+                of the epoch.
+            epochs (int):
+                Number of epochs.
+            callbacks (list[deepecho.callbacks.Callback]):
+                See `fit_sequences`.
+        """
+        raise NotImplementedError()
+
+    def _fit_batches(self, batches, callbacks=None):
+        """Create the networks and train them with the given batches.
+
+        Args:
+            batches (callable):
+                See `_train`.
+            callbacks (list[deepecho.callbacks.Callback]):
+                See `fit_sequences`.
         """
         raise NotImplementedError()
 
+    @staticmethod
+    def _full_batch(batch):
+        """Get a function that gives the same single batch in every epoch, see ``_train``."""
+        return lambda: [(batch, True)]
+
+    def _batch_indices(self, lengths, batch_size):
+        """Split the sequences with the given lengths in shuffled mini-batches.
+
+        If ``_BUCKET_BY_LENGTH`` is set, the sequences are shuffled and then sorted
+        by length within pools of ``_BUCKET_POOL_SIZE`` mini-batches, so that each
+        mini-batch holds sequences of similar lengths, which need little padding.
+        The order of the mini-batches is shuffled afterwards.
+
+        Returns:
+            list[numpy.ndarray]:
+                Sorted indices of the sequences of each mini-batch.
+        """
+        order = np.random.permutation(len(lengths))
+        if not self._BUCKET_BY_LENGTH:
+            batches = [
+                order[start:start + batch_size]
+                for start in range(0, len(order), batch_size)
+            ]
+        else:
+            batches = []
+            pool_size = batch_size * self._BUCKET_POOL_SIZE
+            for pool_start in range(0, len(order), pool_size):
+                pool = order[pool_start:pool_start + pool_size]
+                pool = pool[np.argsort(lengths[pool], kind='stable')]
+                batches.extend(
+                    pool[start:start + batch_size]
+                    for start in range(0, len(pool), batch_size)
+                )
+
+            batches = [batches[index] for index in np.random.permutation(len(batches))]
+
+        # Sorted indices read the stored sequences in order
+        return [np.sort(batch) for batch in batches]
+
+    def _minibatches(self, sequences, batch_size):
+        """Get a function that gives shuffled mini-batches of the sequences, see ``_train``.
+
+        The sequences of each mini-batch are encoded when the mini-batch is needed,
+        so only one mini-batch is held in memory at a time.
+        """
+        lengths = sequences.lengths
+
+        def batches():
+            indices = self._batch_indices(lengths, batch_size)
+            for number, batch in enumerate(indices):
+                arrays = self._encode_batch(sequences.take(batch))
+                yield self._to_tensors(arrays), number == len(indices) - 1
+
+        return batches
+
+    def _fit_encoded(self, arrays, callbacks=None):
+        """Fit the model to the arrays returned by ``_encode_sequences``.
+
+        Args:
+            arrays (dict[str, numpy.ndarray]):
+                Encoded sequences.
+            callbacks (list[deepecho.callbacks.Callback]):
+                See `fit_sequences`.
+        """
+        self._fit_batches(self._full_batch(self._to_tensors(arrays)), callbacks)
+
+    def fit_stream(self, sequences, context_types, data_types, batch_size=1000, path=None,
+                   chunk_size=1000, callbacks=None):
+        """Fit the model to sequences which do not fit in memory.
+
+        The sequences are stored on disk, if they are not yet, and read in two
+        passes: a first one that computes the statistics of the columns, and then
+        one per epoch, in which the model is trained with shuffled mini-batches.
+        Only the mini-batch being used is held in memory.
+
+        Args:
+            sequences (iterable, deepecho.sequences.SequenceBatch or str):
+                The sequences, as an iterable of sequence dictionaries, as described
+                in ``fit_sequences``, or of ``SequenceBatch`` chunks, or as a
+                ``SequenceBatch``, such as one loaded with ``SequenceBatch.load``,
+                or as the path to a ``SequenceBatch`` stored with ``save``.
+            context_types:
+                See `fit_sequences`.
+            data_types:
+                See `fit_sequences`.
+            batch_size (int):
+                Number of sequences of each mini-batch. Defaults to 1000.
+            path (str):
+                Directory where the sequences given as an iterable are stored, so
+                that they can be reused. If not given, they are stored in a
+                temporary directory which is removed at the end.
+            chunk_size (int):
+                Number of sequence dictionaries read in memory at once while
+                storing them. Defaults to 1000.
+            callbacks (list[deepecho.callbacks.Callback]):
+                See `fit_sequences`.
+        """
+        if isinstance(sequences, (str, os.PathLike)):
+            sequences = SequenceBatch.load(sequences)
+
+        instrumentation = self._instrumentation
+        tmp_dir = None
+        with instrumentation.stage('fit_stream'):
+            try:
+                if not isinstance(sequences, SequenceBatch):
+                    if path is None:
+                        tmp_dir = tempfile.mkdtemp(prefix='deepecho-')
+                        path = os.path.join(tmp_dir, 'sequences')
+
+                    with instrumentation.stage('store_sequences'):
+                        sequences = SequenceBatch.from_iterable(sequences, path, chunk_size)
+
+                with instrumentation.stage('analyze'):
+                    self._analyze_sequences(sequences, context_types, data_types)
+
+                self._fit_batches(self._minibatches(sequences, batch_size), callbacks)
+            finally:
+                if tmp_dir is not None:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _fit_cached(self, cache_dir, data, context_types, data_types, segment_size,
+                    sequence_index, n_jobs, segment_stride, validate, callbacks):
+        """Fit the model reusing the encoded sequences stored in ``cache_dir``.
+
+        The cache entries are identified by a fingerprint of the data, the column
+        roles and types, the segmentation arguments and the model class. If no
+        entry exists for this fit, the sequences are assembled, encoded and stored.
+        Otherwise, the stored arrays are memory-mapped and the preprocessing skipped.
+        """
+        model_class = type(self)
+        key = storage.fingerprint(
+            data,
+            model='{}.{}'.format(model_class.__module__, model_class.__name__),
+            entity_columns=self._entity_columns,
+            context_columns=self._context_columns,
+            context_types=context_types,
+            data_types=data_types,
+            segment_size=segment_size,
+            segment_stride=segment_stride,
+            sequence_index=sequence_index,
+        )
+        path = os.path.join(cache_dir, key)
+        instrumentation = self._instrumentation
+        if storage.exists(path):
+            with instrumentation.stage('load_cache'):
+                header, arrays = storage.load(path)
+
+            for name, value in header['attributes'].items():
+                setattr(self, name, value)
+
+        else:
+            sequences = self._assemble_sequences(data, segment_size, sequence_index,
+                                                 n_jobs, segment_stride)
+            if validate:
+                with instrumentation.stage('validate'):
+                    self._validate(sequences, context_types, data_types)
+
+            arrays = self._encode_sequences(sequences, context_types, data_types)
+            attributes = {name: getattr(self, name) for name in self._ENCODING_ATTRIBUTES}
+            with instrumentation.stage('save_cache'):
+                storage.save(path, {'attributes': attributes}, arrays)
+
+        self._fit_encoded(arrays, callbacks)
+
+    def _assemble_sequences(self, data, segment_size, sequence_index, n_jobs, segment_stride):
+        """Assemble the training sequences of the data, reporting the stage."""
+        with self._instrumentation.stage('assemble_sequences', num_rows=len(data)) as stage:
+            sequences = assemble_batch(data, self._entity_columns, self._context_columns,
+                                       segment_size, sequence_index, n_jobs=n_jobs,
+                                       segment_stride=segment_stride)
+            stage.update(num_sequences=len(sequences))
+
+        return sequences
+
+    @staticmethod
+    def _to_dataframe(data):
+        """Convert the input data to a ``pandas.DataFrame``.
+
+        ``pyarrow.Table`` objects and paths to Parquet files are converted without
+        copying the numerical columns whenever possible, and string and dictionary
+        columns are converted to ``pandas.Categorical``, which keeps a single copy
+        of each distinct value instead of one Python string per row.
+        """
+        if isinstance(data, pd.DataFrame):
+            return data
+
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError(
+                'pyarrow is required to fit data of type {}. Install it with '
+                '`pip install deepecho[arrow]`.'.format(type(data).__name__)
+            )
+
+        self_destruct = False
+        if isinstance(data, (str, os.PathLike)):
+            data = pyarrow.parquet.read_table(data)
+            self_destruct = True
+        elif not isinstance(data, pyarrow.Table):
+            raise TypeError(
+                '`data` must be a pandas.DataFrame, a pyarrow.Table or the path to a '
+                'Parquet file, not {}'.format(type(data).__name__)
+            )
+
+        # self_destruct releases each column of a table created here once converted.
+        return data.to_pandas(
+            split_blocks=True,
+            strings_to_categorical=True,
+            self_destruct=self_destruct,
+        )
+
     @staticmethod
     def _get_data_types(data, data_types, columns):
         """Analyze the data and tell the data type of each column."""
@@ -100,13 +526,16 @@ class DeepEcho():
         return dtypes_list
 
     def fit(self, data, entity_columns=None, context_columns=None,
-            data_types=None, segment_size=None, sequence_index=None):
+            data_types=None, segment_size=None, sequence_index=None, n_jobs=None,
+            segment_stride=None, cache_dir=None, validate=True, callbacks=None):
         """Fit the model to a dataframe containing time series data.
 
         Args:
-            data (pd.DataFrame):
+            data (pd.DataFrame, pyarrow.Table or str):
                 DataFrame containing all the timeseries data alongside the
-                entity and context columns.
+                entity and context columns. A ``pyarrow.Table`` or the path
+                to a Parquet file can also be given, in which case string
+                columns are loaded as categoricals.
             entity_columns (list[str]):
                 Names of the columns which identify different time series
                 sequences. These will be used to group the data in separated
@@ -129,9 +558,42 @@ class DeepEcho():
                 Name of the column that acts as the order index of each sequence.
                 The sequence index column can be of any type that can be sorted,
                 such as integer values or datetimes.
+            n_jobs (int):
+                Number of processes to use to assemble the training sequences.
+                If ``-1``, use all the available CPUs. If ``None`` (default), use
+                a single process. The assembled sequences are the same regardless
+                of the number of processes.
+            segment_stride (int, pd.Timedelta or str):
+                If specified, start a new segment every ``segment_stride`` data points
+                or time, instead of every ``segment_size``. Strides smaller than the
+                ``segment_size`` produce overlapping segments, which share the same
+                values in memory. Must be positive and of the same kind as the ``segment_size``.
+            cache_dir (str):
+                If given, store the encoded training sequences in this directory, and
+                reuse them in subsequent calls made with the same data and arguments,
+                skipping the sequence assembly and encoding. The stored arrays are
+                memory-mapped, so they are not loaded in memory until used.
+            validate (bool):
+                Whether to validate the assembled sequences before fitting the model.
+                Defaults to ``True``. It can be disabled to save time when the input
+                data is known to be valid.
+            callbacks (list[deepecho.callbacks.Callback]):
+                Callbacks notified after each training epoch, which can stop the
+                training early, like ``deepecho.callbacks.EarlyStopping``.
         """
         if not entity_columns and segment_size is None:
             raise TypeError('If the data has no `entity_columns`, `segment_size` must be given.')
+
+        with self._instrumentation.stage('fit'):
+            self._fit(data, entity_columns, context_columns, data_types, segment_size,
+                      sequence_index, n_jobs, segment_stride, cache_dir, validate, callbacks)
+
+    def _fit(self, data, entity_columns, context_columns, data_types, segment_size,
+             sequence_index, n_jobs, segment_stride, cache_dir, validate, callbacks):
+        """Fit the model within the ``fit`` stage. See ``fit``."""
+        with self._instrumentation.stage('to_dataframe'):
+            data = self._to_dataframe(data)
+
         if segment_size is not None and not isinstance(segment_size, int):
             if sequence_index is None:
                 raise TypeError(
@@ -146,6 +608,27 @@ class DeepEcho():
 
             segment_size = pd.to_timedelta(segment_size)
 
+        if segment_stride is not None:
+            if segment_size is None:
+                raise TypeError('`segment_stride` can only be given if `segment_size` is given.')
+            if isinstance(segment_size, int):
+                if not isinstance(segment_stride, int):
+                    raise TypeError(
+                        '`segment_stride` must be of type `int` if '
+                        '`segment_size` is of type `int`.'
+                    )
+            else:
+                if _is_number(segment_stride):
+                    raise TypeError(
+                        '`segment_stride` must be a `pd.Timedelta` or a string if '
+                        '`segment_size` is a `pd.Timedelta` or a string.'
+                    )
+
+                segment_stride = pd.to_timedelta(segment_stride)
+
+            if segment_stride <= type(segment_stride)(0):
+                raise ValueError('`segment_stride` must be positive.')
+
         self._output_columns = list(data.columns)
         self._entity_columns = entity_columns or []
         self._context_columns = context_columns or []
@@ -160,15 +643,286 @@ class DeepEcho():
 
         data_types = self._get_data_types(data, data_types, self._data_columns)
         context_types = self._get_data_types(data, data_types, self._context_columns)
-        sequences = assemble_sequences(
-            data, self._entity_columns, self._context_columns, segment_size, sequence_index)
+        self._data_types = data_types
+        self._context_types = context_types
+        self._segment_size = segment_size
+        self._segment_stride = segment_stride
+        self._sequence_index = sequence_index
+        if cache_dir is not None:
+            self._fit_cached(cache_dir, data, context_types, data_types, segment_size,
+                             sequence_index, n_jobs, segment_stride, validate, callbacks)
+        else:
+            sequences = self._assemble_sequences(data, segment_size, sequence_index,
+                                                 n_jobs, segment_stride)
 
-        # Validate and fit
-        self._validate(sequences, context_types, data_types)
-        self.fit_sequences(sequences, context_types, data_types)
+            # Validate and fit
+            if validate:
+                with self._instrumentation.stage('validate'):
+                    self._validate(sequences, context_types, data_types)
+
+            if callbacks is None:
+                # Subclasses may override ``fit_sequences`` without the ``callbacks`` argument
+                self.fit_sequences(sequences, context_types, data_types)
+            else:
+                self.fit_sequences(sequences, context_types, data_types, callbacks=callbacks)
 
         # Store context values
-        self._context_values = data[self._context_columns]
+        with self._instrumentation.stage('store_context'):
+            self._context_store = ContextStore.from_data(
+                data, self._entity_columns, self._context_columns)
+
+        self._stored_context = None
+
+    def _partial_fit_sequences(self, sequences, epochs, callbacks):
+        """Continue training the model on the given sequences.
+
+        Args:
+            sequences (deepecho.sequences.SequenceBatch):
+                New sequences, of the same types as the ones used to fit the model.
+            epochs (int):
+                Number of training epochs.
+            callbacks (list[deepecho.callbacks.Callback]):
+                See `fit`.
+        """
+        raise NotImplementedError()
+
+    def partial_fit(self, data, epochs=None, n_jobs=None, validate=True, callbacks=None):
+        """Continue training a fitted model on new data.
+
+        The networks, the optimizer state and the normalization of the numerical
+        columns are kept. Categories which were not seen before are added to the
+        model, growing its layers, and the length limits are widened to cover the
+        new sequences. Only the given data is used for training, so to mix in
+        data seen before, like a replay buffer, include it in ``data``.
+
+        Args:
+            data (pd.DataFrame, pyarrow.Table or str):
+                New data, with the same columns as the data passed to ``fit``.
+                It is segmented in the same way as in ``fit``.
+            epochs (int):
+                Number of training epochs. Defaults to the number of epochs
+                of the model. If ``0``, only the new categories and contexts
+                are added to the model, without training.
+            n_jobs (int):
+                See ``fit``.
+            validate (bool):
+                See ``fit``.
+            callbacks (list[deepecho.callbacks.Callback]):
+                See ``fit``.
+        """
+        if self._data_columns is None:
+            raise ValueError('The model must be fitted before calling `partial_fit`.')
+        if epochs is not None and epochs < 0:
+            raise ValueError('`epochs` must not be negative.')
+
+        instrumentation = self._instrumentation
+        with instrumentation.stage('partial_fit'):
+            with instrumentation.stage('to_dataframe'):
+                data = self._to_dataframe(data)
+
+            sequences = self._assemble_sequences(data, self._segment_size, self._sequence_index,
+                                                 n_jobs, self._segment_stride)
+            if validate:
+                with instrumentation.stage('validate'):
+                    self._validate(sequences, self._context_types, self._data_types)
+
+            self._partial_fit_sequences(sequences, epochs, callbacks)
+
+            with instrumentation.stage('store_context'):
+                new_context_store = ContextStore.from_data(
+                    data, self._entity_columns, self._context_columns)
+                self._context_store = self._get_context_store().merge(new_context_store)
+
+    @staticmethod
+    def _extend_index_map(mapping, num_dims, new_categories):
+        """Add new categories to an index map.
+
+        The new categories of each column get the dimensions right after the last
+        dimension of the column, and the following dimensions are shifted.
+
+        Args:
+            mapping (dict):
+                Index map, with the dimensions of each column in ``indices``, either
+                as a tuple or as a dict of categories. It is updated in place.
+            num_dims (int):
+                Number of dimensions of the encoded values.
+            new_categories (dict):
+                List of new categories of each column.
+
+        Returns:
+            tuple[numpy.ndarray, int]:
+                The new position of each one of the old dimensions and the new
+                number of dimensions.
+        """
+        inserted = np.zeros(num_dims + 1, dtype=np.int64)
+        for column, categories in new_categories.items():
+            inserted[max(mapping[column]['indices'].values()) + 1] += len(categories)
+
+        positions = np.arange(num_dims) + np.cumsum(inserted)[:num_dims]
+        for column, properties in mapping.items():
+            indices = properties['indices']
+            if isinstance(indices, dict):
+                last = int(positions[max(indices.values())])
+                indices = {value: int(positions[index]) for value, index in indices.items()}
+                for offset, category in enumerate(new_categories.get(column, []), 1):
+                    indices[category] = last + offset
+            else:
+                indices = tuple(int(positions[index]) for index in indices)
+
+            properties['indices'] = indices
+
+        return positions, num_dims + int(inserted.sum())
+
+    @staticmethod
+    def _resize_parameters(module, optimizer, changes):
+        """Resize parameters of a module, and their optimizer state, in place.
+
+        Args:
+            module (torch.nn.Module):
+                Module that contains the parameters.
+            optimizer (torch.optim.Optimizer or None):
+                Optimizer of the parameters. Its state tensors which have the shape of
+                the parameter are resized in the same way.
+            changes (dict):
+                For each parameter name, a tuple with the dimension to resize, the new
+                position of each one of the old elements along it, and the new size.
+                The new elements are zeros.
+        """
+        parameters = dict(module.named_parameters())
+        for name, (dim, positions, size) in changes.items():
+            parameter = parameters[name]
+            old_shape = parameter.shape
+            index = torch.as_tensor(positions, dtype=torch.long, device=parameter.device)
+
+            def resize(tensor):
+                shape = list(tensor.shape)
+                shape[dim] = size
+                return tensor.new_zeros(shape).index_copy_(dim, index, tensor)
+
+            with torch.no_grad():
+                parameter.data = resize(parameter.data)
+                parameter.grad = None
+
+            state = optimizer.state.get(parameter, {}) if optimizer is not None else {}
+            for key, value in state.items():
+                if torch.is_tensor(value) and value.shape == old_shape:
+                    state[key] = resize(value)
+
+    def _get_init_arguments(self):
+        """Get the arguments needed to create a copy of this model."""
+        raise NotImplementedError()
+
+    def _build_modules(self):
+        """Create the torch modules listed in ``_MODULES``, without training them."""
+        raise NotImplementedError()
+
+    def _get_module_states(self):
+        """Get a copy of the training state of the model.
+
+        It holds the weights of the ``_MODULES`` and the state of the
+        ``_TRAINING_MODULES`` which exist, like the optimizers.
+        """
+        return {
+            name: copy.deepcopy(getattr(self, name).state_dict())
+            for name in self._MODULES + self._TRAINING_MODULES
+            if getattr(self, name) is not None
+        }
+
+    def _set_module_states(self, states):
+        """Restore the training state returned by ``_get_module_states``."""
+        for name, state in states.items():
+            getattr(self, name).load_state_dict(state)
+
+    def _get_context_store(self):
+        """Get the context values seen during fit, loading them if needed."""
+        if self._stored_context is not None:
+            self._context_store = ContextStore.from_arrays(*self._stored_context)
+            self._stored_context = None
+
+        return self._context_store
+
+    def save(self, path):
+        """Store the fitted model in the given directory.
+
+        The directory contains a ``header.json`` file with the model arguments,
+        the columns and the index maps, a flat ``weights.npy`` array with the
+        weights of the networks and one ``.npy`` array per context column.
+
+        Args:
+            path (str):
+                Path to the output directory. It is replaced if it exists.
+        """
+        weights = []
+        modules = {}
+        offset = 0
+        for name in self._MODULES:
+            parameters = []
+            for key, tensor in getattr(self, name).state_dict().items():
+                values = tensor.detach().cpu().numpy().astype(np.float32).ravel()
+                parameters.append([key, offset, list(tensor.shape)])
+                weights.append(values)
+                offset += len(values)
+
+            modules[name] = parameters
+
+        context_store = self._get_context_store()
+        if context_store is None:
+            context_header, arrays = None, {}
+        else:
+            context_header, arrays = context_store.to_arrays()
+
+        arrays['weights'] = np.concatenate(weights) if weights else np.zeros(0, np.float32)
+        attribute_names = self._SCHEMA_ATTRIBUTES + self._ENCODING_ATTRIBUTES
+        model_class = type(self)
+        header = {
+            'class': '{}.{}'.format(model_class.__module__, model_class.__name__),
+            'init_arguments': self._get_init_arguments(),
+            'attributes': {name: getattr(self, name) for name in attribute_names},
+            'modules': modules,
+            'context': context_header,
+        }
+        storage.save(path, header, arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Load a model stored with ``save``.
+
+        The weights are memory-mapped and copied to the networks, and the context
+        values are only loaded the first time that they are needed to sample.
+
+        Args:
+            path (str):
+                Path to the directory.
+
+        Returns:
+            DeepEcho:
+                The loaded model, of the same class as the stored one.
+        """
+        header, arrays = storage.load(path)
+        module_name, class_name = header['class'].rsplit('.', 1)
+        model_class = getattr(importlib.import_module(module_name), class_name)
+        if not issubclass(model_class, cls):
+            raise TypeError('{} contains a {}, not a {}'.format(
+                path, model_class.__name__, cls.__name__))
+
+        model = model_class(**header['init_arguments'])
+        for name, value in header['attributes'].items():
+            setattr(model, name, value)
+
+        model._build_modules()
+        weights = arrays.pop('weights')
+        for name, parameters in header['modules'].items():
+            state_dict = {}
+            for key, offset, shape in parameters:
+                values = weights[offset:offset + int(np.prod(shape))].reshape(shape)
+                state_dict[key] = torch.from_numpy(values)
+
+            getattr(model, name).load_state_dict(state_dict)
+
+        if header['context'] is not None:
+            model._stored_context = (header['context'], arrays)
+
+        return model
 
     def sample_sequence(self, context, sequence_length=None):
         """Sample a single sequence conditioned on context.
@@ -189,7 +943,249 @@ class DeepEcho():
         """
         raise NotImplementedError()
 
-    def sample(self, num_entities=None, context=None, sequence_length=None):
+    def sample_sequences(self, contexts, sequence_lengths=None):
+        """Sample one sequence conditioned on each one of the given contexts.
+
+        The base implementation calls ``sample_sequence`` once per context.
+        Models that can sample several sequences at once should override it.
+
+        Args:
+            contexts (list[list] or numpy.ndarray):
+                The lists of values to condition on, one per sequence. They must
+                match the types specified in context_types when fit was called.
+            sequence_lengths (int, list[int] or None):
+                If given, force sequences to be of the indicated lengths, either one
+                for all the sequences or one per sequence. If ``None`` (default),
+                sample sequences of the same length as the original dataset.
+
+        Returns:
+            list[list[list]]:
+                One list of lists (data) per context, corresponding to the types
+                specified in data_types when fit was called.
+        """
+        sequence_lengths = self._broadcast_lengths(sequence_lengths, len(contexts))
+        return [
+            self.sample_sequence(list(context), sequence_length)
+            for context, sequence_length in zip(contexts, sequence_lengths)
+        ]
+
+    @staticmethod
+    def _broadcast_lengths(sequence_lengths, num_sequences):
+        """Get a list with the sequence length to sample for each sequence."""
+        if sequence_lengths is None or isinstance(sequence_lengths, (int, np.integer)):
+            return [sequence_lengths] * num_sequences
+
+        sequence_lengths = list(sequence_lengths)
+        if len(sequence_lengths) != num_sequences:
+            raise ValueError('Expected {} sequence lengths, got {}'.format(
+                num_sequences, len(sequence_lengths)))
+
+        return sequence_lengths
+
+    def _prepare_sample_context(self, context):
+        """Add the entity columns to the given context, if missing."""
+        context = context.reset_index(drop=True)
+        for column in self._entity_columns:
+            if column not in context:
+                context[column] = range(len(context))
+
+        return context
+
+    def _get_chunk_context(self, start, size, context, random_state):
+        """Get the context and entity values of the entities of a chunk.
+
+        If no context is given, it is sampled from the context values seen
+        during fit, and the entities get ids from ``start`` to ``start + size``.
+        """
+        if context is not None:
+            return context.iloc[start:start + size]
+
+        chunk = self._get_context_store().sample(size, random_state)
+        for column in self._entity_columns:
+            chunk[column] = range(start, start + size)
+
+        return chunk
+
+    def _sample_chunk(self, index, start, size, context, sequence_length, seed):
+        """Sample the entities of a chunk.
+
+        If a seed is given, the chunk is sampled with its own random state, derived
+        from the seed and the chunk index, so the output does not depend on which
+        chunks were sampled before, or in which process.
+        """
+        with self._instrumentation.stage('sample_chunk', chunk=index, num_entities=size):
+            if seed is None:
+                context = self._get_chunk_context(start, size, context, None)
+                return self._sample_batch(context, sequence_length)
+
+            torch_seed, numpy_seed = np.random.SeedSequence([seed, index]).generate_state(2)
+            with torch.random.fork_rng():
+                torch.manual_seed(int(torch_seed))
+                random_state = np.random.RandomState(numpy_seed)
+                context = self._get_chunk_context(start, size, context, random_state)
+                return self._sample_batch(context, sequence_length)
+
+    @staticmethod
+    def _get_chunk_tasks(num_entities, chunk_size, shard, num_shards):
+        """Split the entities in chunks and select the ones of the given shard.
+
+        Each shard gets a contiguous range of whole chunks, so the chunk positions,
+        and therefore their seeds, are the same as in a run without shards.
+
+        Returns:
+            list[tuple[int, int, int]]:
+                The index, first entity and number of entities of each chunk.
+        """
+        if not 0 <= shard < num_shards:
+            raise ValueError('`shard` must be between 0 and {}, got {}'.format(
+                num_shards - 1, shard))
+
+        num_chunks = -(-num_entities // chunk_size)
+        first_chunk = shard * num_chunks // num_shards
+        last_chunk = (shard + 1) * num_chunks // num_shards
+        return [
+            (index, index * chunk_size, min(chunk_size, num_entities - index * chunk_size))
+            for index in range(first_chunk, last_chunk)
+        ]
+
+    def _can_fork(self):
+        """Tell whether the sampling workers can be forked from this process.
+
+        Forking is not available on every platform, like Windows, and is not
+        safe once CUDA has been initialized, so in those cases the chunks are
+        sampled in this process.
+        """
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            return False
+
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            return False
+
+        for name in self._MODULES:
+            module = getattr(self, name, None)
+            if module is not None and any(param.is_cuda for param in module.parameters()):
+                return False
+
+        return True
+
+    def _iter_chunks(self, tasks, context, sequence_length, n_jobs, seed):
+        """Sample the given chunks of entities in order, using ``n_jobs`` processes.
+
+        If the workers cannot be forked, see ``_can_fork``, a single process is used.
+
+        Yields:
+            tuple[int, pandas.DataFrame]:
+                The number of entities in the chunk and their sampled data.
+        """
+        if n_jobs is not None and n_jobs < 0:
+            n_jobs = os.cpu_count()
+
+        if n_jobs is None or n_jobs <= 1 or not self._can_fork():
+            for task in tasks:
+                yield task[2], self._sample_chunk(*task, context, sequence_length, seed)
+
+            return
+
+        if seed is None:
+            # Otherwise all the workers would inherit the same random state
+            seed = np.random.randint(2 ** 32, dtype=np.uint64)
+
+        # Forked workers inherit the arguments, so the model weights are not pickled.
+        arguments = {
+            'model': self,
+            'context': context,
+            'sequence_length': sequence_length,
+            'seed': seed,
+        }
+        pool_context = multiprocessing.get_context('fork')
+        with pool_context.Pool(n_jobs, _init_sample_worker, (arguments, )) as pool:
+            chunks = pool.imap(_sample_worker_chunk, tasks)
+            for task, chunk in zip(tasks, chunks):
+                yield task[2], chunk
+
+    def _sample_batch(self, context, sequence_length):
+        """Sample the sequences of the given entities and build a DataFrame."""
+        contexts = context[self._context_columns].to_numpy()
+        with self._instrumentation.stage('sample_sequences', num_sequences=len(contexts)):
+            sequences = self.sample_sequences(contexts, sequence_length)
+
+        lengths = [len(sequence[0]) if sequence else 0 for sequence in sequences]
+
+        # Repeat the entity and context values of each entity once per row
+        rows = np.repeat(np.arange(len(context)), lengths)
+        output = {
+            column: context[column].to_numpy()[rows]
+            for column in self._entity_columns + self._context_columns
+        }
+        for index, column in enumerate(self._data_columns):
+            output[column] = list(itertools.chain.from_iterable(
+                sequence[index] for sequence in sequences
+            ))
+
+        return pd.DataFrame(output, columns=self._output_columns)
+
+    def sample_iter(self, num_entities=None, context=None, sequence_length=None,
+                    chunk_size=1000, n_jobs=None, seed=None, shard=0, num_shards=1):
+        """Sample time series data in chunks of entities.
+
+        The chunks are sampled one at a time, when requested, so the memory needed
+        does not depend on the total number of entities.
+
+        Args:
+            num_entities (int):
+                The number of entities to sample.
+            context (pd.DataFrame):
+                Context values to use when sampling.
+            sequence_length (int or None):
+                If given, force sequences to be of the indicated length.
+                If ``None`` (default), sample sequences of the same length
+                as the original dataset.
+            chunk_size (int):
+                Number of entities to sample in each chunk. Defaults to 1000.
+            n_jobs (int):
+                Number of processes to use to sample the chunks. If ``-1``, use all
+                the available CPUs. If ``None`` (default), use a single process.
+                The worker processes are forked, so a single process is used on
+                platforms without ``fork``, like Windows, or if the model uses CUDA.
+            seed (int):
+                If given, sample each chunk with a random state derived from this
+                seed and the chunk position, which makes the output reproducible
+                for the same ``chunk_size`` regardless of ``n_jobs``.
+            shard (int):
+                Index of the shard to sample, between 0 and ``num_shards - 1``.
+                Defaults to 0.
+            num_shards (int):
+                Number of shards in which the entities are split. Each shard only
+                samples a contiguous range of chunks of the entities, and given a
+                seed, the shards concatenated in order are the same as the output
+                of an unsharded run. Defaults to 1.
+
+        Yields:
+            pd.DataFrame:
+                The data of the next ``chunk_size`` entities, as returned by ``sample``.
+                Entity ids keep increasing across chunks.
+        """
+        if context is not None:
+            context = self._prepare_sample_context(context)
+            num_entities = len(context)
+        elif num_entities is None:
+            raise TypeError('Either context or num_entities must be not None')
+
+        tasks = self._get_chunk_tasks(num_entities, chunk_size, shard, num_shards)
+        if self._verbose:
+            progress_bar = tqdm.tqdm(total=sum(task[2] for task in tasks))
+
+        chunks = self._iter_chunks(tasks, context, sequence_length, n_jobs, seed)
+        for size, chunk in chunks:
+            yield chunk
+            if self._verbose:
+                progress_bar.update(size)
+
+        if self._verbose:
+            progress_bar.close()
+
+    def sample(self, num_entities=None, context=None, sequence_length=None, batch_size=1000,
+               n_jobs=None, seed=None, shard=0, num_shards=1):
         """Sample a dataframe containing time series data.
 
         Args:
@@ -201,6 +1197,26 @@ class DeepEcho():
                 If given, force sequences to be of the indicated length.
                 If ``None`` (default), sample sequences of the same length
                 as the original dataset.
+            batch_size (int):
+                Number of entities passed to ``sample_sequences`` at once.
+                Defaults to 1000.
+            n_jobs (int):
+                Number of processes to use to sample the batches. If ``-1``, use all
+                the available CPUs. If ``None`` (default), use a single process.
+                The worker processes are forked, so a single process is used on
+                platforms without ``fork``, like Windows, or if the model uses CUDA.
+            seed (int):
+                If given, sample each batch with a random state derived from this
+                seed and the batch position, which makes the output reproducible
+                for the same ``batch_size`` regardless of ``n_jobs``.
+            shard (int):
+                Index of the shard to sample, between 0 and ``num_shards - 1``.
+                Defaults to 0.
+            num_shards (int):
+                Number of shards in which the entities are split, in whole batches.
+                Each shard only samples its own entities, and given a seed, the
+                shards concatenated in order are the same as the output of an
+                unsharded run. Defaults to 1.
 
         Returns:
             pd.DataFrame:
@@ -210,44 +1226,171 @@ class DeepEcho():
                 columns containing the time series comes from the conditional
                 time series model.
         """
-        if context is None:
-            if num_entities is None:
-                raise TypeError('Either context or num_entities must be not None')
+        output = list(self.sample_iter(num_entities, context, sequence_length, batch_size,
+                                       n_jobs, seed, shard, num_shards))
+        if not output:
+            return pd.DataFrame(columns=self._output_columns)
 
-            context = self._context_values.sample(num_entities, replace=True)
-            context = context.reset_index(drop=True)
+        return pd.concat(output, ignore_index=True)
 
-        else:
-            num_entities = len(context)
-            context = context.copy()
+    def sample_to_parquet(self, path, num_entities=None, context=None, sequence_length=None,
+                          chunk_size=1000, n_jobs=None, seed=None, shard=0, num_shards=1):
+        """Sample time series data and write it to a Parquet file.
 
-        for column in self._entity_columns:
-            if column not in context:
-                context[column] = range(num_entities)
+        Each chunk of entities is written as a row group as soon as it is sampled,
+        so the memory needed does not depend on the total number of entities.
+        Numerical data columns are always written as floats, because they can hold
+        missing values in some chunks but not others. Columns which only have missing
+        values in the first chunk get the type of the values seen during fit. If
+        sampling or writing fails, the partially written file is removed. If no
+        entities are sampled, like in an empty shard, a file without rows is written.
+
+        Args:
+            path (str):
+                Path of the Parquet file to write.
+            num_entities (int):
+                The number of entities to sample.
+            context (pd.DataFrame):
+                Context values to use when sampling.
+            sequence_length (int or None):
+                If given, force sequences to be of the indicated length.
+                If ``None`` (default), sample sequences of the same length
+                as the original dataset.
+            chunk_size (int):
+                Number of entities to sample in each row group. Defaults to 1000.
+            n_jobs (int):
+                See ``sample_iter``.
+            seed (int):
+                See ``sample_iter``.
+            shard (int):
+                See ``sample_iter``.
+            num_shards (int):
+                See ``sample_iter``.
+        """
+        try:
+            # Imported here to fail before sampling, the chunks are written by
+            # ``_write_parquet_chunk``
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise ImportError(
+                'pyarrow is required to write Parquet files. Install it with '
+                '`pip install deepecho[arrow]`.'
+            )
 
-        # Set the entity_columns as index to properly iterate over them
-        if self._entity_columns:
-            context = context.set_index(self._entity_columns)
+        chunks = self.sample_iter(num_entities, context, sequence_length, chunk_size,
+                                  n_jobs, seed, shard, num_shards)
+        writer = None
+        try:
+            for chunk in chunks:
+                writer = self._write_parquet_chunk(writer, path, chunk)
 
-        if self._verbose:
-            iterator = tqdm.tqdm(context.iterrows(), total=num_entities)
+            if writer is None:
+                # No entities were sampled, so only the schema is written
+                writer = self._write_parquet_chunk(None, path, self._get_empty_output(context))
+
+        except BaseException:
+            if writer is not None:
+                writer.close()
+                writer = None
+                os.remove(path)
+
+            raise
+
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def _write_parquet_chunk(self, writer, path, chunk):
+        """Write a sampled chunk to a Parquet file, opening it for the first chunk.
+
+        Returns:
+            pyarrow.parquet.ParquetWriter:
+                The writer of the file.
+        """
+        import pyarrow
+        import pyarrow.parquet
+
+        for column in self._data_columns:
+            if chunk[column].dtype.kind in 'iuf':
+                chunk[column] = chunk[column].astype(np.float64)
+
+        if writer is None:
+            table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+            schema = self._get_parquet_schema(table.schema)
+            table = pyarrow.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            writer = pyarrow.parquet.ParquetWriter(path, table.schema)
         else:
-            iterator = context.iterrows()
+            table = pyarrow.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
 
-        output = pd.DataFrame()
-        for entity_values, context_values in iterator:
-            context_values = context_values.tolist()
-            sequence = self.sample_sequence(context_values, sequence_length)
+        writer.write_table(table)
+        return writer
 
-            # Reformat as a DataFrame
-            group = pd.DataFrame(
-                dict(zip(self._data_columns, sequence)),
-                columns=self._data_columns
-            )
-            group[self._entity_columns] = entity_values
-            for column, value in zip(self._context_columns, context_values):
-                group[column] = value
+    def _get_empty_output(self, context):
+        """Get a sampled DataFrame without rows, with the types of the given context."""
+        if context is None:
+            context_store = self._get_context_store()
+            if context_store is None:
+                context = pd.DataFrame(columns=self._context_columns, dtype=object)
+            else:
+                context = context_store.to_frame()
+
+        context = self._prepare_sample_context(context.iloc[:0])
+        output = {
+            column: context[column]
+            for column in self._entity_columns + self._context_columns
+        }
+        for column in self._data_columns:
+            output[column] = pd.Series([], dtype=object)
+
+        return pd.DataFrame(output, columns=self._output_columns)
+
+    def _get_data_categories(self, index):
+        """Get the categories of the categorical data column at the given index.
+
+        Args:
+            index (int):
+                Position of the column in the data columns.
+
+        Returns:
+            list:
+                The categories seen during fit, including ``None`` if the
+                column had missing values.
+        """
+        raise NotImplementedError()
+
+    def _get_parquet_schema(self, schema):
+        """Replace the ``null`` types of a schema with the types of the fitted columns.
+
+        The schema of the file is inferred from the first sampled chunk, in which a
+        column may only have missing values. The type of such a column is taken
+        from its data type or, for categorical columns, from its categories.
+        """
+        import pyarrow
+
+        fields = []
+        for field in schema:
+            if pyarrow.types.is_null(field.type):
+                values = []
+                if field.name in self._data_columns:
+                    index = self._data_columns.index(field.name)
+                    data_type = self._data_types[index]
+                    if data_type in ('continuous', 'count'):
+                        field = field.with_type(pyarrow.float64())
+                    elif data_type == 'datetime':
+                        field = field.with_type(pyarrow.timestamp('ns'))
+                    else:
+                        values = self._get_data_categories(index)
+
+                elif field.name in self._context_columns:
+                    context_store = self._get_context_store()
+                    if context_store is not None:
+                        index = context_store.columns.index(field.name)
+                        values = list(context_store.categories[index])
+
+                values = [value for value in values if not pd.isnull(value)]
+                if values:
+                    field = field.with_type(pyarrow.array(values).type)
 
-            output = output.append(group)
+            fields.append(field)
 
-        return output[self._output_columns].reset_index(drop=True)
+        return pyarrow.schema(fields)
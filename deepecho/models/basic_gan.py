@@ -7,7 +7,9 @@ import pandas as pd
 import torch
 from tqdm import tqdm
 
+from deepecho.callbacks import CallbackList
 from deepecho.models.base import DeepEcho
+from deepecho.sequences import SequenceBatch
 
 LOGGER = logging.getLogger(__name__)
 
@@ -149,6 +151,21 @@ class BasicGANModel(DeepEcho):
     _data_size = None
     _model_data_size = None
     _generator = None
+    _discriminator = None
+    _generator_opt = None
+    _discriminator_opt = None
+
+    _MODULES = ('_generator', )
+    _TRAINING_MODULES = ('_discriminator', '_generator_opt', '_discriminator_opt')
+    _ENCODING_ATTRIBUTES = (
+        '_max_sequence_length',
+        '_fixed_length',
+        '_context_map',
+        '_context_size',
+        '_data_map',
+        '_data_size',
+        '_model_data_size',
+    )
 
     def __init__(self, epochs=1024, latent_size=32, hidden_size=16,
                  gen_lr=1e-3, dis_lr=1e-3, cuda=True, verbose=True):
@@ -187,6 +204,17 @@ class BasicGANModel(DeepEcho):
             self._verbose,
         )
 
+    def _get_init_arguments(self):
+        return {
+            'epochs': self._epochs,
+            'latent_size': self._latent_size,
+            'hidden_size': self._hidden_size,
+            'gen_lr': self._gen_lr,
+            'dis_lr': self._dis_lr,
+            'cuda': str(self._device),
+            'verbose': self._verbose,
+        }
+
     # ########################### #
     # Preprocessing and preparing #
     # ########################### #
@@ -209,24 +237,35 @@ class BasicGANModel(DeepEcho):
               as information about whether the value should be NaN or not.
             - If the column is categorical or ordinal, 1 dimentions is created for
               each possible value, which will be later on used to hold one-hot encoding
-              information about the values.
+              information about the values. Missing values are one more category,
+              ``None``.
+
+        Args:
+            columns (list[deepecho.sequences.ColumnSummary]):
+                Statistics of each column.
+            types (list[str]):
+                Type of each column.
         """
         dimensions = 0
         mapping = {}
         for column, column_type in enumerate(types):
-            values = columns[column]
+            summary = columns[column]
             if column_type in ('continuous', 'count'):
                 mapping[column] = {
                     'type': column_type,
-                    'min': np.min(values),
-                    'max': np.max(values),
+                    'min': summary.min,
+                    'max': summary.max,
                     'indices': (dimensions, dimensions + 1)
                 }
                 dimensions += 2
 
             elif column_type in ('categorical', 'ordinal'):
+                categories = list(summary.categories)
+                if summary.nulls:
+                    categories.append(None)
+
                 indices = {}
-                for value in set(values):
+                for value in categories:
                     indices[value] = dimensions
                     dimensions += 1
 
@@ -240,7 +279,7 @@ class BasicGANModel(DeepEcho):
 
         return mapping, dimensions
 
-    def _analyze_data(self, sequences, context_types, data_types):
+    def _analyze_sequences(self, sequences, context_types, data_types):
         """Extract information about the context and data that will be used later.
 
         The following information is stored:
@@ -248,22 +287,12 @@ class BasicGANModel(DeepEcho):
             - Index map and dimensions for the context.
             - Index map and dimensions for the data.
         """
-        sequence_lengths = np.array([len(sequence['data'][0]) for sequence in sequences])
+        sequence_lengths = sequences.lengths
         self._max_sequence_length = np.max(sequence_lengths)
         self._fixed_length = (sequence_lengths == self._max_sequence_length).all()
 
-        # Concatenate all the context sequences together
-        context = []
-        for column in range(len(context_types)):
-            context.append([sequence['context'][column] for sequence in sequences])
-
+        context, data = sequences.summarize(context_types, data_types)
         self._context_map, self._context_size = self._index_map(context, context_types)
-
-        # Concatenate all the data sequences together
-        data = []
-        for column in range(len(data_types)):
-            data.append(sum([sequence['data'][column] for sequence in sequences], []))
-
         self._data_map, self._data_size = self._index_map(data, data_types)
 
         self._model_data_size = self._data_size + int(not self._fixed_length)
@@ -282,41 +311,15 @@ class BasicGANModel(DeepEcho):
             tensor[value_idx] = 2.0 * offset / column_range - 1.0
             tensor[missing_idx] = 0.0
 
-    @staticmethod
-    def _denormalize(tensor, row, properties, round_value):
-        """Denormalize previously normalized values, setting NaN values if necessary."""
-        value_idx, missing_idx = properties['indices']
-        if tensor[row, 0, missing_idx] > 0.5:
-            return None
-
-        normalized = tensor[row, 0, value_idx].item()
-        column_min = properties['min']
-        column_range = properties['max'] - column_min
-
-        denormalized = (normalized + 1) * column_range / 2.0 + column_min
-        if round_value:
-            denormalized = round(denormalized)
-
-        return denormalized
-
     @staticmethod
     def _one_hot_encode(tensor, value, properties):
         """Update the index that corresponds to the value to 1.0."""
+        if pd.isnull(value):
+            value = None
+
         value_index = properties['indices'][value]
         tensor[value_index] = 1.0
 
-    @staticmethod
-    def _one_hot_decode(tensor, row, properties):
-        """Obtain the category that corresponds to the highest one-hot value."""
-        max_value = float('-inf')
-        for category, idx in properties['indices'].items():
-            value = tensor[row, 0, idx]
-            if value > max_value:
-                max_value = value
-                selected = category
-
-        return selected
-
     def _value_to_tensor(self, tensor, value, properties):
         """Update the tensor according to the value and properties."""
         column_type = properties['type']
@@ -361,35 +364,46 @@ class BasicGANModel(DeepEcho):
 
         return tensor
 
-    def _tensor_to_data(self, tensor):
-        """Rebuild a valid sequence from the given tensor."""
-        sequence_length, num_sequences, _ = tensor.shape
-        assert num_sequences == 1
+    def _tensor_to_columns(self, tensor):
+        """Rebuild the values of each column from the given tensor.
 
-        data = [None] * len(self._data_map)
+        Returns:
+            list[numpy.ndarray]:
+                One array of shape ``(sequence_length, num_sequences)`` per column.
+        """
+        tensor = tensor.cpu().numpy().astype(np.float64)
+        columns = [None] * len(self._data_map)
         for column, properties in self._data_map.items():
             column_type = properties['type']
+            if column_type in ('continuous', 'count'):
+                value_idx, missing_idx = properties['indices']
+                column_min = properties['min']
+                column_range = properties['max'] - column_min
+                values = (tensor[:, :, value_idx] + 1) * column_range / 2.0 + column_min
+                if column_type == 'count':
+                    values = np.round(values).astype(np.int64)
 
-            column_data = []
-            data[column] = column_data
-            for row in range(sequence_length):
-                if column_type in ('continuous', 'count'):
-                    round_value = column_type == 'count'
-                    value = self._denormalize(tensor, row, properties, round_value=round_value)
-                elif column_type in ('categorical', 'ordinal'):
-                    value = self._one_hot_decode(tensor, row, properties)
-                else:
-                    raise ValueError()   # Theoretically unreachable
+                values = values.astype(object)
+                values[tensor[:, :, missing_idx] > 0.5] = None
 
-                column_data.append(value)
+            elif column_type in ('categorical', 'ordinal'):
+                categories = np.empty(len(properties['indices']), dtype=object)
+                categories[:] = list(properties['indices'].keys())
+                selected = tensor[:, :, list(properties['indices'].values())].argmax(axis=2)
+                values = categories[selected]
 
-        return data
+            else:
+                raise ValueError()   # Theoretically unreachable
+
+            columns[column] = values
 
-    def _build_tensor(self, transform, sequences, key, dim):
-        """Convert input sequences to tensors."""
+        return columns
+
+    def _build_tensor(self, transform, values, dim):
+        """Convert the values of each input sequence to tensors."""
         tensors = []
-        for sequence in sequences:
-            tensors.append(transform(sequence[key]))
+        for sequence_values in values:
+            tensors.append(transform(sequence_values))
 
         return torch.stack(tensors, dim=dim).to(self._device)
 
@@ -463,7 +477,7 @@ class BasicGANModel(DeepEcho):
 
         return generator_score
 
-    def _build_fit_artifacts(self):
+    def _build_modules(self):
         self._generator = BasicGenerator(
             context_size=self._context_size,
             latent_size=self._latent_size,
@@ -472,18 +486,24 @@ class BasicGANModel(DeepEcho):
             device=self._device,
         ).to(self._device)
 
-        discriminator = BasicDiscriminator(
-            context_size=self._context_size,
-            data_size=self._model_data_size,
-            hidden_size=self._hidden_size,
-        ).to(self._device)
-
-        generator_opt = torch.optim.Adam(self._generator.parameters(), lr=self._gen_lr)
-        discriminator_opt = torch.optim.Adam(discriminator.parameters(), lr=self._dis_lr)
-
-        return discriminator, generator_opt, discriminator_opt
-
-    def fit_sequences(self, sequences, context_types, data_types):
+    def _build_fit_artifacts(self):
+        """Create the discriminator and the optimizers of both networks, if missing."""
+        if self._discriminator is None:
+            self._discriminator = BasicDiscriminator(
+                context_size=self._context_size,
+                data_size=self._model_data_size,
+                hidden_size=self._hidden_size,
+            ).to(self._device)
+
+        if self._generator_opt is None:
+            self._generator_opt = torch.optim.Adam(
+                self._generator.parameters(), lr=self._gen_lr)
+
+        if self._discriminator_opt is None:
+            self._discriminator_opt = torch.optim.Adam(
+                self._discriminator.parameters(), lr=self._dis_lr)
+
+    def fit_sequences(self, sequences, context_types, data_types, callbacks=None):
         """Fit a model to the specified sequences.
 
         Args:
@@ -509,6 +529,8 @@ class BasicGANModel(DeepEcho):
                 to the actual time series data such that `data[i][j]` contains
                 the value at the jth time step of the ith channel of the
                 multivariate time series.
+
+                Sequences can also be given as a ``deepecho.sequences.SequenceBatch``.
             context_types:
                 List of strings indicating the type of each value in context.
                 he value at `context[i]` must match the type specified by
@@ -518,38 +540,226 @@ class BasicGANModel(DeepEcho):
                 List of strings indicating the type of each channel in data.
                 Each value in the list at data[i] must match the type specified by
                 `data_types[i]`. The valid types are the same as for `context_types`.
+            callbacks (list[deepecho.callbacks.Callback]):
+                Callbacks notified during the training, which can stop it early.
         """
-        self._analyze_data(sequences, context_types, data_types)
+        arrays = self._encode_sequences(sequences, context_types, data_types)
+        self._fit_encoded(arrays, callbacks)
 
-        data = self._build_tensor(self._data_to_tensor, sequences, 'data', dim=1)
-        context = self._build_tensor(self._context_to_tensor, sequences, 'context', dim=0)
-        data_context = _expand_context(data, context)
+    def _encode_sequences(self, sequences, context_types, data_types):
+        """Analyze the sequences and encode them as arrays.
 
-        discriminator, generator_opt, discriminator_opt = self._build_fit_artifacts()
+        Returns:
+            dict[str, numpy.ndarray]:
+                The padded ``data`` tensor, of shape ``(max_sequence_length,
+                num_sequences, model_data_size)``, and the ``context`` tensor,
+                of shape ``(num_sequences, context_size)``.
+        """
+        sequences = SequenceBatch.from_sequences(sequences)
+        with self._instrumentation.stage('analyze'):
+            self._analyze_sequences(sequences, context_types, data_types)
+
+        return self._encode_batch(sequences)
+
+    def _encode_batch(self, sequences):
+        """Encode the sequences with the current index maps."""
+        sequence_data = (sequences.get_data(i) for i in range(len(sequences)))
+        with self._instrumentation.stage('encode', num_sequences=len(sequences)):
+            data = self._build_tensor(self._data_to_tensor, sequence_data, dim=1)
+            context = self._build_tensor(self._context_to_tensor, sequences.context, dim=0)
+
+        return {
+            'data': data.cpu().numpy(),
+            'context': context.cpu().numpy(),
+        }
+
+    def _to_tensors(self, arrays):
+        """Convert the encoded sequences to the tensors used in ``_train``."""
+        data = torch.from_numpy(np.asarray(arrays['data'])).to(self._device)
+        context = torch.from_numpy(np.asarray(arrays['context'])).to(self._device)
+
+        return _expand_context(data, context), context
+
+    def _fit_batches(self, batches, callbacks=None):
+        self._build_modules()
+        self._discriminator = None
+        self._generator_opt = None
+        self._discriminator_opt = None
+        self._build_fit_artifacts()
+        self._train(batches, self._epochs, callbacks)
+
+    def _train(self, batches, epochs, callbacks=None):
+        """Train the networks for the given epochs.
 
-        iterator = range(self._epochs)
+        Args:
+            batches (callable):
+                Function that gives the batches of an epoch. See ``DeepEcho._train``.
+            epochs (int):
+                Number of epochs.
+            callbacks (list[deepecho.callbacks.Callback]):
+                See ``fit_sequences``.
+        """
+        iterator = range(epochs)
         if self._verbose:
             iterator = tqdm(iterator)
 
-        for epoch in iterator:
-            discriminator_score = self._discriminator_step(
-                discriminator=discriminator,
-                discriminator_opt=discriminator_opt,
-                data_context=data_context,
-                context=context,
-            )
-            generator_score = self._generator_step(
-                discriminator=discriminator,
-                generator_opt=generator_opt,
-                context=context,
-            )
-
-            if self._verbose:
-                iterator.set_description(
-                    'Epoch {} | D Loss {} | G Loss {}'.format(
-                        epoch + 1, discriminator_score.item(), generator_score.item()
+        instrumentation = self._instrumentation
+        callbacks = CallbackList(callbacks)
+        callbacks.on_train_begin(self)
+        with instrumentation.stage('train', epochs=epochs):
+            for epoch in iterator:
+                with instrumentation.stage('epoch', epoch=epoch) as stage:
+                    distances = []
+                    for (data_context, context), last in batches():
+                        discriminator_score = self._discriminator_step(
+                            discriminator=self._discriminator,
+                            discriminator_opt=self._discriminator_opt,
+                            data_context=data_context,
+                            context=context,
+                        )
+                        distances.append(-discriminator_score.detach())
+
+                        # The estimate of the Wasserstein distance, made before the
+                        # generator step so that the weights of the generator match it
+                        stop = False
+                        if last and callbacks:
+                            distance = torch.stack(distances).mean()
+                            stop = callbacks.on_epoch_end(self, epoch, distance)
+
+                        generator_score = self._generator_step(
+                            discriminator=self._discriminator,
+                            generator_opt=self._generator_opt,
+                            context=context,
+                        )
+
+                    stage.update(discriminator_loss=discriminator_score,
+                                 generator_loss=generator_score)
+
+                if self._verbose:
+                    iterator.set_description(
+                        'Epoch {} | D Loss {} | G Loss {}'.format(
+                            epoch + 1, discriminator_score.item(), generator_score.item()
+                        )
                     )
-                )
+
+                if stop:
+                    break
+
+        callbacks.on_train_end(self)
+
+    def _get_data_categories(self, index):
+        return list(self._data_map[index]['indices'])
+
+    @staticmethod
+    def _new_categories(mapping, values):
+        """Get the categories of each categorical column which are not in the mapping."""
+        return {
+            column: [
+                category for category in set(None if pd.isnull(v) else v for v in values[column])
+                if category not in properties['indices']
+            ]
+            for column, properties in mapping.items()
+            if properties['type'] in ('categorical', 'ordinal')
+        }
+
+    def _partial_fit_sequences(self, sequences, epochs, callbacks):
+        sequences = SequenceBatch.from_sequences(sequences)
+        lengths = sequences.lengths
+        # Compare with the length seen so far, before widening it
+        fixed_length = self._fixed_length and (lengths == self._max_sequence_length).all()
+        self._max_sequence_length = max(self._max_sequence_length, int(lengths.max()))
+
+        data = [sequences.get_values(i) for i in range(len(sequences.data))]
+        contexts = [sequences.context[:, i] for i in range(sequences.context.shape[1])]
+        data_positions, model_data_size = self._extend_index_map(
+            self._data_map, self._model_data_size, self._new_categories(self._data_map, data))
+        context_positions, context_size = self._extend_index_map(
+            self._context_map, self._context_size,
+            self._new_categories(self._context_map, contexts)
+        )
+        self._data_size = model_data_size - int(not self._fixed_length)
+        if self._fixed_length and not fixed_length:
+            # Add the end flag after the data dimensions
+            model_data_size += 1
+            self._fixed_length = False
+
+        self._build_fit_artifacts()
+
+        # The generator gets the noise followed by the context, and the
+        # discriminator gets the data followed by the context
+        latent_positions = np.arange(self._latent_size)
+        self._resize_parameters(self._generator, self._generator_opt, {
+            'rnn.weight_ih_l0': (
+                1,
+                np.concatenate([latent_positions, self._latent_size + context_positions]),
+                self._latent_size + context_size,
+            ),
+            'linear.weight': (0, data_positions, model_data_size),
+            'linear.bias': (0, data_positions, model_data_size),
+        })
+        self._resize_parameters(self._discriminator, self._discriminator_opt, {
+            'rnn.weight_ih_l0': (
+                1,
+                np.concatenate([data_positions, model_data_size + context_positions]),
+                model_data_size + context_size,
+            ),
+        })
+        self._generator.rnn.input_size = self._latent_size + context_size
+        self._generator.linear.out_features = model_data_size
+        self._discriminator.rnn.input_size = model_data_size + context_size
+        self._model_data_size = model_data_size
+        self._context_size = context_size
+
+        batches = self._full_batch(self._to_tensors(self._encode_batch(sequences)))
+        if epochs is None:
+            epochs = self._epochs
+
+        self._train(batches, epochs, callbacks)
+
+    def sample_sequences(self, contexts, sequence_lengths=None):
+        """Sample one sequence conditioned on each one of the given contexts.
+
+        All the sequences are generated at once, with the length of the
+        longest one, and then cut to their own length.
+
+        Args:
+            contexts (list[list] or numpy.ndarray):
+                The lists of values to condition on, one per sequence. They must
+                match the types specified in context_types when fit was called.
+            sequence_lengths (int, list[int] or None):
+                If given, force sequences to be of the indicated lengths, either one
+                for all the sequences or one per sequence. If ``None`` (default),
+                sample sequences of the same length as the original dataset.
+
+        Returns:
+            list[list[list]]:
+                One list of lists (data) per context, corresponding to the types
+                specified in data_types when fit was called.
+        """
+        num_sequences = len(contexts)
+        sequence_lengths = self._broadcast_lengths(sequence_lengths, num_sequences)
+        lengths = np.array([
+            self._max_sequence_length if length is None else length
+            for length in sequence_lengths
+        ], dtype=np.int64)
+
+        context = self._build_tensor(self._context_to_tensor, contexts, dim=0)
+        with torch.no_grad():
+            generated = self._generate(context, int(lengths.max()))
+
+        if not self._fixed_length:
+            # Cut the sequences of unspecified length where the end flag is set
+            end_flag = generated[:, :, -1].cpu().numpy() == 1.0
+            to_cut = end_flag.any(axis=0) & np.array([
+                length is None for length in sequence_lengths
+            ])
+            lengths[to_cut] = end_flag.argmax(axis=0)[to_cut]
+
+        columns = self._tensor_to_columns(generated)
+        return [
+            [values[:length, index].tolist() for values in columns]
+            for index, length in enumerate(lengths)
+        ]
 
     def sample_sequence(self, context, sequence_length=None):
         """Sample a single sequence conditioned on context.
@@ -564,14 +774,4 @@ class BasicGANModel(DeepEcho):
                 A list of lists (data) corresponding to the types specified
                 in data_types when fit was called.
         """
-        context = self._context_to_tensor(context).unsqueeze(0).to(self._device)
-
-        with torch.no_grad():
-            generated = self._generate(context, sequence_length)
-            if sequence_length is None:
-                end_flag = generated[:, 0, -1]
-                if (end_flag == 1.0).any():
-                    cut_index = end_flag.cpu().numpy().argmax()
-                    generated = generated[:cut_index, :, :]
-
-            return self._tensor_to_data(generated)
+        return self.sample_sequences([context], sequence_length)[0]
@@ -7,7 +7,9 @@ import pandas as pd
 import torch
 from tqdm import tqdm
 
+from deepecho.callbacks import CallbackList
 from deepecho.models.base import DeepEcho
+from deepecho.sequences import SequenceBatch
 
 LOGGER = logging.getLogger(__name__)
 
@@ -52,6 +54,33 @@ class PARNet(torch.nn.Module):
 
         return x
 
+    def step(self, x, c, hidden=None):
+        """Compute the output of the next timestep of a batch of sequences.
+
+        Only the given timestep is processed, and the state of the recurrent
+        layer is carried from the previous call, so computing a whole sequence
+        step by step gives the same output as ``forward``.
+
+        Args:
+            x (torch.Tensor):
+                Input of the timestep, of shape ``(1, num_sequences, data_size)``.
+            c (torch.Tensor):
+                Context of each sequence, of shape ``(num_sequences, context_size)``.
+            hidden (torch.Tensor):
+                Hidden state returned by the previous step. ``None`` for the
+                first timestep.
+
+        Returns:
+            tuple[torch.Tensor, torch.Tensor]:
+                The output of the timestep, with the same shape as ``x``, and
+                the hidden state to pass to the next step.
+        """
+        if self.context_size:
+            x = torch.cat([x, c.unsqueeze(0)], dim=2)
+
+        x, hidden = self.rnn(self.down(x), hidden)
+        return self.up(x), hidden
+
 
 class PARModel(DeepEcho):
     """Probabilistic autoregressive model.
@@ -90,11 +119,33 @@ class PARModel(DeepEcho):
             Defaults to ``True``.
         verbose (bool):
             Whether to print progress to console or not.
+        batch_size (int):
+            If given, train on shuffled mini-batches of this number of sequences,
+            taking one optimization step per mini-batch, instead of one step per
+            epoch over all the sequences. The sequences of each mini-batch have
+            similar lengths, so that little padding is needed. Defaults to ``None``.
     """
 
-    def __init__(self, epochs=128, sample_size=1, cuda=True, verbose=True):
+    _BUCKET_BY_LENGTH = True
+    _ENCODING_ATTRIBUTES = (
+        '_fixed_length',
+        '_min_length',
+        '_max_length',
+        '_ctx_map',
+        '_ctx_dims',
+        '_data_map',
+        '_data_dims',
+    )
+
+    _MODULES = ('_model', )
+    _TRAINING_MODULES = ('_optimizer', )
+    _model = None
+    _optimizer = None
+
+    def __init__(self, epochs=128, sample_size=1, cuda=True, verbose=True, batch_size=None):
         self.epochs = epochs
         self.sample_size = sample_size
+        self.batch_size = batch_size
 
         if not cuda or not torch.cuda.is_available():
             device = 'cpu'
@@ -111,24 +162,38 @@ class PARModel(DeepEcho):
             print(self, 'instance created')
 
     def __repr__(self):
-        return "{}(epochs={}, sample_size={}, cuda='{}', verbose={})".format(
+        return "{}(epochs={}, sample_size={}, cuda='{}', verbose={}, batch_size={})".format(
             self.__class__.__name__,
             self.epochs,
             self.sample_size,
             self.device,
             self.verbose,
+            self.batch_size,
         )
 
+    def _get_init_arguments(self):
+        return {
+            'epochs': self.epochs,
+            'sample_size': self.sample_size,
+            'cuda': str(self.device),
+            'verbose': self.verbose,
+            'batch_size': self.batch_size,
+        }
+
+    def _build_modules(self):
+        self._model = PARNet(self._data_dims, self._ctx_dims).to(self.device)
+
     def _idx_map(self, x, t):
+        """Build the index map of the columns from their ``ColumnSummary`` objects."""
         idx = 0
         idx_map = {}
         for i, t in enumerate(t):
             if t == 'continuous' or t == 'datetime':
                 idx_map[i] = {
                     'type': t,
-                    'mu': np.nanmean(x[i]),
-                    'std': np.nanstd(x[i]),
-                    'nulls': pd.isnull(x[i]).any(),
+                    'mu': x[i].mean,
+                    'std': x[i].std,
+                    'nulls': x[i].nulls,
                     'indices': (idx, idx + 1, idx + 2)
                 }
                 idx += 3
@@ -136,9 +201,9 @@ class PARModel(DeepEcho):
             elif t == 'count':
                 idx_map[i] = {
                     'type': t,
-                    'min': np.nanmin(x[i]),
-                    'range': np.nanmax(x[i]) - np.nanmin(x[i]),
-                    'nulls': pd.isnull(x[i]).any(),
+                    'min': x[i].min,
+                    'range': x[i].max - x[i].min,
+                    'nulls': x[i].nulls,
                     'indices': (idx, idx + 1, idx + 2)
                 }
                 idx += 3
@@ -149,10 +214,11 @@ class PARModel(DeepEcho):
                     'indices': {}
                 }
                 idx += 1
-                for v in set(x[i]):
-                    if pd.isnull(v):
-                        v = None
+                categories = list(x[i].categories)
+                if x[i].nulls:
+                    categories.append(None)
 
+                for v in categories:
                     idx_map[i]['indices'][v] = idx
                     idx += 1
 
@@ -161,27 +227,16 @@ class PARModel(DeepEcho):
 
         return idx_map, idx
 
-    def _build(self, sequences, context_types, data_types):
-        contexts = [[] for _ in range(len(context_types))]
-        data = [[] for _ in range(len(data_types))]
-        min_length = np.inf
-        max_length = -np.inf
-        for sequence in sequences:
-            sequence_data = sequence['data']
-            sequence_context = sequence['context']
-            sequence_length = len(sequence_data[0])
-            min_length = min(min_length, sequence_length)
-            max_length = max(max_length, sequence_length)
-
-            for i in range(len(context_types)):
-                contexts[i].append(sequence_context[i])
-            for i in range(len(data_types)):
-                data[i].extend(sequence_data[i])
-
+    def _analyze_sequences(self, sequences, context_types, data_types):
+        lengths = sequences.lengths
+        min_length = int(lengths.min())
+        max_length = int(lengths.max())
         self._fixed_length = min_length == max_length
         self._min_length = min_length
         self._max_length = max_length
 
+        contexts, data = sequences.summarize(context_types, data_types)
+
         self._ctx_map, self._ctx_dims = self._idx_map(contexts, context_types)
         self._data_map, self._data_dims = self._idx_map(data, data_types)
         self._data_map['<TOKEN>'] = {
@@ -194,83 +249,101 @@ class PARModel(DeepEcho):
         }
         self._data_dims += 3
 
-    def _data_to_tensor(self, data):
-        seq_len = len(data[0])
-        X = []
+    @staticmethod
+    def _to_numbers(values):
+        """Convert values without missing ones to ``float64``, datetimes to nanoseconds."""
+        values = np.asarray(values)
+        if values.dtype.kind in 'mM':
+            values = values.view(np.int64)
 
-        x = torch.zeros(self._data_dims)
-        x[self._data_map['<TOKEN>']['indices']['<START>']] = 1.0
-        X.append(x)
+        return values.astype(np.float64)
 
-        for i in range(seq_len):
-            x = torch.zeros(self._data_dims)
-            for key, props in self._data_map.items():
-                if key == '<TOKEN>':
-                    x[self._data_map['<TOKEN>']['indices']['<BODY>']] = 1.0
+    def _encode_columns(self, columns, mapping, num_dims, num_values):
+        """Encode the values of all the columns at once.
 
-                elif props['type'] in ['continuous', 'timestamp']:
-                    mu_idx, sigma_idx, missing_idx = props['indices']
-                    x[mu_idx] = 0.0 if (data[key][i] is None or props['std'] == 0) else (
-                        data[key][i] - props['mu']) / props['std']
-                    x[sigma_idx] = 0.0
-                    x[missing_idx] = 1.0 if data[key][i] is None else 0.0
+        Numerical values are normalized and flagged when missing, and categorical
+        values are one-hot encoded using their integer codes.
 
-                elif props['type'] in ['count']:
-                    r_idx, p_idx, missing_idx = props['indices']
-                    x[r_idx] = 0.0 if (data[key][i] is None or props['range'] == 0) else (
-                        data[key][i] - props['min']) / props['range']
-                    x[p_idx] = 0.0
-                    x[missing_idx] = 1.0 if data[key][i] is None else 0.0
+        Args:
+            columns (list):
+                The values of each column, all of them of length ``num_values``.
+            mapping (dict):
+                Index map of the columns.
+            num_dims (int):
+                Number of dimensions of the encoded values.
+            num_values (int):
+                Number of values of each column.
 
-                elif props['type'] in ['categorical', 'ordinal']:   # categorical
-                    value = data[key][i]
-                    if pd.isnull(value):
-                        value = None
-                    x[props['indices'][value]] = 1.0
+        Returns:
+            numpy.ndarray:
+                Array of shape ``(num_values, num_dims)``.
+        """
+        encoded = np.zeros((num_values, num_dims), dtype=np.float32)
+        for key, props in mapping.items():
+            if key == '<TOKEN>':
+                continue
 
+            values = columns[key]
+            if props['type'] in ['continuous', 'datetime', 'timestamp', 'count']:
+                if props['type'] == 'count':
+                    offset, scale = props['min'], props['range']
                 else:
-                    raise ValueError()
+                    offset, scale = props['mu'], props['std']
 
-            X.append(x)
+                value_idx, _, missing_idx = props['indices']
+                nulls = pd.isnull(values)
+                if scale != 0:
+                    numbers = self._to_numbers(values[~nulls])
+                    encoded[~nulls, value_idx] = (numbers - offset) / scale
 
-        x = torch.zeros(self._data_dims)
-        x[self._data_map['<TOKEN>']['indices']['<END>']] = 1.0
-        X.append(x)
+                encoded[:, missing_idx] = nulls
 
-        return torch.stack(X, dim=0).to(self.device)
+            elif props['type'] in ['categorical', 'ordinal']:
+                # Missing values have code -1, which points to the last dimension
+                codes, categories = pd.factorize(values)
+                dims = [props['indices'][value] for value in categories]
+                if (codes < 0).any():
+                    dims.append(props['indices'][None])
 
-    def _context_to_tensor(self, context):
-        if not self._ctx_dims:
-            return None
+                encoded[np.arange(num_values), np.array(dims, dtype=np.int64)[codes]] = 1.0
 
-        x = torch.zeros(self._ctx_dims)
-        for key, props in self._ctx_map.items():
-            if props['type'] in ['continuous', 'datetime']:
-                mu_idx, sigma_idx, missing_idx = props['indices']
-                x[mu_idx] = 0.0 if (pd.isnull(context[key]) or props['std'] == 0) else (
-                    context[key] - props['mu']) / props['std']
-                x[sigma_idx] = 0.0
-                x[missing_idx] = 1.0 if pd.isnull(context[key]) else 0.0
+            else:
+                raise ValueError('Unsupported type: {}'.format(props['type']))
 
-            elif props['type'] in ['count']:
-                r_idx, p_idx, missing_idx = props['indices']
-                x[r_idx] = 0.0 if (pd.isnull(context[key]) or props['range'] == 0) else (
-                    context[key] - props['min']) / props['range']
-                x[p_idx] = 0.0
-                x[missing_idx] = 1.0 if pd.isnull(context[key]) else 0.0
+        return encoded
 
-            elif props['type'] in ['categorical', 'ordinal']:
-                value = context[key]
-                if pd.isnull(value):
-                    value = None
-                x[props['indices'][value]] = 1.0
+    def _encode_data(self, sequences):
+        """Encode the data of the sequences, adding the start and end rows of each one.
 
-            else:
-                raise ValueError()
+        Returns:
+            numpy.ndarray:
+                The encoded rows of all the sequences, one after another.
+        """
+        lengths = sequences.lengths
+        num_values = int(lengths.sum())
+        columns = [sequences.get_values(column) for column in range(len(sequences.data))]
+        body = self._encode_columns(columns, self._data_map, self._data_dims, num_values)
+        tokens = self._data_map['<TOKEN>']['indices']
+        body[:, tokens['<BODY>']] = 1.0
+
+        ends = np.cumsum(lengths + 2)
+        data = np.zeros((ends[-1] if len(ends) else 0, self._data_dims), dtype=np.float32)
+        data[ends - lengths - 2, tokens['<START>']] = 1.0
+        data[ends - 1, tokens['<END>']] = 1.0
+
+        # Value j of sequence i goes after the start and end rows of the previous
+        # sequences and its own start row
+        sequence_ids = np.repeat(np.arange(len(lengths)), lengths)
+        data[np.arange(num_values) + 2 * sequence_ids + 1] = body
+
+        return data
 
-        return x.to(self.device)
+    def _encode_context(self, context):
+        """Encode a matrix of context values, with one row per sequence."""
+        columns = [context[:, column] for column in range(context.shape[1])]
+        return self._encode_columns(columns, self._ctx_map, self._ctx_dims, len(context))
 
-    def fit_sequences(self, sequences, context_types, data_types):
+    def fit_sequences(self, sequences, context_types, data_types, callbacks=None):
         """Fit a model to the specified sequences.
 
         Args:
@@ -296,6 +369,8 @@ class PARModel(DeepEcho):
                 to the actual time series data such that `data[i][j]` contains
                 the value at the jth time step of the ith channel of the
                 multivariate time series.
+
+                Sequences can also be given as a ``deepecho.sequences.SequenceBatch``.
             context_types (list):
                 List of strings indicating the type of each value in context.
                 he value at `context[i]` must match the type specified by
@@ -305,36 +380,196 @@ class PARModel(DeepEcho):
                 List of strings indicating the type of each channel in data.
                 Each value in the list at data[i] must match the type specified by
                 `data_types[i]`. The valid types are the same as for `context_types`.
+            callbacks (list[deepecho.callbacks.Callback]):
+                Callbacks notified during the training, which can stop it early.
         """
-        X, C = [], []
-        self._build(sequences, context_types, data_types)
-        for sequence in sequences:
-            X.append(self._data_to_tensor(sequence['data']))
-            C.append(self._context_to_tensor(sequence['context']))
+        arrays = self._encode_sequences(sequences, context_types, data_types)
+        self._fit_encoded(arrays, callbacks)
+
+    def _encode_sequences(self, sequences, context_types, data_types):
+        """Analyze the sequences and encode them as arrays.
+
+        Returns:
+            dict[str, numpy.ndarray]:
+                The encoded ``data`` of all the sequences, concatenated along the
+                first axis, the ``lengths`` of the encoded sequences and the
+                encoded ``context`` of each sequence.
+        """
+        sequences = SequenceBatch.from_sequences(sequences)
+        with self._instrumentation.stage('analyze'):
+            self._analyze_sequences(sequences, context_types, data_types)
+
+        return self._encode_batch(sequences)
+
+    def _encode_batch(self, sequences):
+        """Encode the sequences with the current index maps."""
+        with self._instrumentation.stage('encode', num_sequences=len(sequences)):
+            data = self._encode_data(sequences)
+            context = self._encode_context(sequences.context)
+
+        return {
+            'data': data,
+            'lengths': sequences.lengths + 2,
+            'context': context,
+        }
 
+    def _to_tensors(self, arrays):
+        """Convert the encoded sequences to the tensors used in ``_train``."""
+        data = torch.from_numpy(np.asarray(arrays['data']))
+        X = list(torch.split(data, arrays['lengths'].tolist()))
         X = torch.nn.utils.rnn.pack_sequence(X, enforce_sorted=False).to(self.device)
-        if self._ctx_dims:
-            C = torch.stack(C, dim=0).to(self.device)
+        C = torch.from_numpy(np.asarray(arrays['context'])).to(self.device)
+        X_padded, seq_len = torch.nn.utils.rnn.pad_packed_sequence(X)
 
-        self._model = PARNet(self._data_dims, self._ctx_dims).to(self.device)
-        optimizer = torch.optim.Adam(self._model.parameters(), lr=1e-3)
+        return X, C, X_padded, seq_len
 
-        iterator = range(self.epochs)
-        if self.verbose:
-            iterator = tqdm(iterator)
+    def _batches(self, arrays):
+        """Get the batches of the encoded sequences for ``_train``.
 
-        X_padded, seq_len = torch.nn.utils.rnn.pad_packed_sequence(X)
-        for epoch in iterator:
-            Y = self._model(X, C)
-            Y_padded, _ = torch.nn.utils.rnn.pad_packed_sequence(Y)
+        Without a ``batch_size``, all the sequences form a single batch. Otherwise,
+        the rows of each mini-batch are gathered from the arrays when it is needed.
+        """
+        lengths = np.asarray(arrays['lengths'])
+        if self.batch_size is None or len(lengths) <= self.batch_size:
+            return self._full_batch(self._to_tensors(arrays))
+
+        starts = np.cumsum(lengths) - lengths
+
+        def batches():
+            indices = self._batch_indices(lengths, self.batch_size)
+            for number, batch in enumerate(indices):
+                batch_lengths = lengths[batch]
+                offsets = np.cumsum(batch_lengths) - batch_lengths
+                rows = np.arange(batch_lengths.sum()) + np.repeat(
+                    starts[batch] - offsets, batch_lengths)
+                batch_arrays = {
+                    'data': arrays['data'][rows],
+                    'lengths': batch_lengths,
+                    'context': arrays['context'][batch],
+                }
+                yield self._to_tensors(batch_arrays), number == len(indices) - 1
+
+        return batches
+
+    def _fit_encoded(self, arrays, callbacks=None):
+        self._fit_batches(self._batches(arrays), callbacks)
+
+    def _fit_batches(self, batches, callbacks=None):
+        self._build_modules()
+        self._optimizer = torch.optim.Adam(self._model.parameters(), lr=1e-3)
+        self._train(batches, self.epochs, callbacks)
 
-            optimizer.zero_grad()
-            loss = self._compute_loss(X_padded[1:, :, :], Y_padded[:-1, :, :], seq_len)
-            loss.backward()
-            if self.verbose:
-                iterator.set_description('Epoch {} | Loss {}'.format(epoch + 1, loss.item()))
+    def _train(self, batches, epochs, callbacks=None):
+        """Train the network for the given epochs.
+
+        Args:
+            batches (callable):
+                Function that gives the batches of an epoch. See ``DeepEcho._train``.
+            epochs (int):
+                Number of epochs.
+            callbacks (list[deepecho.callbacks.Callback]):
+                See ``fit_sequences``.
+        """
+        iterator = range(epochs)
+        if self.verbose:
+            iterator = tqdm(iterator)
 
-            optimizer.step()
+        instrumentation = self._instrumentation
+        callbacks = CallbackList(callbacks)
+        callbacks.on_train_begin(self)
+        with instrumentation.stage('train', epochs=epochs):
+            for epoch in iterator:
+                with instrumentation.stage('epoch', epoch=epoch) as stage:
+                    losses = []
+                    sizes = []
+                    for (X, C, X_padded, seq_len), last in batches():
+                        Y = self._model(X, C)
+                        Y_padded, _ = torch.nn.utils.rnn.pad_packed_sequence(Y)
+
+                        self._optimizer.zero_grad()
+                        loss = self._compute_loss(
+                            X_padded[1:, :, :], Y_padded[:-1, :, :], seq_len)
+                        loss.backward()
+                        losses.append(loss.detach())
+                        sizes.append(X_padded.shape[1])
+
+                        stop = False
+                        if last:
+                            # Mean over the sequences, weighting each batch by its size
+                            sizes = torch.tensor(sizes, dtype=loss.dtype, device=loss.device)
+                            loss = (torch.stack(losses) * sizes).sum() / sizes.sum()
+                            if self.verbose:
+                                iterator.set_description(
+                                    'Epoch {} | Loss {}'.format(epoch + 1, loss.item()))
+
+                            # Notify the callbacks while the weights still match the loss
+                            if callbacks:
+                                stop = callbacks.on_epoch_end(self, epoch, loss)
+
+                        self._optimizer.step()
+
+                    stage.update(loss=loss)
+
+                if stop:
+                    break
+
+        callbacks.on_train_end(self)
+
+    def _get_data_categories(self, index):
+        return list(self._data_map[index]['indices'])
+
+    def _new_categories(self, mapping, values):
+        """Get the categories of each categorical column which are not in the mapping."""
+        new_categories = {}
+        for column, properties in mapping.items():
+            if column != '<TOKEN>' and properties['type'] in ('categorical', 'ordinal'):
+                categories = set(None if pd.isnull(v) else v for v in values[column])
+                new_categories[column] = [
+                    category for category in categories
+                    if category not in properties['indices']
+                ]
+
+        return new_categories
+
+    def _partial_fit_sequences(self, sequences, epochs, callbacks):
+        sequences = SequenceBatch.from_sequences(sequences)
+        lengths = sequences.lengths
+        self._min_length = min(self._min_length, int(lengths.min()))
+        self._max_length = max(self._max_length, int(lengths.max()))
+        self._fixed_length = self._min_length == self._max_length
+
+        data = [sequences.get_values(i) for i in range(len(sequences.data))]
+        contexts = [sequences.context[:, i] for i in range(sequences.context.shape[1])]
+        data_positions, data_dims = self._extend_index_map(
+            self._data_map, self._data_dims, self._new_categories(self._data_map, data))
+        ctx_positions, ctx_dims = self._extend_index_map(
+            self._ctx_map, self._ctx_dims, self._new_categories(self._ctx_map, contexts))
+
+        for column, properties in self._data_map.items():
+            if 'nulls' in properties:
+                properties['nulls'] = bool(properties['nulls'] or pd.isnull(data[column]).any())
+
+        if self._optimizer is None:
+            self._optimizer = torch.optim.Adam(self._model.parameters(), lr=1e-3)
+
+        # Inputs are the data followed by the context, outputs are the data
+        input_positions = np.concatenate([data_positions, data_dims + ctx_positions])
+        self._resize_parameters(self._model, self._optimizer, {
+            'down.weight': (1, input_positions, data_dims + ctx_dims),
+            'up.weight': (0, data_positions, data_dims),
+            'up.bias': (0, data_positions, data_dims),
+        })
+        self._model.context_size = ctx_dims
+        self._model.down.in_features = data_dims + ctx_dims
+        self._model.up.out_features = data_dims
+        self._data_dims = data_dims
+        self._ctx_dims = ctx_dims
+
+        batches = self._batches(self._encode_batch(sequences))
+        if epochs is None:
+            epochs = self.epochs
+
+        self._train(batches, epochs, callbacks)
 
     def _compute_loss(self, X_padded, Y_padded, seq_len):
         """Compute the loss between X and Y.
@@ -344,8 +579,13 @@ class PARModel(DeepEcho):
         returns the loss between the predicted and actual sequence.
 
         .. note::
-            The `i`th time series (with padding removed) can be indexed with
-            `X[:seq_len[i], i, :]`.
+            The loss is computed over the whole padded batch at once. Since
+            ``X`` and ``Y`` are shifted by one timestep, the `i`th time series
+            (with padding removed) can be indexed with `X[:seq_len[i] - 1, i, :]`
+            and the padding is masked out.
+
+        The loss is the negative log likelihood per sequence and column,
+        averaged over the sequences of the batch.
 
         Args:
             X_padded (tensor):
@@ -355,170 +595,272 @@ class PARModel(DeepEcho):
             seq_len (list):
                 This list contains the length of each sequence.
         """
-        log_likelihood = 0.0
-        _, batch_size, input_size = X_padded.shape
+        steps, batch_size, _ = X_padded.shape
+        # Each sequence has one target less than steps, since the first step is never predicted
+        lengths = torch.as_tensor(seq_len, device=X_padded.device) - 1
+        mask = torch.arange(steps, device=X_padded.device).unsqueeze(1) < lengths
 
+        def masked_sum(log_prob):
+            # ``where`` rather than a product, so non finite values in the padding are dropped
+            return torch.where(mask, log_prob, torch.zeros_like(log_prob)).sum()
+
+        log_likelihood = 0.0
         for key, props in self._data_map.items():
-            if props['type'] in ['continuous', 'timestamp']:
-                mu_idx, sigma_idx, missing_idx = props['indices']
-                mu = Y_padded[:, :, mu_idx]
-                sigma = torch.nn.functional.softplus(Y_padded[:, :, sigma_idx])
-                missing = torch.nn.LogSigmoid()(Y_padded[:, :, missing_idx])
-
-                for i in range(batch_size):
-                    dist = torch.distributions.normal.Normal(
-                        mu[:seq_len[i], i], sigma[:seq_len[i], i])
-                    log_likelihood += torch.sum(dist.log_prob(X_padded[-seq_len[i]:, i, mu_idx]))
-
-                    p_true = X_padded[:seq_len[i], i, missing_idx]
-                    p_pred = missing[:seq_len[i], i]
-                    log_likelihood += torch.sum(p_true * p_pred)
-                    log_likelihood += torch.sum((1.0 - p_true) * torch.log(
-                        1.0 - torch.exp(p_pred)))
-
-            elif props['type'] in ['count']:
-                r_idx, p_idx, missing_idx = props['indices']
-                r = torch.nn.functional.softplus(Y_padded[:, :, r_idx]) * props['range']
-                p = torch.sigmoid(Y_padded[:, :, p_idx])
-                x = X_padded[:, :, r_idx] * props['range']
-                missing = torch.nn.LogSigmoid()(Y_padded[:, :, missing_idx])
-
-                for i in range(batch_size):
+            if props['type'] in ['continuous', 'datetime', 'timestamp', 'count']:
+                if props['type'] == 'count':
+                    r_idx, p_idx, missing_idx = props['indices']
+                    r = torch.nn.functional.softplus(Y_padded[:, :, r_idx]) * props['range']
+                    p = torch.sigmoid(Y_padded[:, :, p_idx])
                     dist = torch.distributions.negative_binomial.NegativeBinomial(
-                        r[:seq_len[i], i], p[:seq_len[i], i])
-                    log_likelihood += torch.sum(dist.log_prob(x[:seq_len[i], i]))
+                        r, p, validate_args=False)
+                    x = X_padded[:, :, r_idx] * props['range']
+                    log_likelihood += masked_sum(dist.log_prob(x))
 
-                    p_true = X_padded[:seq_len[i], i, missing_idx]
-                    p_pred = missing[:seq_len[i], i]
-                    log_likelihood += torch.sum(p_true * p_pred)
-                    log_likelihood += torch.sum((1.0 - p_true) * torch.log(
-                        1.0 - torch.exp(p_pred)))
+                else:
+                    mu_idx, sigma_idx, missing_idx = props['indices']
+                    mu = Y_padded[:, :, mu_idx]
+                    sigma = torch.nn.functional.softplus(Y_padded[:, :, sigma_idx])
+                    dist = torch.distributions.normal.Normal(mu, sigma, validate_args=False)
+                    log_likelihood += masked_sum(dist.log_prob(X_padded[:, :, mu_idx]))
+
+                missing = torch.distributions.bernoulli.Bernoulli(
+                    logits=Y_padded[:, :, missing_idx], validate_args=False)
+                log_likelihood += masked_sum(missing.log_prob(X_padded[:, :, missing_idx]))
 
             elif props['type'] in ['categorical', 'ordinal']:
                 idx = list(props['indices'].values())
                 log_softmax = torch.nn.functional.log_softmax(Y_padded[:, :, idx], dim=2)
-
-                for i in range(batch_size):
-                    target = X_padded[:seq_len[i], i, idx]
-                    predicted = log_softmax[:seq_len[i], i]
-                    target = torch.argmax(target, dim=1).unsqueeze(dim=1)
-                    log_likelihood += torch.sum(predicted.gather(dim=1, index=target))
+                target = torch.argmax(X_padded[:, :, idx], dim=2, keepdim=True)
+                log_likelihood += masked_sum(log_softmax.gather(dim=2, index=target).squeeze(2))
 
             else:
-                raise ValueError()
+                raise ValueError('Unsupported type: {}'.format(props['type']))
 
-        return -log_likelihood / (batch_size * len(self._data_map) * batch_size)
+        # Mean over the sequences, so the loss does not depend on the size of the batch
+        return -log_likelihood / (batch_size * len(self._data_map))
 
-    def _tensor_to_data(self, x):
-        # Force CPU on x
-        x = x.to(torch.device('cpu'))
+    def _tensor_to_columns(self, x):
+        """Rebuild the values of each data column from the sampled tensor.
 
-        seq_len, batch_size, _ = x.shape
-        assert batch_size == 1
-
-        data = [None] * (len(self._data_map) - 1)
-        for key, props in self._data_map.items():
-            if key == '<TOKEN>':
+        Returns:
+            list[numpy.ndarray]:
+                One array of shape ``(sequence_length, num_sequences)`` per column.
+        """
+        x = x.cpu().numpy().astype(np.float64)
+        columns = [None] * (len(self._data_map) - 1)
+        for column, props in self._data_map.items():
+            if column == '<TOKEN>':
                 continue
 
-            data[key] = []
-            for i in range(seq_len):
-                if props['type'] in ['continuous', 'datetime']:
-                    mu_idx, sigma_idx, missing_idx = props['indices']
-                    if (x[i, 0, missing_idx] > 0) and props['nulls']:
-                        data[key].append(None)
+            if props['type'] in ['continuous', 'datetime', 'timestamp', 'count']:
+                if props['type'] == 'count':
+                    value_idx, _, missing_idx = props['indices']
+                    values = np.round(x[:, :, value_idx] * props['range'] + props['min'])
+                    values = values.astype(np.int64).astype(object)
+                else:
+                    value_idx, _, missing_idx = props['indices']
+                    values = x[:, :, value_idx] * props['std'] + props['mu']
+                    if props['type'] == 'datetime':
+                        # Datetimes are encoded as nanoseconds since the epoch
+                        values = pd.to_datetime(values.ravel(), unit='ns')
+                        values = values.to_numpy(dtype=object).reshape(x.shape[:2])
                     else:
-                        data[key].append(x[i, 0, mu_idx].item() * props['std'] + props['mu'])
+                        values = values.astype(object)
 
-                elif props['type'] in ['count']:
-                    r_idx, p_idx, missing_idx = props['indices']
-                    if x[i, 0, missing_idx] > 0 and props['nulls']:
-                        data[key].append(None)
-                    else:
-                        sample = x[i, 0, r_idx].item() * props['range'] + props['min']
-                        data[key].append(int(sample))
+                if props['nulls']:
+                    values[x[:, :, missing_idx] > 0] = None
 
-                elif props['type'] in ['categorical', 'ordinal']:
-                    ml_value, max_x = None, float('-inf')
-                    for value, idx in props['indices'].items():
-                        if x[i, 0, idx] > max_x:
-                            max_x = x[i, 0, idx]
-                            ml_value = value
+            elif props['type'] in ['categorical', 'ordinal']:
+                categories = np.empty(len(props['indices']), dtype=object)
+                categories[:] = list(props['indices'].keys())
+                values = categories[x[:, :, list(props['indices'].values())].argmax(axis=2)]
 
-                    data[key].append(ml_value)
+            else:
+                raise ValueError('Unsupported type: {}'.format(props['type']))
 
-                else:
-                    raise ValueError()
+            columns[column] = values
 
-        return data
+        return columns
 
     def _sample_state(self, x):
-        log_likelihood = 0.0
-        seq_len, batch_size, input_size = x.shape
-        assert seq_len == 1 and batch_size == 1
+        """Sample the next state of each sequence from the output of the network.
+
+        Args:
+            x (torch.Tensor):
+                Output of the network for the last step, of shape
+                ``(1, num_sequences, data_dims)``. It is overwritten with the
+                sampled state.
 
+        Returns:
+            tuple[torch.Tensor, torch.Tensor]:
+                The sampled state and its log likelihood for each sequence.
+        """
+        seq_len, batch_size, _ = x.shape
+        assert seq_len == 1
+
+        state = x[0]
+        log_likelihood = torch.zeros(batch_size, device=x.device)
         for key, props in self._data_map.items():
-            if props['type'] in ['continuous', 'timestamp']:
-                mu_idx, sigma_idx, missing_idx = props['indices']
-                mu = x[0, 0, mu_idx]
-                sigma = torch.nn.functional.softplus(x[0, 0, sigma_idx])
-                dist = torch.distributions.normal.Normal(mu, sigma)
-                x[0, 0, mu_idx] = dist.sample()
-                x[0, 0, sigma_idx] = 0.0
-                log_likelihood += torch.sum(dist.log_prob(x[0, 0, mu_idx]))
-
-                dist = torch.distributions.Bernoulli(torch.sigmoid(x[0, 0, missing_idx]))
-                x[0, 0, missing_idx] = dist.sample()
-                x[0, 0, mu_idx] = x[0, 0, mu_idx] * (1.0 - x[0, 0, missing_idx])
-                log_likelihood += torch.sum(dist.log_prob(x[0, 0, missing_idx]))
-
-            elif props['type'] in ['count']:
-                r_idx, p_idx, missing_idx = props['indices']
-                r = torch.nn.functional.softplus(x[0, 0, r_idx]) * props['range']
-                p = torch.sigmoid(x[0, 0, p_idx])
-                dist = torch.distributions.negative_binomial.NegativeBinomial(r, p)
-                x[0, 0, r_idx] = dist.sample()
-                x[0, 0, p_idx] = 0.0
-                log_likelihood += torch.sum(dist.log_prob(x[0, 0, r_idx]))
-                x[0, 0, r_idx] /= props['range']
-
-                dist = torch.distributions.Bernoulli(torch.sigmoid(x[0, 0, missing_idx]))
-                x[0, 0, missing_idx] = dist.sample()
-                x[0, 0, r_idx] = x[0, 0, r_idx] * (1.0 - x[0, 0, missing_idx])
-                log_likelihood += torch.sum(dist.log_prob(x[0, 0, missing_idx]))
+            if props['type'] in ['continuous', 'datetime', 'timestamp', 'count']:
+                if props['type'] == 'count':
+                    value_idx, param_idx, missing_idx = props['indices']
+                    r = torch.nn.functional.softplus(state[:, value_idx]) * props['range']
+                    p = torch.sigmoid(state[:, param_idx])
+                    dist = torch.distributions.negative_binomial.NegativeBinomial(r, p)
+                    scale = props['range']
+                else:
+                    value_idx, param_idx, missing_idx = props['indices']
+                    mu = state[:, value_idx]
+                    sigma = torch.nn.functional.softplus(state[:, param_idx])
+                    dist = torch.distributions.normal.Normal(mu, sigma)
+                    scale = 1.0
+
+                value = dist.sample()
+                log_likelihood += dist.log_prob(value)
+
+                dist = torch.distributions.Bernoulli(logits=state[:, missing_idx])
+                missing = dist.sample()
+                log_likelihood += dist.log_prob(missing)
+
+                state[:, value_idx] = value / scale * (1.0 - missing)
+                state[:, param_idx] = 0.0
+                state[:, missing_idx] = missing
 
             elif props['type'] in ['categorical', 'ordinal']:
                 idx = list(props['indices'].values())
-                p = torch.nn.functional.softmax(x[0, 0, idx], dim=0)
-                x_new = torch.zeros(p.size()).to(self.device)
-                x_new.scatter_(dim=0, index=torch.multinomial(p, 1), value=1)
-                x[0, 0, idx] = x_new
-                log_likelihood += torch.sum(torch.log(p) * x_new)
+                p = torch.nn.functional.softmax(state[:, idx], dim=1)
+                choice = torch.multinomial(p, 1)
+                state[:, idx] = torch.zeros_like(p).scatter_(dim=1, index=choice, value=1)
+                log_likelihood += torch.log(p.gather(dim=1, index=choice)).squeeze(1)
 
             else:
-                raise ValueError()
+                raise ValueError('Unsupported type: {}'.format(props['type']))
 
         return x, log_likelihood
 
-    def _sample_sequence(self, context, min_length, max_length):
-        log_likelihood = 0.0
+    def _sample_sequences(self, context, min_length, max_length):
+        """Sample a batch of sequences in lockstep.
+
+        Each step is sampled for all the sequences at once. A sequence ends
+        when it samples the end token while it has at least its minimum length,
+        or when it reaches its maximum length. Before the minimum length, the
+        end token is replaced by the body token. The network only processes
+        the newest step, carrying its hidden state, and the sampled steps are
+        written into a buffer allocated for the maximum length.
+
+        Args:
+            context (torch.Tensor):
+                Encoded context of each sequence, or ``None`` if there is no context.
+            min_length (numpy.ndarray):
+                Minimum length of each sequence.
+            max_length (numpy.ndarray):
+                Maximum length of each sequence.
+
+        Returns:
+            tuple[torch.Tensor, numpy.ndarray, torch.Tensor]:
+                The sampled steps, of shape ``(steps, num_sequences, data_dims)``,
+                the length of each sequence and its log likelihood.
+        """
+        tokens = self._data_map['<TOKEN>']['indices']
+        num_sequences = len(min_length)
+        min_length = torch.as_tensor(min_length, device=self.device)
+        max_length = torch.as_tensor(max_length, device=self.device)
+        lengths = max_length.clone()
+        finished = torch.zeros(num_sequences, dtype=torch.bool, device=self.device)
+        log_likelihood = torch.zeros(num_sequences, device=self.device)
+
+        # Each step is fed back as the input of the next one
+        x = torch.zeros(1, num_sequences, self._data_dims, device=self.device)
+        x[0, :, tokens['<START>']] = 1.0
+        hidden = None
+        output = torch.empty(
+            int(max_length.max()), num_sequences, self._data_dims, device=self.device)
+        for step in range(len(output) + 1):
+            finished |= max_length <= step
+            if finished.all():
+                break
+
+            y, hidden = self._model.step(x, context, hidden)
+            x, ll = self._sample_state(y)
+            log_likelihood += torch.where(finished, torch.zeros_like(ll), ll)
+
+            end = (x[0, :, tokens['<END>']] > 0.0) & ~finished
+            can_end = min_length <= step
+            lengths[end & can_end] = step
+            finished |= end & can_end
+
+            too_short = end & ~can_end
+            x[0, too_short, tokens['<BODY>']] = 1.0
+            x[0, too_short, tokens['<END>']] = 0.0
+            output[step] = x[0]
+
+        return output[:step], lengths.cpu().numpy(), log_likelihood
+
+    def sample_sequences(self, contexts, sequence_lengths=None):
+        """Sample one sequence conditioned on each one of the given contexts.
+
+        All the sequences are sampled at once, step by step, and each one of
+        them ends on its own. If ``sample_size`` is greater than one, the whole
+        batch is sampled that many times and, for each sequence, the sample with
+        the highest likelihood is kept.
 
-        x = torch.zeros(self._data_dims).to(self.device)
-        x[self._data_map['<TOKEN>']['indices']['<START>']] = 1.0
-        x = x.unsqueeze(0).unsqueeze(0)
+        Args:
+            contexts (list[list] or numpy.ndarray):
+                The lists of values to condition on, one per sequence. They must
+                match the types specified in context_types when fit was called.
+            sequence_lengths (int, list[int] or None):
+                If given, force sequences to be of the indicated lengths, either one
+                for all the sequences or one per sequence. If ``None`` (default),
+                sample sequences of the same length as the original dataset.
 
-        for step in range(max_length):
-            next_x, ll = self._sample_state(self._model(x, context)[-1:, :, :])
-            x = torch.cat([x, next_x], dim=0)
-            log_likelihood += ll
-            if next_x[0, 0, self._data_map['<TOKEN>']['indices']['<END>']] > 0.0:
-                if min_length <= step + 1 <= max_length:
-                    break  # received end token
+        Returns:
+            list[list[list]]:
+                One list of lists (data) per context, corresponding to the types
+                specified in data_types when fit was called.
+        """
+        num_sequences = len(contexts)
+        sequence_lengths = self._broadcast_lengths(sequence_lengths, num_sequences)
+        min_length = np.array([
+            self._min_length if length is None else length
+            for length in sequence_lengths
+        ], dtype=np.int64)
+        max_length = np.array([
+            self._max_length if length is None else length
+            for length in sequence_lengths
+        ], dtype=np.int64)
+
+        context = None
+        if self._ctx_dims:
+            # Rows are copied one by one to keep the values as they were given
+            matrix = np.empty((num_sequences, len(self._ctx_map)), dtype=object)
+            for index, values in enumerate(contexts):
+                matrix[index] = list(values)
 
-                next_x[0, 0, self._data_map['<TOKEN>']['indices']['<BODY>']] = 1.0
-                next_x[0, 0, self._data_map['<TOKEN>']['indices']['<END>']] = 0.0
+            context = torch.from_numpy(self._encode_context(matrix)).to(self.device)
 
-        return x[1:, :, :], log_likelihood
+        best_x, best_lengths, best_ll = None, None, None
+        for _ in range(self.sample_size):
+            with torch.no_grad():
+                x, lengths, log_likelihood = self._sample_sequences(
+                    context, min_length, max_length)
+
+            if best_x is None:
+                best_x, best_lengths, best_ll = x, lengths, log_likelihood
+                continue
+
+            steps = max(len(x), len(best_x))
+            x = torch.nn.functional.pad(x, (0, 0, 0, 0, 0, steps - len(x)))
+            best_x = torch.nn.functional.pad(best_x, (0, 0, 0, 0, 0, steps - len(best_x)))
+            better = log_likelihood > best_ll
+            best_x = torch.where(better.view(1, -1, 1), x, best_x)
+            best_lengths = np.where(better.cpu().numpy(), lengths, best_lengths)
+            best_ll = torch.where(better, log_likelihood, best_ll)
+
+        columns = self._tensor_to_columns(best_x)
+        return [
+            [values[:length, index].tolist() for values in columns]
+            for index, length in enumerate(best_lengths)
+        ]
 
     def sample_sequence(self, context, sequence_length=None):
         """Sample a single sequence conditioned on context.
@@ -537,24 +879,4 @@ class PARModel(DeepEcho):
                 A list of lists (data) corresponding to the types specified
                 in data_types when fit was called.
         """
-        if sequence_length is not None:
-            min_length = max_length = sequence_length
-        else:
-            min_length = self._min_length
-            max_length = self._max_length
-
-        if self._ctx_dims:
-            context = self._context_to_tensor(context).unsqueeze(0)
-        else:
-            context = None
-
-        best_x, best_ll = None, float('-inf')
-        for _ in range(self.sample_size):
-            with torch.no_grad():
-                x, log_likelihood = self._sample_sequence(context, min_length, max_length)
-
-            if log_likelihood > best_ll:
-                best_x = x
-                best_ll = log_likelihood
-
-        return self._tensor_to_data(best_x)
+        return self.sample_sequences([context], sequence_length)[0]
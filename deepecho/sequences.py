@@ -1,7 +1,575 @@
 """Functions to manipulate sequences and assemble training examples."""
 
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
 
-def segment_by_size(sequence, segment_size):
+import numpy as np
+import pandas as pd
+
+from deepecho import storage
+
+
+def _to_array(values):
+    """Convert the given values to a ``numpy.ndarray`` without altering the Python objects.
+
+    Strings are stored in ``object`` arrays to prevent ``numpy`` from casting other
+    values that are mixed with them.
+    """
+    if isinstance(values, (np.ndarray, _CodedColumn)):
+        return values
+
+    array = np.asarray(values)
+    if array.dtype.kind in 'US':
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+
+    return array
+
+
+class _CodedColumn:
+    """Column of a stored ``SequenceBatch`` kept as integer codes of its distinct values.
+
+    Indexing the column returns ``object`` arrays, so only the indexed values are
+    decoded in memory while the codes can stay memory-mapped on disk. Missing
+    values have code ``-1`` and are decoded as ``None``.
+
+    Args:
+        codes (numpy.ndarray):
+            Code of the value of each row.
+        categories (list):
+            The distinct values of the column.
+    """
+
+    dtype = np.dtype(object)
+
+    def __init__(self, codes, categories):
+        self.codes = codes
+        # The ``None`` at the end is what code -1 points to
+        self.categories = np.empty(len(categories) + 1, dtype=object)
+        self.categories[:-1] = categories
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def shape(self):
+        """tuple: Shape of the column."""
+        return self.codes.shape
+
+    def __getitem__(self, index):
+        return self.categories[self.codes[index]]
+
+    def __array__(self, dtype=None, copy=None):
+        return self[:] if dtype is None else self[:].astype(dtype)
+
+
+def _encode_column(values):
+    """Convert a column to an array that can be stored without pickling.
+
+    Columns of Python objects are stored as floats if they only contain numbers
+    and missing values, or as integer codes of their distinct values otherwise.
+
+    Returns:
+        tuple[numpy.ndarray, list or None]:
+            The array to store and the distinct values of the column, if encoded.
+    """
+    if isinstance(values, _CodedColumn):
+        return np.asarray(values.codes), list(values.categories[:-1])
+
+    values = _to_array(values)
+    if values.dtype.kind != 'O':
+        return values, None
+
+    nulls = pd.isnull(values)
+    kind = pd.api.types.infer_dtype(values, skipna=True)
+    if kind in ('integer', 'floating', 'mixed-integer-float', 'empty'):
+        numbers = np.full(len(values), np.nan)
+        numbers[~nulls] = values[~nulls].astype(np.float64)
+        return numbers, None
+
+    codes, categories = pd.factorize(values)
+    return codes.astype(_code_dtype(len(categories))), list(categories)
+
+
+def _code_dtype(num_categories):
+    return np.int32 if num_categories < 2 ** 31 else np.int64
+
+
+def _merge_columns(directory, name, columns, num_values):
+    """Concatenate the columns encoded with ``_encode_column`` into a stored array.
+
+    Columns of different parts may be encoded differently, in which case they are
+    all encoded as codes of the union of their distinct values.
+
+    Args:
+        directory (str):
+            Directory of the artifact being written.
+        name (str):
+            Name of the stored array.
+        columns (list[tuple[numpy.ndarray, list or None]]):
+            The encoded column of each part.
+        num_values (int):
+            Total number of values of the column.
+
+    Returns:
+        list or None:
+            The distinct values of the column, if encoded.
+    """
+    if all(categories is None for _, categories in columns):
+        dtype = np.result_type(*[array.dtype for array, _ in columns])
+        output = storage.open_array(directory, name, dtype, (num_values, ))
+        offset = 0
+        for array, _ in columns:
+            output[offset:offset + len(array)] = array
+            offset += len(array)
+
+        output.flush()
+        return None
+
+    # Factorize the parts that are not encoded yet, one at a time, and merge the categories
+    merged = {}
+    for array, categories in columns:
+        if categories is None:
+            categories = pd.unique(array[~pd.isnull(array)])
+
+        for category in categories:
+            merged.setdefault(category, len(merged))
+
+    dtype = _code_dtype(len(merged))
+    output = storage.open_array(directory, name, dtype, (num_values, ))
+    offset = 0
+    for array, categories in columns:
+        if categories is None:
+            array, categories = pd.factorize(array)
+
+        mapping = np.array([merged[category] for category in categories] + [-1], dtype=dtype)
+        output[offset:offset + len(array)] = mapping[array]
+        offset += len(array)
+
+    output.flush()
+    return list(merged)
+
+
+class ColumnSummary:
+    """Statistics of the values of a column, computed incrementally.
+
+    Numerical columns keep the number of values, their mean, standard deviation,
+    minimum and maximum, and categorical columns their distinct values in order of
+    appearance. In both cases, missing values are skipped and only flagged.
+
+    Args:
+        categorical (bool):
+            Whether the column is categorical. Defaults to ``False``.
+    """
+
+    def __init__(self, categorical=False):
+        self.categorical = categorical
+        self.nulls = False
+        self.count = 0
+        self.mean = np.nan
+        self.min = np.nan
+        self.max = np.nan
+        self.categories = {} if categorical else None
+        self._squares = 0.0
+
+    @property
+    def std(self):
+        """float: Standard deviation of the values."""
+        return np.sqrt(self._squares / self.count) if self.count else np.nan
+
+    def update(self, values):
+        """Add a chunk of values to the statistics."""
+        nulls = pd.isnull(values)
+        self.nulls = self.nulls or bool(nulls.any())
+        values = values[~nulls]
+        if self.categorical:
+            self.categories.update(dict.fromkeys(pd.unique(values)))
+            return
+
+        if not len(values):
+            return
+
+        if values.dtype.kind in 'mM':
+            values = values.view(np.int64)
+
+        values = values.astype(np.float64)
+        count = len(values)
+        mean = values.mean()
+        squares = np.square(values - mean).sum()
+        if self.count:
+            # Combine the statistics of both chunks, see Chan et al.
+            total = self.count + count
+            delta = mean - self.mean
+            mean = self.mean + delta * count / total
+            squares += self._squares + delta ** 2 * self.count * count / total
+            count = total
+
+        self.count = count
+        self.mean = mean
+        self._squares = squares
+        self.min = np.fmin(self.min, values.min())
+        self.max = np.fmax(self.max, values.max())
+
+
+def _concatenate(values):
+    """Concatenate the values that a column takes in several sequences."""
+    if values and all(isinstance(value, np.ndarray) for value in values):
+        return np.concatenate(values)
+
+    return _to_array(list(itertools.chain.from_iterable(values)))
+
+
+class SequenceBatch:
+    """Columnar collection of sequences.
+
+    The data values of all the sequences are stored as one array per data column,
+    alongside the offsets at which each sequence starts and ends within those arrays
+    and a context matrix which contains one row per sequence.
+
+    Sequences are not required to be adjacent to each other within the data arrays,
+    which allows building a ``SequenceBatch`` over the sorted data without copying
+    the values of each segment.
+
+    Args:
+        data (list[numpy.ndarray]):
+            One array for each data column.
+        starts (numpy.ndarray):
+            Offset at which each sequence starts within the data arrays.
+        ends (numpy.ndarray):
+            Offset at which each sequence ends within the data arrays.
+        context (numpy.ndarray):
+            Two dimensional array with the context values of each sequence.
+            If not given, sequences have no context.
+    """
+
+    def __init__(self, data, starts, ends, context=None):
+        self.data = [_to_array(values) for values in data]
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        if context is None:
+            context = np.empty((len(self.starts), 0))
+
+        self.context = context
+
+    @classmethod
+    def from_sequences(cls, sequences):
+        """Build a ``SequenceBatch`` from a list of sequence dictionaries.
+
+        Args:
+            sequences (list):
+                List of sequences as described in ``DeepEcho.fit_sequences``.
+
+        Returns:
+            SequenceBatch
+        """
+        if isinstance(sequences, cls):
+            return sequences
+
+        num_columns = len(sequences[0]['data']) if sequences else 0
+        data = [
+            _concatenate([sequence['data'][column] for sequence in sequences])
+            for column in range(num_columns)
+        ]
+
+        lengths = [len(sequence['data'][0]) if num_columns else 0 for sequence in sequences]
+        ends = np.cumsum(lengths, dtype=np.int64)
+
+        num_context = len(sequences[0]['context']) if sequences else 0
+        context = None
+        if num_context:
+            context = np.column_stack([
+                _to_array([sequence['context'][column] for sequence in sequences])
+                for column in range(num_context)
+            ])
+
+        return cls(data, ends - lengths, ends, context)
+
+    @property
+    def lengths(self):
+        """numpy.ndarray: Length of each sequence."""
+        return self.ends - self.starts
+
+    def __len__(self):
+        return len(self.starts)
+
+    def get_data(self, index):
+        """Get the data values of the indicated sequence, as one array view per column."""
+        start = self.starts[index]
+        end = self.ends[index]
+        return [values[start:end] for values in self.data]
+
+    def get_values(self, column):
+        """Get the values that a data column takes in all the sequences, one after another."""
+        values = self.data[column]
+        if not len(self):
+            return values[:0]
+
+        if (self.starts[1:] == self.ends[:-1]).all():
+            return values[self.starts[0]:self.ends[-1]]
+
+        lengths = self.lengths
+        positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return values[np.repeat(self.starts, lengths) + positions]
+
+    def take(self, indices):
+        """Get a ``SequenceBatch`` with the sequences at the given indices.
+
+        The new batch shares the data arrays with this one.
+        """
+        return SequenceBatch(
+            self.data, self.starts[indices], self.ends[indices], self.context[indices])
+
+    def summarize(self, context_types, data_types, chunk_size=10000):
+        """Compute the statistics of the context and data columns.
+
+        The sequences are processed in chunks, so the statistics of a batch stored
+        on disk are computed in a single pass without loading it in memory.
+
+        Args:
+            context_types (list[str]):
+                Type of each context column.
+            data_types (list[str]):
+                Type of each data column.
+            chunk_size (int):
+                Number of sequences processed at once. Defaults to 10000.
+
+        Returns:
+            tuple[list[ColumnSummary], list[ColumnSummary]]:
+                The statistics of the context columns and of the data columns.
+        """
+        categorical = ('categorical', 'ordinal')
+        context = [ColumnSummary(column_type in categorical) for column_type in context_types]
+        data = [ColumnSummary(column_type in categorical) for column_type in data_types]
+        for start in range(0, len(self), chunk_size):
+            chunk = self[start:start + chunk_size]
+            for column, summary in enumerate(context):
+                summary.update(chunk.context[:, column])
+
+            for column, summary in enumerate(data):
+                summary.update(chunk.get_values(column))
+
+        return context, data
+
+    def save(self, path):
+        """Store the sequences in the given directory.
+
+        Numerical columns are stored as arrays which are memory-mapped when loaded
+        back with ``load``, and columns of other values as integer codes of their
+        distinct values.
+
+        Args:
+            path (str):
+                Path to the output directory.
+        """
+        header = {'data_categories': [], 'context_categories': []}
+        arrays = {'starts': self.starts, 'ends': self.ends}
+        for column, values in enumerate(self.data):
+            array, categories = _encode_column(values)
+            arrays['data_{}'.format(column)] = array
+            header['data_categories'].append(categories)
+
+        for column in range(self.context.shape[1]):
+            array, categories = _encode_column(self.context[:, column])
+            arrays['context_{}'.format(column)] = array
+            header['context_categories'].append(categories)
+
+        storage.save(path, header, arrays)
+
+    @classmethod
+    def load(cls, path, mmap_mode='c'):
+        """Load sequences stored with ``save`` or ``from_iterable``.
+
+        The data columns stay on disk until they are read. The context is loaded
+        in memory.
+
+        Args:
+            path (str):
+                Path to the directory.
+            mmap_mode (str or None):
+                See ``deepecho.storage.load``.
+
+        Returns:
+            SequenceBatch
+        """
+        header, arrays = storage.load(path, mmap_mode)
+        data = []
+        for column, categories in enumerate(header['data_categories']):
+            values = arrays['data_{}'.format(column)]
+            data.append(values if categories is None else _CodedColumn(values, categories))
+
+        context = []
+        for column, categories in enumerate(header['context_categories']):
+            values = arrays['context_{}'.format(column)]
+            if categories is None:
+                context.append(np.asarray(values))
+            else:
+                context.append(_CodedColumn(values, categories)[:])
+
+        context = np.column_stack(context) if context else None
+        return cls(data, arrays['starts'], arrays['ends'], context)
+
+    @classmethod
+    def from_iterable(cls, sequences, path, chunk_size=1000):
+        """Store the sequences given by an iterable on disk and load them.
+
+        Only ``chunk_size`` sequences are held in memory at a time. Each chunk is
+        first stored as a separate part, and then the parts are concatenated.
+
+        Args:
+            sequences (iterable):
+                Sequences, either as dictionaries as described in
+                ``DeepEcho.fit_sequences`` or as ``SequenceBatch`` chunks.
+            path (str):
+                Path to the output directory.
+            chunk_size (int):
+                Number of sequence dictionaries gathered in each part.
+                Defaults to 1000.
+
+        Returns:
+            SequenceBatch:
+                The stored sequences, loaded as in ``load``.
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        parts_path = tempfile.mkdtemp(dir=parent, prefix='.parts-')
+        try:
+            parts = []
+            for chunk in _iter_chunks(sequences, chunk_size):
+                part_path = os.path.join(parts_path, str(len(parts)))
+                chunk.save(part_path)
+                parts.append(storage.load(part_path))
+
+            _merge_parts(parts, path)
+        finally:
+            shutil.rmtree(parts_path, ignore_errors=True)
+
+        return cls.load(path)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return SequenceBatch(
+                self.data, self.starts[index], self.ends[index], self.context[index])
+
+        return {
+            'context': self.context[index],
+            'data': self.get_data(index),
+        }
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def _iter_chunks(sequences, chunk_size):
+    """Group the given sequences in ``SequenceBatch`` chunks with contiguous values."""
+    pending = []
+    for sequence in sequences:
+        if isinstance(sequence, SequenceBatch):
+            if pending:
+                yield SequenceBatch.from_sequences(pending)
+                pending = []
+
+            lengths = sequence.lengths
+            ends = np.cumsum(lengths)
+            data = [sequence.get_values(column) for column in range(len(sequence.data))]
+            yield SequenceBatch(data, ends - lengths, ends, sequence.context)
+
+        else:
+            pending.append(sequence)
+            if len(pending) == chunk_size:
+                yield SequenceBatch.from_sequences(pending)
+                pending = []
+
+    if pending:
+        yield SequenceBatch.from_sequences(pending)
+
+
+def _merge_parts(parts, path):
+    """Concatenate the stored parts of a ``SequenceBatch`` into a single one."""
+    if not parts:
+        raise ValueError('No sequences were given.')
+
+    header = parts[0][0]
+    num_data = len(header['data_categories'])
+    num_context = len(header['context_categories'])
+    for part_header, _ in parts:
+        if (len(part_header['data_categories']), len(part_header['context_categories'])) != (
+                num_data, num_context):
+            raise ValueError('All the sequences must have the same number of columns.')
+
+    lengths = np.concatenate([arrays['ends'] - arrays['starts'] for _, arrays in parts])
+    ends = np.cumsum(lengths)
+    num_values = int(ends[-1]) if len(ends) else 0
+    with storage.writing(path) as tmp_path:
+        header = {'data_categories': [], 'context_categories': []}
+        for kind, num_columns, size in (('data', num_data, num_values),
+                                        ('context', num_context, len(lengths))):
+            for column in range(num_columns):
+                name = '{}_{}'.format(kind, column)
+                columns = [
+                    (arrays[name], part_header['{}_categories'.format(kind)][column])
+                    for part_header, arrays in parts
+                ]
+                categories = _merge_columns(tmp_path, name, columns, size)
+                header['{}_categories'.format(kind)].append(categories)
+
+        storage.write_array(tmp_path, 'starts', ends - lengths)
+        storage.write_array(tmp_path, 'ends', ends)
+        storage.write_header(tmp_path, header)
+
+
+def _is_number(value):
+    """Tell whether the value is a plain number, which cannot be used as a time length."""
+    return isinstance(value, (int, float, np.number)) and not isinstance(value, np.timedelta64)
+
+
+def _size_offsets(starts, ends, segment_size, segment_stride=None):
+    """Compute the offsets of all the complete segments of the indicated size.
+
+    The segments of all the given ``[start, end)`` ranges are computed at once.
+    A new segment starts every ``segment_stride`` data points, which makes the
+    segments overlap if the stride is smaller than the ``segment_size``.
+
+    Args:
+        starts (numpy.ndarray):
+            Start offsets of the sequences to segment.
+        ends (numpy.ndarray):
+            End offsets of the sequences to segment.
+        segment_size (int):
+            Size of each segment.
+        segment_stride (int):
+            Distance between the starts of two consecutive segments.
+            Defaults to the ``segment_size``.
+
+    Returns:
+        tuple[numpy.ndarray, numpy.ndarray]:
+            Arrays with the start and end offsets of each segment.
+    """
+    segment_stride = segment_size if segment_stride is None else segment_stride
+    if segment_stride <= 0:
+        raise ValueError('`segment_stride` must be positive.')
+
+    num_segments = np.maximum((ends - starts - segment_size) // segment_stride + 1, 0)
+    first_segments = np.repeat(np.cumsum(num_segments) - num_segments, num_segments)
+    positions = np.arange(first_segments.size) - first_segments
+    segment_starts = np.repeat(starts, num_segments) + positions * segment_stride
+    return segment_starts, segment_starts + segment_size
+
+
+def _split_frame(sequence, starts, ends):
+    """Split the sequence in one ``pandas.DataFrame`` for each pair of offsets."""
+    columns = [(column, values.array) for column, values in sequence.items()]
+    return [
+        pd.DataFrame({column: values[start:end] for column, values in columns},
+                     columns=sequence.columns)
+        for start, end in zip(starts, ends)
+    ]
+
+
+def segment_by_size(sequence, segment_size, segment_stride=None):
     """Segment the sequence in segments of the indicated size.
 
     If sequence length is not exactly divisible by the ``segment_size``,
@@ -13,32 +581,72 @@ def segment_by_size(sequence, segment_size):
             Sequence to segment, passed as a multi-column ``pandas.DataFrame``.
         segment_size (int):
             Size of each segment, passed as an integer.
+        segment_stride (int):
+            Number of data points between the starts of two consecutive segments.
+            If smaller than the ``segment_size``, segments overlap.
+            Defaults to the ``segment_size``.
 
     Returns:
         list:
             List of ``pandas.DataFrames`` containing each segment, all
             of the indicated size.
     """
-    sequences = []
-    start = 0
-    total = len(sequence)
-    while start < total:
-        end = start + segment_size
-        segment = sequence.iloc[start:end].reset_index(drop=True)
-        if len(segment) != segment_size:
-            break
+    starts, ends = _size_offsets(
+        np.array([0]), np.array([len(sequence)]), segment_size, segment_stride)
+    return _split_frame(sequence, starts, ends)
 
-        sequences.append(segment)
-        start = end
 
-    return sequences
+def _time_offsets(sequence_index, segment_size, first=None, last=None, segment_stride=None):
+    """Compute the offsets of all the segments of the indicated time length.
 
+    Segments are time windows which start at the ``first`` time, one every
+    ``segment_stride``, and are added until the ``last`` time is covered. The rows
+    of each window are located using a binary search over the sorted ``sequence_index``,
+    which means that windows without any data point get a range of length zero.
 
-def segment_by_time(sequence, segment_size, sequence_index):
+    Args:
+        sequence_index (pandas.Series):
+            Sorted values of the column that is used as the time index.
+        segment_size (pandas.Timedelta):
+            Time length of each segment.
+        first (pandas.Timestamp):
+            Start time of the first segment. Defaults to the first ``sequence_index`` value.
+        last (pandas.Timestamp):
+            Time that must be covered by the last segment. Defaults to the last
+            ``sequence_index`` value.
+        segment_stride (pandas.Timedelta):
+            Time between the starts of two consecutive segments.
+            Defaults to the ``segment_size``.
+
+    Returns:
+        tuple[numpy.ndarray, numpy.ndarray]:
+            Arrays with the start and end offsets of each segment.
+    """
+    segment_stride = segment_size if segment_stride is None else segment_stride
+    if _is_number(segment_stride) or segment_stride <= pd.Timedelta(0):
+        raise ValueError('`segment_stride` must be a positive `pandas.Timedelta`.')
+
+    if len(sequence_index):
+        first = sequence_index.iloc[0] if first is None else first
+        last = sequence_index.iloc[-1] if last is None else last
+
+    if not len(sequence_index) or pd.isnull(first) or pd.isnull(last) or last < first:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    num_segments = (last - first) // segment_stride + 1
+    window_starts = first + pd.timedelta_range(0, periods=num_segments, freq=segment_stride)
+    starts = sequence_index.searchsorted(window_starts, side='left')
+    ends = sequence_index.searchsorted(window_starts + segment_size, side='left')
+
+    return starts, ends
+
+
+def segment_by_time(sequence, segment_size, sequence_index, segment_stride=None):
     """Segment the sequence in segments of the indicated time length.
 
     Segmentation will happen by time, which means that there is no guarantee
     that the outputed segments all contain the same number of data points.
+    Time windows that do not contain any data point are returned as empty segments.
 
     Args:
         sequence (pandas.DataFrame):
@@ -48,24 +656,29 @@ def segment_by_time(sequence, segment_size, sequence_index):
         sequence_index (pandas.Series):
             Data of the column that will be used as the time index for the
             segmentation.
+        segment_stride (pandas.Timedelta):
+            Time between the starts of two consecutive segments. If smaller than
+            the ``segment_size``, segments overlap. Defaults to the ``segment_size``.
 
     Returns:
         list:
             List of ``pandas.DataFrames`` containing each segment.
     """
-    sequences = []
-    start = sequence_index.iloc[0]
-    max_time = sequence_index.iloc[-1]
-    while start <= max_time:
-        end = start + segment_size
-        selected = (start <= sequence_index) & (sequence_index < end)
-        sequences.append(sequence[selected.values].reset_index(drop=True))
-        start = end
+    first = last = None
+    if len(sequence_index) and not sequence_index.is_monotonic_increasing:
+        first = sequence_index.iloc[0]
+        last = sequence_index.iloc[-1]
+        order = np.argsort(sequence_index.to_numpy(), kind='mergesort')
+        sequence = sequence.iloc[order]
+        sequence_index = sequence_index.iloc[order]
 
-    return sequences
+    sequence_index = sequence_index.reset_index(drop=True)
+    starts, ends = _time_offsets(sequence_index, segment_size, first, last, segment_stride)
+    return _split_frame(sequence, starts, ends)
 
 
-def segment_sequence(sequence, segment_size, sequence_index, drop_sequence_index=True):
+def segment_sequence(sequence, segment_size, sequence_index, drop_sequence_index=True,
+                     segment_stride=None):
     """Segment the sequence in segments of the indicated time length or size.
 
     If a ``sequence_index`` is given, data will be sorted by it first.
@@ -84,6 +697,9 @@ def segment_sequence(sequence, segment_size, sequence_index, drop_sequence_index
             segmentation. Required if a timedelta ``segment_size`` is passed.
         drop_sequence_index (bool):
             Whether to drop the sequence index after sorting. Defaults to ``True``.
+        segment_stride (int or pandas.Timedelta):
+            Distance between the starts of two consecutive segments, of the same
+            type as the ``segment_size``. Defaults to the ``segment_size``.
 
     Returns:
         list:
@@ -99,38 +715,300 @@ def segment_sequence(sequence, segment_size, sequence_index, drop_sequence_index
         return [sequence]
 
     if isinstance(segment_size, int):
-        return segment_by_size(sequence, segment_size)
+        return segment_by_size(sequence, segment_size, segment_stride)
 
-    return segment_by_time(sequence, segment_size, sequence_index_values)
+    return segment_by_time(sequence, segment_size, sequence_index_values, segment_stride)
 
 
-def _convert_to_dicts(segments, context_columns):
-    sequences = []
-    for segment in segments:
-        if context_columns:
-            context = segment[context_columns]
-            if len(context.drop_duplicates()) > 1:
-                raise ValueError('Context columns are not constant within each segment.')
+def _is_constant(values, starts, ends):
+    """Tell whether the rows of ``values`` are constant within each ``[start, end)`` range.
 
-            context = context.iloc[0].values
-            segment = segment.drop(context_columns, axis=1)
-        else:
-            context = []
+    All the ranges are validated at once by comparing each row with the previous one
+    and only looking at the rows that are inside a range without being its first row.
+    Null values are considered equal to each other.
 
-        lists = [
-            list(row)
-            for _, row in segment.items()
-        ]
-        sequences.append({
-            'context': context,
-            'data': lists
+    Args:
+        values (numpy.ndarray):
+            Two dimensional array containing the values to validate.
+        starts (numpy.ndarray):
+            Start offsets of the ranges.
+        ends (numpy.ndarray):
+            End offsets of the ranges.
+
+    Returns:
+        bool:
+            Whether the values are constant within each range or not.
+    """
+    if len(values) < 2:
+        return True
+
+    previous = values[:-1]
+    current = values[1:]
+    changed = (previous != current) & ~(pd.isnull(previous) & pd.isnull(current))
+    changed = changed.any(axis=1)
+
+    non_trivial = (ends - starts) > 1
+    inside = np.zeros(len(values) + 1, dtype=np.int64)
+    np.add.at(inside, starts[non_trivial] + 1, 1)
+    np.add.at(inside, ends[non_trivial], -1)
+    inside = np.cumsum(inside)[1:len(values)] > 0
+
+    return not (changed & inside).any()
+
+
+def _entity_ids(data, entity_columns):
+    """Get an integer id for the entity of each row.
+
+    Ids follow the order in which ``pandas.DataFrame.groupby`` iterates over the
+    entities. Rows which have null values in any of the entity columns get ``-1``.
+    """
+    if not entity_columns:
+        return np.zeros(len(data), dtype=np.int64)
+
+    entity_ids = data.groupby(entity_columns, observed=True).ngroup()
+    return entity_ids.fillna(-1).to_numpy().astype(np.int64)
+
+
+def _sort_rows(data, rows, entity_ids, sequence_index):
+    """Sort the indicated rows by entity and sequence index.
+
+    Rows are sorted with a stable sort, and the ones which do not belong to any
+    entity are discarded.
+
+    Returns:
+        tuple[numpy.ndarray, numpy.ndarray]:
+            The positions of the rows in sorted order and their entity ids.
+    """
+    row_entity_ids = entity_ids[rows]
+    if sequence_index is not None:
+        keys = pd.DataFrame({
+            'entity_id': row_entity_ids,
+            'sequence_index': data[sequence_index].take(rows).reset_index(drop=True),
         })
+        order = keys.sort_values(['entity_id', 'sequence_index'], kind='mergesort').index
+        order = order.to_numpy()
+    else:
+        order = np.argsort(row_entity_ids, kind='mergesort')
 
-    return sequences
+    order = order[row_entity_ids[order] >= 0]
+    return rows[order], row_entity_ids[order]
 
 
-def assemble_sequences(data, entity_columns, context_columns, segment_size,
-                       sequence_index, drop_sequence_index=True):
+def _segment_offsets(starts, ends, segment_size, segment_stride, sequence_index):
+    """Compute the offsets of the segments of all the given ``[start, end)`` ranges."""
+    if segment_size is None:
+        return starts, ends
+
+    if isinstance(segment_size, int):
+        return _size_offsets(starts, ends, segment_size, segment_stride)
+
+    segment_starts = []
+    segment_ends = []
+    for start, end in zip(starts, ends):
+        window_starts, window_ends = _time_offsets(
+            sequence_index.iloc[start:end], segment_size, segment_stride=segment_stride)
+        segment_starts.append(window_starts + start)
+        segment_ends.append(window_ends + start)
+
+    segment_starts = np.concatenate(segment_starts) if segment_starts else starts
+    segment_ends = np.concatenate(segment_ends) if segment_ends else ends
+
+    # Time windows without data points do not make valid training examples
+    non_empty = segment_ends > segment_starts
+    return segment_starts[non_empty], segment_ends[non_empty]
+
+
+def _offsets_to_dicts(columns, context, starts, ends, as_arrays):
+    """Build the sequence dictionaries out of the data columns and the segment offsets."""
+    if not as_arrays:
+        return [
+            {
+                'context': [] if context is None else context[start],
+                'data': [list(values[start:end]) for values in columns],
+            }
+            for start, end in zip(starts, ends)
+        ]
+
+    if context is None:
+        context = np.empty((len(starts), 0))
+    else:
+        context = context[starts]
+
+    return [
+        {
+            'context': segment_context,
+            'data': [values[start:end] for values in columns],
+        }
+        for segment_context, start, end in zip(context, starts, ends)
+    ]
+
+
+def _segment_rows(data, rows, entity_ids, context, entity_columns,
+                  segment_size, segment_stride, sequence_index):
+    """Sort the indicated rows and compute the offsets of their segments.
+
+    Args:
+        data (pandas.DataFrame):
+            Data to segment.
+        rows (numpy.ndarray or None):
+            Positions of the rows to segment. If ``None``, all the rows are segmented
+            in their current order.
+        entity_ids (numpy.ndarray):
+            Entity id of each row of the data.
+        context (numpy.ndarray or None):
+            Context values of each row of the data, if any.
+        entity_columns (list):
+            List with the names of the columns that form each entity_id.
+        segment_size (int or pandas.Timedelta):
+            Size of each segment.
+        segment_stride (int or pandas.Timedelta):
+            Distance between the starts of two consecutive segments.
+        sequence_index (str):
+            Name of the column that will be used as the time index.
+
+    Raises:
+        ValueError:
+            If context columns are not constant within each entity or segment.
+
+    Returns:
+        tuple:
+            The positions of the rows in sorted order, or ``None`` if they were not
+            sorted, the start and end offsets of each segment within the sorted rows
+            and the entity id of each segment.
+    """
+    if rows is None:
+        order = None
+        sorted_entity_ids = entity_ids
+    else:
+        order, sorted_entity_ids = _sort_rows(data, rows, entity_ids, sequence_index)
+
+    boundaries = np.flatnonzero(sorted_entity_ids[1:] != sorted_entity_ids[:-1]) + 1
+    if len(sorted_entity_ids):
+        starts = np.concatenate([[0], boundaries])
+        ends = np.concatenate([boundaries, [len(sorted_entity_ids)]])
+    else:
+        starts = ends = boundaries
+
+    if context is not None:
+        context = context if order is None else context[order]
+        if entity_columns and not _is_constant(context, starts, ends):
+            raise ValueError('Context columns are not constant within each entity.')
+
+    sequence_index_values = None
+    if sequence_index is not None:
+        sequence_index_values = data[sequence_index].take(order).reset_index(drop=True)
+
+    starts, ends = _segment_offsets(
+        starts, ends, segment_size, segment_stride, sequence_index_values)
+    if context is not None and not entity_columns and not _is_constant(context, starts, ends):
+        raise ValueError('Context columns are not constant within each segment.')
+
+    return order, starts, ends, sorted_entity_ids[starts]
+
+
+_WORKER_ARGUMENTS = {}
+
+
+def _init_worker(arguments):
+    _WORKER_ARGUMENTS.update(arguments)
+
+
+def _segment_partition(partition):
+    """Segment the rows of the entities which belong to the indicated partition."""
+    arguments = dict(_WORKER_ARGUMENTS)
+    num_partitions = arguments.pop('num_partitions')
+    rows = np.flatnonzero(arguments['entity_ids'] % num_partitions == partition)
+    return _segment_rows(rows=rows, **arguments)
+
+
+def _parallel_segment_rows(n_jobs, **arguments):
+    """Segment the rows using multiple processes.
+
+    Entities are partitioned by id between the worker processes, which sort and
+    segment the rows of their partition and return only their positions and segment
+    offsets. When the ``fork`` start method is available, the data is inherited by
+    the worker processes instead of being pickled.
+
+    The results are merged in the order of the entity ids, which makes them identical
+    to the ones obtained by segmenting all the rows in a single process.
+    """
+    arguments['num_partitions'] = n_jobs
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+
+    with context.Pool(n_jobs, initializer=_init_worker, initargs=(arguments, )) as pool:
+        results = pool.map(_segment_partition, range(n_jobs))
+
+    orders, starts, ends, entity_ids = [], [], [], []
+    offset = 0
+    for order, partition_starts, partition_ends, partition_entity_ids in results:
+        orders.append(order)
+        starts.append(partition_starts + offset)
+        ends.append(partition_ends + offset)
+        entity_ids.append(partition_entity_ids)
+        offset += len(order)
+
+    segments = np.argsort(np.concatenate(entity_ids), kind='mergesort')
+    starts = np.concatenate(starts)[segments]
+    ends = np.concatenate(ends)[segments]
+
+    return np.concatenate(orders), starts, ends
+
+
+def _assemble(data, entity_columns, context_columns, segment_size,
+              sequence_index, drop_sequence_index, n_jobs, segment_stride):
+    """Sort the data and compute the segment offsets.
+
+    Returns:
+        tuple:
+            The sorted data columns, the sorted context values, if any, and the start
+            and end offsets of each segment.
+    """
+    entity_ids = _entity_ids(data, entity_columns)
+    context = data[context_columns].to_numpy() if context_columns else None
+    arguments = {
+        'data': data,
+        'entity_ids': entity_ids,
+        'context': context,
+        'entity_columns': entity_columns,
+        'segment_size': segment_size,
+        'segment_stride': segment_stride,
+        'sequence_index': sequence_index,
+    }
+
+    if n_jobs is not None and n_jobs < 0:
+        n_jobs = os.cpu_count()
+
+    if entity_columns and n_jobs is not None and n_jobs > 1:
+        order, starts, ends = _parallel_segment_rows(n_jobs, **arguments)
+    else:
+        rows = None
+        if entity_columns or sequence_index is not None:
+            rows = np.arange(len(data))
+
+        order, starts, ends, _ = _segment_rows(rows=rows, **arguments)
+
+    if context is not None and order is not None:
+        context = context[order]
+
+    skip_columns = entity_columns + context_columns
+    if sequence_index is not None and drop_sequence_index:
+        skip_columns = skip_columns + [sequence_index]
+
+    columns = []
+    for column in data.columns:
+        if column not in skip_columns:
+            values = data[column].to_numpy()
+            columns.append(values if order is None else values[order])
+
+    return columns, context, starts, ends
+
+
+def assemble_sequences(data, entity_columns, context_columns, segment_size, sequence_index,
+                       drop_sequence_index=True, as_arrays=False, n_jobs=None,
+                       segment_stride=None):
     """Build sequences from the data, grouping first by entity and then segmenting by size.
 
     Input is a ``pandas.DataFrame`` containing all the data, lists of entity and context
@@ -138,14 +1016,19 @@ def assemble_sequences(data, entity_columns, context_columns, segment_size,
 
     The process of building the sequences consists on:
 
-    1. First group by the entity columns. If no entity columns are given this
-       step is skipped.
+    1. First sort the data by the entity columns and the sequence index, and locate
+       the rows that belong to each entity. If no entity columns are given, all the
+       data is considered to belong to a single entity.
     2. Then segment the data that corresponds to each data using the segment_size
        and sequence_index details.
     3. Finally build dictionaries out of each segment, containing two elements:
         * `context`: List of contextual values.
         * `data`: List containing one list for each data column, containing its values.
 
+    If ``as_arrays`` is ``True``, the values of each data column are given as
+    ``numpy.ndarray`` views over the sorted data instead of lists, and the context
+    as a ``numpy.ndarray``, which avoids creating one Python object per value.
+
     Args:
         data (pandas.DataFrame):
             Data to assemble in sequences, containing entity columns, context columns
@@ -165,6 +1048,18 @@ def assemble_sequences(data, entity_columns, context_columns, segment_size,
             segmentation. Required if a timedelta ``segment_size`` is passed.
         drop_sequence_index (bool):
             Whether to drop the sequence index after sorting. Defaults to ``True``.
+        as_arrays (bool):
+            Whether to return the context and data values as ``numpy.ndarray`` objects
+            instead of lists. Defaults to ``False``.
+        n_jobs (int):
+            Number of processes to use to sort and segment the entities. If ``-1``,
+            use all the available CPUs. If ``None`` (default), use a single process.
+            The output is the same regardless of the number of processes.
+        segment_stride (int or pandas.Timedelta):
+            Distance between the starts of two consecutive segments, of the same type
+            as the ``segment_size``. If smaller than the ``segment_size``, segments
+            overlap, and the values of the overlapping segments are not copied when
+            ``as_arrays`` is ``True``. Defaults to the ``segment_size``.
 
     Raises:
         ValueError:
@@ -172,20 +1067,61 @@ def assemble_sequences(data, entity_columns, context_columns, segment_size,
 
     Returns:
         list:
-            List of ``pandas.DataFrames`` containing each segment.
+            List of dictionaries containing the context and data of each segment.
     """
-    if not entity_columns:
-        segments = segment_sequence(data, segment_size, sequence_index, drop_sequence_index)
-    else:
-        segments = []
-        for _, sequence in data.groupby(entity_columns):
-            sequence.drop(entity_columns, axis=1, inplace=True)
-            if context_columns:
-                if len(sequence[context_columns].drop_duplicates()) > 1:
-                    raise ValueError('Context columns are not constant within each entity.')
-
-            entity_segments = segment_sequence(sequence, segment_size,
-                                               sequence_index, drop_sequence_index)
-            segments.extend(entity_segments)
-
-    return _convert_to_dicts(segments, context_columns)
+    columns, context, starts, ends = _assemble(data, entity_columns, context_columns, segment_size,
+                                               sequence_index, drop_sequence_index, n_jobs,
+                                               segment_stride)
+
+    return _offsets_to_dicts(columns, context, starts, ends, as_arrays)
+
+
+def assemble_batch(data, entity_columns, context_columns, segment_size,
+                   sequence_index, drop_sequence_index=True, n_jobs=None, segment_stride=None):
+    """Build a ``SequenceBatch`` from the data.
+
+    The sequences are built following the same process as in ``assemble_sequences``,
+    but instead of building one dictionary for each segment the ``SequenceBatch``
+    references the segments within the sorted data columns.
+
+    Args:
+        data (pandas.DataFrame):
+            Data to assemble in sequences, containing entity columns, context columns
+            and data columns.
+        entity_columns (list):
+            List with the names of the columns that form each entity_id.
+        context_columns (list):
+            List with the names of the columns that act as context for each entity or
+            segment.
+        segment_size (int or pandas.Timedelta):
+            Size of each segment, passed as an integer or as a``pandas.Timedelta``
+            object.
+        sequence_index (str):
+            Name of the column that will be used as the time index for the
+            segmentation. Required if a timedelta ``segment_size`` is passed.
+        drop_sequence_index (bool):
+            Whether to drop the sequence index after sorting. Defaults to ``True``.
+        n_jobs (int):
+            Number of processes to use to sort and segment the entities. If ``-1``,
+            use all the available CPUs. If ``None`` (default), use a single process.
+        segment_stride (int or pandas.Timedelta):
+            Distance between the starts of two consecutive segments, of the same type
+            as the ``segment_size``. Overlapping segments share the same values within
+            the ``SequenceBatch`` data arrays. Defaults to the ``segment_size``.
+
+    Raises:
+        ValueError:
+            If context columns are not constant within each entity or segment.
+
+    Returns:
+        SequenceBatch:
+            The assembled sequences.
+    """
+    columns, context, starts, ends = _assemble(data, entity_columns, context_columns, segment_size,
+                                               sequence_index, drop_sequence_index, n_jobs,
+                                               segment_stride)
+
+    if context is not None:
+        context = context[starts]
+
+    return SequenceBatch(columns, starts, ends, context)
@@ -0,0 +1,204 @@
+"""Helpers to persist DeepEcho artifacts on disk.
+
+Artifacts are stored as directories that contain a ``header.json`` file with
+the JSON serializable metadata and one ``.npy`` file per array, which can be
+memory-mapped when loaded back.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+HEADER_NAME = 'header.json'
+FORMAT_VERSION = 1
+
+
+def _encode(value):
+    """Convert a value to a JSON serializable structure.
+
+    Dicts are stored as lists of key-value pairs, so that keys which are not
+    strings, such as ``None`` or integers, survive the round trip, and tuples
+    are told apart from lists.
+    """
+    if isinstance(value, dict):
+        return {'__dict__': [[_encode(key), _encode(item)] for key, item in value.items()]}
+    if isinstance(value, tuple):
+        return {'__tuple__': [_encode(item) for item in value]}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return {'__timestamp__': pd.Timestamp(value).isoformat()}
+    if isinstance(value, (pd.Timedelta, np.timedelta64)):
+        return {'__timedelta__': pd.Timedelta(value).isoformat()}
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+
+    raise TypeError('Cannot store values of type {}'.format(type(value).__name__))
+
+
+def _decode(value):
+    """Rebuild a value previously converted with ``_encode``."""
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if isinstance(value, dict):
+        if '__dict__' in value:
+            return {_decode(key): _decode(item) for key, item in value['__dict__']}
+        if '__tuple__' in value:
+            return tuple(_decode(item) for item in value['__tuple__'])
+        if '__timestamp__' in value:
+            return pd.Timestamp(value['__timestamp__'])
+        if '__timedelta__' in value:
+            return pd.Timedelta(value['__timedelta__'])
+
+    return value
+
+
+def _parse_constant(constant):
+    # Use the ``np.nan`` singleton so that NaN dict keys can be looked up again.
+    return {'NaN': np.nan, 'Infinity': np.inf, '-Infinity': -np.inf}[constant]
+
+
+def fingerprint(data, **parameters):
+    """Compute a hash that identifies a DataFrame and the given parameters.
+
+    Args:
+        data (pandas.DataFrame):
+            The data to hash. Both the values and the column names and dtypes
+            are taken into account.
+        **parameters:
+            Additional values, like the column roles, that also identify the
+            result computed from the data. They must be JSON serializable once
+            their ``repr`` is taken.
+
+    Returns:
+        str:
+            Hexadecimal sha256 digest.
+    """
+    digest = hashlib.sha256()
+    digest.update(str(FORMAT_VERSION).encode())
+    columns = [[str(column), str(dtype)] for column, dtype in data.dtypes.items()]
+    digest.update(json.dumps(columns).encode())
+    parameters = {name: repr(value) for name, value in parameters.items()}
+    digest.update(json.dumps(parameters, sort_keys=True).encode())
+    hashes = pd.util.hash_pandas_object(data, index=False).to_numpy()
+    digest.update(np.ascontiguousarray(hashes).tobytes())
+
+    return digest.hexdigest()
+
+
+@contextlib.contextmanager
+def writing(path):
+    """Write a directory in a temporary location and move it in place when done.
+
+    An interrupted write never leaves a partially written directory behind.
+    An existing directory is replaced.
+
+    Args:
+        path (str):
+            Path to the output directory.
+
+    Yields:
+        str:
+            Path to the temporary directory to write to.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+    try:
+        # mkdtemp creates the directory only readable by its owner
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o777 & ~umask)
+
+        yield tmp_path
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+        os.rename(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def write_header(directory, header):
+    """Write the header of an artifact being written with ``writing``."""
+    with open(os.path.join(directory, HEADER_NAME), 'w') as header_file:
+        json.dump(_encode(header), header_file)
+
+
+def write_array(directory, name, array):
+    """Write an array of an artifact being written with ``writing``."""
+    np.save(os.path.join(directory, name + '.npy'), array, allow_pickle=False)
+
+
+def open_array(directory, name, dtype, shape):
+    """Create an array of an artifact being written with ``writing``.
+
+    The array is memory-mapped, so it can be filled in parts without
+    holding it in memory.
+
+    Returns:
+        numpy.memmap
+    """
+    return np.lib.format.open_memmap(
+        os.path.join(directory, name + '.npy'), mode='w+', dtype=dtype, shape=shape)
+
+
+def save(path, header, arrays):
+    """Store a header and a collection of arrays in the given directory.
+
+    The directory is written atomically, see ``writing``.
+
+    Args:
+        path (str):
+            Path to the output directory.
+        header (dict):
+            Metadata to store as JSON.
+        arrays (dict[str, numpy.ndarray]):
+            Arrays to store, by name. Arrays of ``object`` dtype are not supported.
+    """
+    with writing(path) as tmp_path:
+        write_header(tmp_path, header)
+        for name, array in arrays.items():
+            write_array(tmp_path, name, array)
+
+
+def load(path, mmap_mode='c'):
+    """Load a header and the arrays stored with ``save``.
+
+    Args:
+        path (str):
+            Path to the directory.
+        mmap_mode (str or None):
+            Mode used to memory-map the arrays. Defaults to ``'c'`` (copy-on-write),
+            which keeps the arrays on disk until they are read but allows them to
+            be modified in memory. If ``None``, read the arrays in memory.
+
+    Returns:
+        tuple[dict, dict[str, numpy.ndarray]]:
+            The header and the arrays by name.
+    """
+    with open(os.path.join(path, HEADER_NAME)) as header_file:
+        header = _decode(json.load(header_file, parse_constant=_parse_constant))
+
+    arrays = {}
+    for filename in sorted(os.listdir(path)):
+        if filename.endswith('.npy'):
+            array_path = os.path.join(path, filename)
+            arrays[filename[:-4]] = np.load(array_path, mmap_mode=mmap_mode, allow_pickle=False)
+
+    return header, arrays
+
+
+def exists(path):
+    """Tell whether the given path contains a complete stored artifact."""
+    return os.path.isfile(os.path.join(path, HEADER_NAME))
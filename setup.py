@@ -18,6 +18,10 @@ install_requires = [
     'tqdm>=4,<5',
 ]
 
+arrow_requires = [
+    'pyarrow>=1,<15',
+]
+
 setup_requires = [
     'pytest-runner>=2.11.1',
 ]
@@ -79,8 +83,9 @@ setup(
     ],
     description='Mixed-type multivariate time series modeling with generative adversarial networks.',
     extras_require={
-        'test': tests_require,
-        'dev': development_requires + tests_require,
+        'arrow': arrow_requires,
+        'test': tests_require + arrow_requires,
+        'dev': development_requires + tests_require + arrow_requires,
     },
     include_package_data=True,
     install_requires=install_requires,
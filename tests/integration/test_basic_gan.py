@@ -1,6 +1,16 @@
+import copy
+import tempfile
 import unittest
+from unittest.mock import Mock
 
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+
+from deepecho.callbacks import Callback, EarlyStopping
 from deepecho.models.basic_gan import BasicGANModel
+from deepecho.sequences import SequenceBatch
 
 
 class TestBasicGANModel(unittest.TestCase):
@@ -124,3 +134,237 @@ class TestBasicGANModel(unittest.TestCase):
         model = BasicGANModel(epochs=10)
         model.fit_sequences(sequences, context_types, data_types)
         model.sample_sequence([0])
+
+    def test_arrays(self):
+        sequences = [
+            {
+                'context': np.array([0]),
+                'data': [
+                    np.array([0.0, 0.1, 0.2, 0.3, 0.4, 0.5]),
+                    np.array(['a', 'b', 'a', 'b', 'a', 'b'], dtype=object),
+                ]
+            },
+            {
+                'context': np.array([1]),
+                'data': [
+                    np.array([0.5, 0.4, 0.3, 0.2, 0.1, 0.0]),
+                    np.array(['b', 'a', 'b', 'a', 'b', 'a'], dtype=object),
+                ]
+            }
+        ]
+        context_types = ['categorical']
+        data_types = ['continuous', 'categorical']
+
+        model = BasicGANModel(epochs=10)
+        model.fit_sequences(sequences, context_types, data_types)
+        model.sample_sequence([0])
+
+    def test_sample_sequences(self):
+        sequences = [
+            {
+                'context': [0],
+                'data': [
+                    [0.0, 0.1, 0.2, 0.3],
+                    ['a', 'b', 'a', 'b'],
+                ]
+            },
+            {
+                'context': [1],
+                'data': [
+                    [0.5, 0.4, 0.3, 0.2, 0.1, 0.0],
+                    ['b', 'a', 'b', 'a', 'b', 'a'],
+                ]
+            }
+        ]
+        context_types = ['categorical']
+        data_types = ['continuous', 'categorical']
+
+        model = BasicGANModel(epochs=1)
+        model.fit_sequences(sequences, context_types, data_types)
+        sampled = model.sample_sequences([[0], [1], [0]], [2, 3, None])
+
+        assert len(sampled) == 3
+        assert [len(values) for values in sampled[0]] == [2, 2]
+        assert [len(values) for values in sampled[1]] == [3, 3]
+        assert len(sampled[2][0]) <= 6
+        assert set(sampled[1][1]) <= {'a', 'b'}
+
+    def test_sample_seed(self):
+        data = pd.DataFrame({
+            'entity': [0, 0, 0, 1, 1, 1, 1],
+            'context': ['a', 'a', 'a', 'b', 'b', 'b', 'b'],
+            'value': [0.0, 0.1, 0.2, 0.5, 0.4, 0.3, 0.2],
+        })
+        model = BasicGANModel(epochs=1)
+        model.fit(data, ['entity'], ['context'])
+
+        sampled = model.sample(5, batch_size=2, seed=0)
+        parallel = model.sample(5, batch_size=2, seed=0, n_jobs=2)
+        other = model.sample(5, batch_size=2, seed=1)
+
+        pd.testing.assert_frame_equal(sampled, parallel)
+        # Entities sampled with an empty sequence have no rows
+        assert set(sampled['entity']) <= {0, 1, 2, 3, 4}
+        assert sampled['entity'].is_monotonic_increasing
+        assert not sampled.equals(other)
+
+    def test_sample_shards(self):
+        data = pd.DataFrame({
+            'entity': [0, 0, 0, 1, 1, 1, 1],
+            'context': ['a', 'a', 'a', 'b', 'b', 'b', 'b'],
+            'value': [0.0, 0.1, 0.2, 0.5, 0.4, 0.3, 0.2],
+        })
+        model = BasicGANModel(epochs=1)
+        model.fit(data, ['entity'], ['context'])
+
+        sampled = model.sample(7, batch_size=2, seed=0)
+        shards = [
+            model.sample(7, batch_size=2, seed=0, shard=shard, num_shards=3)
+            for shard in range(3)
+        ]
+
+        # Entities sampled with an empty sequence have no rows
+        for shard, entities in zip(shards, [{0, 1}, {2, 3}, {4, 5, 6}]):
+            assert set(shard['entity']) <= entities
+
+        rows = pd.concat(shards, ignore_index=True)
+        assert rows['entity'].tolist() == sampled['entity'].tolist()
+        np.testing.assert_array_equal(rows['value'].astype(float), sampled['value'])
+
+    def test_callbacks(self):
+        data = pd.DataFrame({
+            'entity': [0, 0, 0, 1, 1, 1],
+            'context': ['a', 'a', 'a', 'b', 'b', 'b'],
+            'value': [0.0, 0.1, 0.2, 0.5, 0.4, 0.3],
+        })
+        states = []
+        recorder = Mock(spec=Callback)
+        recorder.on_epoch_end.side_effect = lambda model, epoch, loss: states.append(
+            model._get_module_states()['_generator'])
+        early_stopping = EarlyStopping(patience=2, min_delta=1e9)
+
+        model = BasicGANModel(epochs=100)
+        model.fit(data, ['entity'], ['context'], callbacks=[recorder, early_stopping])
+
+        # Stopped after two epochs without improvement, back to the first weights
+        assert early_stopping.stopped_epoch == 2
+        assert len(states) == 3
+        for name, value in model._generator.state_dict().items():
+            assert torch.equal(value, states[0][name])
+            assert not torch.equal(value, states[2][name])
+
+    def test_fit_stream(self):
+        sequences = [
+            {'context': ['a' if entity % 2 else 'b'], 'data': [[0.1 * entity] * 3]}
+            for entity in range(10)
+        ]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            SequenceBatch.from_sequences(sequences).save(tmp_dir + '/sequences')
+
+            model = BasicGANModel(epochs=2)
+            model.fit_stream(tmp_dir + '/sequences', ['categorical'], ['continuous'],
+                             batch_size=4)
+
+        assert model._data_map[0]['min'] == 0
+        np.testing.assert_allclose(model._data_map[0]['max'], 0.9)
+        assert len(model.sample_sequence(['a'])[0]) == 3
+
+    def test_save_load(self):
+        data = pd.DataFrame({
+            'entity': [0, 0, 0, 1, 1, 2, 2],
+            'context': ['a', 'a', 'a', 'b', 'b', None, None],
+            'value': [0.0, 0.1, 0.2, 0.5, 0.4, 0.3, 0.2],
+        })
+        model = BasicGANModel(epochs=1)
+        model.fit(data, ['entity'], ['context'])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model.save(tmp_dir + '/model')
+            loaded = BasicGANModel.load(tmp_dir + '/model')
+
+            sampled = loaded.sample(3, seed=0)
+
+        assert isinstance(loaded, BasicGANModel)
+        pd.testing.assert_frame_equal(sampled, model.sample(3, seed=0))
+
+    def test__get_module_states(self):
+        data = pd.DataFrame({
+            'entity': [0, 0, 0, 1, 1, 1],
+            'value': [0.0, 0.1, 0.2, 0.5, 0.4, 0.3],
+        })
+        model = BasicGANModel(epochs=1)
+        model.fit(data, ['entity'])
+
+        states = model._get_module_states()
+        weights = copy.deepcopy(model._discriminator.state_dict())
+        model.partial_fit(data, epochs=2)
+        model._set_module_states(states)
+
+        assert set(states) == {
+            '_generator', '_discriminator', '_generator_opt', '_discriminator_opt'
+        }
+        for name, value in model._discriminator.state_dict().items():
+            assert torch.equal(value, weights[name])
+
+        assert model._generator_opt.state_dict()['state'][0]['step'] == 1
+
+    def test_partial_fit_no_epochs(self):
+        data = pd.DataFrame({
+            'entity': [0, 0, 0, 1, 1, 1],
+            'value': [0.0, 0.1, 0.2, 0.5, 0.4, 0.3],
+        })
+        model = BasicGANModel(epochs=1)
+        model.fit(data, ['entity'])
+        weights = copy.deepcopy(model._generator.state_dict())
+
+        model.partial_fit(data, epochs=0)
+
+        for name, value in model._generator.state_dict().items():
+            assert torch.equal(value, weights[name])
+
+        with pytest.raises(ValueError):
+            model.partial_fit(data, epochs=-1)
+
+    def test_partial_fit_new_fixed_length(self):
+        data = pd.DataFrame({
+            'entity': [0, 0, 0, 1, 1, 1],
+            'value': [0.0, 0.1, 0.2, 0.5, 0.4, 0.3],
+        })
+        new_data = pd.DataFrame({
+            'entity': [2] * 5 + [3] * 5,
+            'value': [0.1, 0.2, 0.3, 0.4, 0.5] * 2,
+        })
+        model = BasicGANModel(epochs=1)
+        model.fit(data, ['entity'])
+        model.partial_fit(new_data, epochs=1)
+
+        sampled = model.sample(5)
+
+        assert not model._fixed_length
+        assert model._max_sequence_length == 5
+        assert model._generator.linear.out_features == model._model_data_size
+        assert sampled.groupby('entity').size().max() <= 5
+
+    def test_partial_fit(self):
+        data = pd.DataFrame({
+            'entity': [0, 0, 0, 1, 1, 1],
+            'context': ['a', 'a', 'a', 'b', 'b', 'b'],
+            'value': [0.0, 0.1, 0.2, 0.5, 0.4, 0.3],
+            'category': ['x', 'y', 'x', 'y', 'x', 'y'],
+        })
+        new_data = pd.DataFrame({
+            'entity': [2, 2, 2, 2, 3, 3],
+            'context': ['c', 'c', 'c', 'c', 'a', 'a'],
+            'value': [0.3, 0.2, 0.1, 0.0, 0.1, 0.2],
+            'category': ['z', 'x', 'y', 'z', 'x', 'w'],
+        })
+        model = BasicGANModel(epochs=1)
+        model.fit(data, ['entity'], ['context'])
+        model.partial_fit(new_data, epochs=2)
+
+        sampled = model.sample(context=pd.DataFrame({'context': ['a', 'c']}))
+
+        assert set(sampled['category']) <= {'w', 'x', 'y', 'z'}
+        assert model._context_store.counts.sum() == 4
+        assert model._generator.linear.out_features == model._model_data_size
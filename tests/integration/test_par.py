@@ -1,6 +1,18 @@
+import copy
+import os
+import tempfile
 import unittest
+from unittest.mock import Mock, patch
 
-from deepecho.models.par import PARModel
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+
+from deepecho.callbacks import Callback, EarlyStopping, TargetLoss
+from deepecho.instrumentation import EventLog
+from deepecho.models.par import PARModel, PARNet
+from deepecho.sequences import SequenceBatch
 
 
 class TestPARModel(unittest.TestCase):
@@ -124,3 +136,336 @@ class TestPARModel(unittest.TestCase):
         model = PARModel()
         model.fit_sequences(sequences, context_types, data_types)
         model.sample_sequence([0])
+
+    def test_batch_size(self):
+        sequences = [
+            {'context': [entity % 2], 'data': [list(range(entity % 5 + 1))]}
+            for entity in range(20)
+        ]
+        model = PARModel(epochs=2, batch_size=4)
+        recorder = Mock(spec=Callback)
+        recorder.on_epoch_end.return_value = False
+        model.fit_sequences(sequences, ['categorical'], ['continuous'], callbacks=[recorder])
+        sampled = model.sample_sequence([0])
+
+        assert recorder.on_epoch_end.call_count == 2
+        assert len(sampled) == 1
+
+    def test_sample_sequences(self):
+        sequences = [
+            {'context': [entity % 2], 'data': [list(range(entity % 4 + 2)), ['a', None] * 3]}
+            for entity in range(10)
+        ]
+        for sequence in sequences:
+            sequence['data'][1] = sequence['data'][1][:len(sequence['data'][0])]
+
+        model = PARModel(epochs=1, sample_size=2)
+        model.fit_sequences(sequences, ['categorical'], ['count', 'categorical'])
+
+        sampled = model.sample_sequences([[0], [1], [1]], [1, 3, 6])
+        assert [len(sequence[0]) for sequence in sampled] == [1, 3, 6]
+        assert [len(sequence[1]) for sequence in sampled] == [1, 3, 6]
+        assert set(sampled[2][1]) <= {'a', None}
+
+        sampled = model.sample_sequences([[0]] * 20)
+        assert all(2 <= len(sequence[0]) <= 5 for sequence in sampled)
+
+    def test_step(self):
+        net = PARNet(data_size=4, context_size=2)
+        x = torch.randn(6, 3, 4)
+        c = torch.randn(3, 2)
+
+        with torch.no_grad():
+            expected = net(x, c)
+            hidden = None
+            outputs = []
+            for step in range(6):
+                output, hidden = net.step(x[step:step + 1], c, hidden)
+                outputs.append(output)
+
+        torch.testing.assert_close(torch.cat(outputs), expected)
+
+    def test_datetime(self):
+        data = pd.DataFrame({
+            'entity': [0, 0, 0, 1, 1, 1],
+            'time': pd.date_range(start='2000-01-01', periods=6, freq='1d'),
+            'value': [0.0, 0.1, 0.2, 0.5, 0.4, 0.3],
+        })
+        model = PARModel(epochs=1)
+        model.fit(data, ['entity'])
+
+        sampled = model.sample(2)
+
+        assert model._data_types == ['datetime', 'continuous']
+        assert sampled['time'].dtype.kind == 'M'
+
+    def test_arrays(self):
+        sequences = [
+            {
+                'context': np.array([0]),
+                'data': [
+                    np.array([0.0, 0.1, 0.2, 0.3, 0.4, 0.5]),
+                    np.array(['a', 'b', 'a', 'b', 'a', 'b'], dtype=object),
+                ]
+            },
+            {
+                'context': np.array([1]),
+                'data': [
+                    np.array([0.5, 0.4, 0.3, 0.2, 0.1, 0.0]),
+                    np.array(['b', 'a', 'b', 'a', 'b', 'a'], dtype=object),
+                ]
+            }
+        ]
+        context_types = ['categorical']
+        data_types = ['continuous', 'categorical']
+
+        model = PARModel()
+        model.fit_sequences(sequences, context_types, data_types)
+        model.sample_sequence([0])
+
+    def test_cache_dir(self):
+        data = pd.DataFrame({
+            'entity': [0, 0, 0, 1, 1, 1, 1],
+            'context': ['a', 'a', 'a', 'b', 'b', 'b', 'b'],
+            'value': [0.0, 0.1, 0.2, 0.5, 0.4, 0.3, 0.2],
+            'category': ['x', 'y', 'x', 'y', 'x', None, 'y'],
+        })
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            model = PARModel(epochs=1)
+            model.fit(data, ['entity'], ['context'], cache_dir=cache_dir)
+
+            cached = PARModel(epochs=1)
+            with patch('deepecho.models.base.assemble_batch') as assemble_mock:
+                cached.fit(data, ['entity'], ['context'], cache_dir=cache_dir)
+
+            assemble_mock.assert_not_called()
+            assert cached._data_map == model._data_map
+            assert cached._ctx_map == model._ctx_map
+            assert cached._max_length == model._max_length
+            cached.sample_sequence(['b'])
+
+    def test_fit_arrow(self):
+        pyarrow = pytest.importorskip('pyarrow')
+        parquet = pytest.importorskip('pyarrow.parquet')
+        data = pd.DataFrame({
+            'entity': [0, 0, 0, 1, 1, 1, 1],
+            'context': ['a', 'a', 'a', 'b', 'b', 'b', 'b'],
+            'value': [0.0, 0.1, 0.2, 0.5, 0.4, 0.3, 0.2],
+            'category': ['x', 'y', 'x', 'y', 'x', None, 'y'],
+        })
+        table = pyarrow.Table.from_pandas(data)
+
+        model = PARModel(epochs=1)
+        model.fit(data, ['entity'], ['context'])
+
+        table_model = PARModel(epochs=1)
+        table_model.fit(table, ['entity'], ['context'])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'data.parquet')
+            parquet.write_table(table, path)
+            path_model = PARModel(epochs=1)
+            path_model.fit(path, ['entity'], ['context'])
+
+        # Category indices follow the set iteration order, so only compare the categories
+        def categories(data_map):
+            return {
+                column: set(properties['indices'])
+                for column, properties in data_map.items()
+                if properties['type'] == 'categorical'
+            }
+
+        assert categories(table_model._data_map) == categories(model._data_map)
+        assert categories(path_model._data_map) == categories(model._data_map)
+        assert categories(path_model._ctx_map) == categories(model._ctx_map)
+        assert path_model._data_map[0] == model._data_map[0]
+        path_model.sample(1)
+
+    def test_sample_seed(self):
+        data = pd.DataFrame({
+            'entity': [0, 0, 0, 1, 1, 1, 1],
+            'context': ['a', 'a', 'a', 'b', 'b', 'b', 'b'],
+            'value': [0.0, 0.1, 0.2, 0.5, 0.4, 0.3, 0.2],
+        })
+        model = PARModel(epochs=1)
+        model.fit(data, ['entity'], ['context'])
+
+        sampled = model.sample(5, batch_size=2, seed=0)
+        parallel = model.sample(5, batch_size=2, seed=0, n_jobs=2)
+        other = model.sample(5, batch_size=2, seed=1)
+
+        pd.testing.assert_frame_equal(sampled, parallel)
+        assert sampled['entity'].unique().tolist() == [0, 1, 2, 3, 4]
+        assert not sampled.equals(other)
+
+    def test_instrumentation(self):
+        data = pd.DataFrame({
+            'entity': [0, 0, 0, 1, 1, 1, 1],
+            'context': ['a', 'a', 'a', 'b', 'b', 'b', 'b'],
+            'value': [0.0, 0.1, 0.2, 0.5, 0.4, 0.3, 0.2],
+        })
+        model = PARModel(epochs=2)
+        log = EventLog()
+        model.set_instrumentation(log)
+        model.fit(data, ['entity'], ['context'])
+        model.sample(3, batch_size=2)
+
+        stages = [event['stage'] for event in log.events]
+        assert stages == [
+            'to_dataframe', 'assemble_sequences', 'validate', 'analyze', 'encode',
+            'epoch', 'epoch', 'train', 'store_context', 'fit',
+            'sample_sequences', 'sample_chunk', 'sample_sequences', 'sample_chunk',
+        ]
+        assert log.events[1]['num_sequences'] == 2
+        assert isinstance(log.events[5]['loss'], float)
+
+    def test_callbacks(self):
+        data = pd.DataFrame({
+            'entity': [0, 0, 0, 1, 1, 1, 1],
+            'context': ['a', 'a', 'a', 'b', 'b', 'b', 'b'],
+            'value': [0.0, 0.1, 0.2, 0.5, 0.4, 0.3, 0.2],
+        })
+        model = PARModel(epochs=100)
+        log = EventLog()
+        model.set_instrumentation(log)
+        early_stopping = EarlyStopping(patience=100)
+        model.fit(data, ['entity'], ['context'], callbacks=[TargetLoss(np.inf), early_stopping])
+
+        epochs = [event for event in log.events if event['stage'] == 'epoch']
+        assert len(epochs) == 1
+        assert early_stopping.best_loss == epochs[0]['loss']
+
+    def test_fit_stream(self):
+        def sequences():
+            for entity in range(10):
+                length = entity % 3 + 2
+                yield {
+                    'context': ['a' if entity % 2 else 'b'],
+                    'data': [[0.1 * entity] * length, ['x', 'y', 'x', 'y'][:length]],
+                }
+
+        model = PARModel(epochs=2)
+        model.fit_stream(sequences(), ['categorical'], ['continuous', 'categorical'],
+                         batch_size=4, chunk_size=3)
+
+        assert (model._min_length, model._max_length) == (2, 4)
+        assert set(model._data_map[1]['indices']) == {'x', 'y'}
+        sequence = model.sample_sequence(['a'])
+        assert set(sequence[1]) <= {'x', 'y'}
+
+    def test__encode_batch(self):
+        sequences = SequenceBatch.from_sequences([
+            {'context': ['a'], 'data': [[1.0, None], ['x', 'y']]},
+            {'context': [None], 'data': [[3.0], [None]]},
+        ])
+        model = PARModel(epochs=1)
+        model._analyze_sequences(sequences, ['categorical'], ['continuous', 'categorical'])
+
+        arrays = model._encode_batch(sequences)
+
+        # mu, sigma, missing, x, y, None, <START>, <END>, <BODY>
+        expected_data = [
+            [0, 0, 0, 0, 0, 0, 0, 1, 0, 0],
+            [-1, 0, 0, 0, 1, 0, 0, 0, 0, 1],
+            [0, 0, 1, 0, 0, 1, 0, 0, 0, 1],
+            [0, 0, 0, 0, 0, 0, 0, 0, 1, 0],
+            [0, 0, 0, 0, 0, 0, 0, 1, 0, 0],
+            [1, 0, 0, 0, 0, 0, 1, 0, 0, 1],
+            [0, 0, 0, 0, 0, 0, 0, 0, 1, 0],
+        ]
+        np.testing.assert_array_equal(arrays['data'], expected_data)
+        np.testing.assert_array_equal(arrays['lengths'], [4, 3])
+        np.testing.assert_array_equal(arrays['context'], [[0, 1, 0], [0, 0, 1]])
+
+    def test__compute_loss_padding(self):
+        model = PARModel(epochs=1)
+        model._data_map = {
+            0: {'type': 'continuous', 'indices': (0, 1, 2)},
+            1: {'type': 'count', 'range': 4, 'indices': (3, 4, 5)},
+            2: {'type': 'categorical', 'indices': {'a': 6, 'b': 7}},
+        }
+        X_padded = torch.rand(5, 2, 8)
+        Y_padded = torch.randn(5, 2, 8)
+        seq_len = [6, 3]
+
+        loss = model._compute_loss(X_padded, Y_padded, seq_len)
+        X_padded[2:, 1] = float('nan')
+        Y_padded[2:, 1] = float('nan')
+        padded_loss = model._compute_loss(X_padded, Y_padded, seq_len)
+
+        assert torch.isfinite(loss)
+        assert padded_loss == loss
+
+    def test__compute_loss_batch_size(self):
+        model = PARModel(epochs=1)
+        model._data_map = {
+            0: {'type': 'continuous', 'indices': (0, 1, 2)},
+            1: {'type': 'categorical', 'indices': {'a': 3, 'b': 4}},
+        }
+        X_padded = torch.rand(5, 1, 5)
+        Y_padded = torch.randn(5, 1, 5)
+
+        loss = model._compute_loss(X_padded, Y_padded, [6])
+        batch_loss = model._compute_loss(
+            X_padded.repeat(1, 256, 1), Y_padded.repeat(1, 256, 1), [6] * 256)
+
+        torch.testing.assert_close(batch_loss, loss)
+
+    def test_save_load(self):
+        data = pd.DataFrame({
+            'entity': [0, 0, 0, 1, 1, 2, 2],
+            'context': ['a', 'a', 'a', 'b', 'b', None, None],
+            'value': [0.0, 0.1, 0.2, 0.5, 0.4, 0.3, 0.2],
+        })
+        model = PARModel(epochs=1)
+        model.fit(data, ['entity'], ['context'])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model.save(tmp_dir + '/model')
+            loaded = PARModel.load(tmp_dir + '/model')
+
+            sampled = loaded.sample(3, seed=0)
+
+        assert isinstance(loaded, PARModel)
+        pd.testing.assert_frame_equal(sampled, model.sample(3, seed=0))
+
+    def test_partial_fit_no_epochs(self):
+        data = pd.DataFrame({
+            'entity': [0, 0, 0, 1, 1, 1],
+            'value': [0.0, 0.1, 0.2, 0.5, 0.4, 0.3],
+        })
+        model = PARModel(epochs=1)
+        model.fit(data, ['entity'])
+        weights = copy.deepcopy(model._model.state_dict())
+
+        model.partial_fit(data, epochs=0)
+
+        for name, value in model._model.state_dict().items():
+            assert torch.equal(value, weights[name])
+
+        with pytest.raises(ValueError):
+            model.partial_fit(data, epochs=-1)
+
+    def test_partial_fit(self):
+        data = pd.DataFrame({
+            'entity': [0, 0, 0, 1, 1, 1],
+            'context': ['a', 'a', 'a', 'b', 'b', 'b'],
+            'value': [0.0, 0.1, 0.2, 0.5, 0.4, 0.3],
+            'category': ['x', 'y', 'x', 'y', 'x', 'y'],
+        })
+        new_data = pd.DataFrame({
+            'entity': [2, 2, 2, 2, 3, 3],
+            'context': ['c', 'c', 'c', 'c', 'a', 'a'],
+            'value': [0.3, 0.2, 0.1, 0.0, 0.1, 0.2],
+            'category': ['z', 'x', 'y', 'z', 'x', 'w'],
+        })
+        model = PARModel(epochs=1)
+        model.fit(data, ['entity'], ['context'])
+        model.partial_fit(new_data, epochs=2)
+
+        sampled = model.sample(context=pd.DataFrame({'context': ['a', 'c']}))
+
+        assert set(sampled['category']) <= {'w', 'x', 'y', 'z'}
+        assert model._context_store.counts.sum() == 4
+        assert model._model.up.out_features == model._data_dims
@@ -0,0 +1,267 @@
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from deepecho.context import ContextStore
+from deepecho.models.base import DeepEcho
+from deepecho.sequences import SequenceBatch
+
+
+def test__validate():
+    sequences = [
+        {'context': [1], 'data': [[1, 2, 3], ['a', 'b', 'c']]},
+        {'context': [2], 'data': [np.array([1]), np.array(['a'], dtype=object)]},
+    ]
+
+    DeepEcho._validate(sequences, ['categorical'], ['continuous', 'categorical'])
+
+
+def test__validate_invalid_sequences():
+    sequences = [
+        {'context': [1], 'data': [[1, 2, 3], ['a', 'b', 'c']]},
+        {'context': [], 'data': [[1, 2, 3], ['a', 'b']]},
+        {'context': [1], 'data': [[1, 2, 3]]},
+        {'context': [1, 2], 'data': [[1], ['a', 'b']]},
+    ]
+
+    message = (
+        r'Invalid sequences: sequences \[1, 3\] do not have 1 context values; '
+        r'sequences \[2\] do not have 2 data columns; '
+        r'sequences \[1, 3\] have data columns of different lengths.'
+    )
+    with pytest.raises(ValueError, match=message):
+        DeepEcho._validate(sequences, ['categorical'], ['continuous', 'categorical'])
+
+
+def test__validate_invalid_types():
+    with pytest.raises(ValueError, match='Invalid data types'):
+        DeepEcho._validate([], ['categorical'], ['continuous', 'text'])
+
+
+def test__validate_sequence_batch():
+    sequences = SequenceBatch(
+        data=[np.arange(5)],
+        starts=np.array([0, 2]),
+        ends=np.array([2, 5]),
+        context=np.array([[1], [2]]),
+    )
+
+    DeepEcho._validate(sequences, ['categorical'], ['continuous'])
+    with pytest.raises(ValueError, match='1 context values instead of 0'):
+        DeepEcho._validate(sequences, [], ['continuous'])
+
+
+class DummyModel(DeepEcho):
+
+    _verbose = False
+    _entity_columns = ['entity']
+    _context_columns = ['context']
+    _data_columns = ['data']
+    _output_columns = ['entity', 'context', 'data']
+
+    def sample_sequence(self, context, sequence_length=None):
+        return [[context[0]] * (sequence_length or context[0])]
+
+
+def test_sample_sequences():
+    model = DummyModel()
+
+    out = model.sample_sequences([[1], [2]], [3, None])
+
+    assert out == [[[1, 1, 1]], [[2, 2]]]
+
+
+def test_sample():
+    model = DummyModel()
+    context = pd.DataFrame({'context': [1, 3, 2]})
+
+    out = model.sample(context=context, batch_size=2)
+
+    expected = pd.DataFrame({
+        'entity': [0, 1, 1, 1, 2, 2],
+        'context': [1, 3, 3, 3, 2, 2],
+        'data': [1, 3, 3, 3, 2, 2],
+    })
+    pd.testing.assert_frame_equal(out, expected)
+
+
+@patch('deepecho.models.base.multiprocessing')
+def test_sample_without_fork(multiprocessing_mock):
+    """Without ``fork``, the chunks are sampled in this process."""
+    multiprocessing_mock.get_all_start_methods.return_value = ['spawn']
+    model = DummyModel()
+    context = pd.DataFrame({'context': [1, 3, 2]})
+
+    out = model.sample(context=context, batch_size=2, n_jobs=2)
+
+    assert out['data'].tolist() == [1, 3, 3, 3, 2, 2]
+    multiprocessing_mock.get_context.assert_not_called()
+
+
+def test_sample_iter():
+    model = DummyModel()
+    model._context_store = ContextStore.from_frame(pd.DataFrame({'context': [1, 2]}))
+
+    chunks = list(model.sample_iter(5, chunk_size=2))
+
+    assert [chunk['entity'].unique().tolist() for chunk in chunks] == [[0, 1], [2, 3], [4]]
+    for chunk in chunks:
+        assert chunk['context'].isin([1, 2]).all()
+        assert (chunk['data'] == chunk['context']).all()
+
+
+def test_sample_to_parquet(tmp_path):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    model = DummyModel()
+    context = pd.DataFrame({'context': [1, 3, 2]})
+    path = str(tmp_path / 'sampled.parquet')
+
+    model.sample_to_parquet(path, context=context, chunk_size=2)
+
+    parquet_file = parquet.ParquetFile(path)
+    assert parquet_file.num_row_groups == 2
+    expected = model.sample(context=context).astype({'data': float})
+    pd.testing.assert_frame_equal(parquet_file.read().to_pandas(), expected)
+
+
+class MissingFirstModel(DummyModel):
+
+    _data_types = ['categorical']
+
+    def _get_data_categories(self, index):
+        return ['x', None]
+
+    def sample_sequence(self, context, sequence_length=None):
+        return [[{1: None, 2: 'x', 3: 1}[context[0]]] * 2]
+
+
+def test_sample_to_parquet_missing_first_chunk(tmp_path):
+    """A column with only missing values in the first chunk gets its fitted type."""
+    parquet = pytest.importorskip('pyarrow.parquet')
+    model = MissingFirstModel()
+    context = pd.DataFrame({'context': [1, 2]})
+    path = str(tmp_path / 'sampled.parquet')
+
+    model.sample_to_parquet(path, context=context, chunk_size=1)
+
+    table = parquet.read_table(path)
+    assert str(table.schema.field('data').type) == 'string'
+    assert table.column('data').to_pylist() == [None, None, 'x', 'x']
+
+
+def test_sample_to_parquet_no_entities(tmp_path):
+    """If no entities are sampled, a file with the schema and no rows is written."""
+    parquet = pytest.importorskip('pyarrow.parquet')
+    model = MissingFirstModel()
+    model._context_store = ContextStore.from_frame(pd.DataFrame({'context': [1, 2]}))
+    path = str(tmp_path / 'sampled.parquet')
+
+    model.sample_to_parquet(path, num_entities=0)
+
+    table = parquet.read_table(path)
+    assert table.num_rows == 0
+    assert table.column_names == ['entity', 'context', 'data']
+    assert str(table.schema.field('context').type) == 'int64'
+    assert str(table.schema.field('data').type) == 'string'
+
+
+def test_sample_to_parquet_error(tmp_path):
+    """If a chunk cannot be written, the partial file is removed."""
+    pyarrow = pytest.importorskip('pyarrow')
+    model = MissingFirstModel()
+    context = pd.DataFrame({'context': [2, 3]})
+    path = tmp_path / 'sampled.parquet'
+
+    with pytest.raises(pyarrow.ArrowException):
+        model.sample_to_parquet(str(path), context=context, chunk_size=1)
+
+    assert not path.exists()
+
+
+def test__get_chunk_tasks():
+    tasks = [DeepEcho._get_chunk_tasks(7, 2, shard, 3) for shard in range(3)]
+
+    assert tasks == [
+        [(0, 0, 2)],
+        [(1, 2, 2)],
+        [(2, 4, 2), (3, 6, 1)],
+    ]
+    with pytest.raises(ValueError):
+        DeepEcho._get_chunk_tasks(7, 2, 3, 3)
+
+
+def test__extend_index_map():
+    mapping = {
+        0: {'type': 'categorical', 'indices': {'a': 0, 'b': 1}},
+        1: {'type': 'continuous', 'indices': (2, 3)},
+        2: {'type': 'categorical', 'indices': {'x': 4}},
+    }
+
+    positions, num_dims = DeepEcho._extend_index_map(mapping, 6, {0: ['c'], 2: ['y', 'z']})
+
+    assert positions.tolist() == [0, 1, 3, 4, 5, 8]
+    assert num_dims == 9
+    assert mapping == {
+        0: {'type': 'categorical', 'indices': {'a': 0, 'b': 1, 'c': 2}},
+        1: {'type': 'continuous', 'indices': (3, 4)},
+        2: {'type': 'categorical', 'indices': {'x': 5, 'y': 6, 'z': 7}},
+    }
+
+
+def test__batch_indices():
+    lengths = np.array([5, 1, 4, 2, 3, 1, 5, 2, 4, 3])
+    model = DummyModel()
+
+    batches = model._batch_indices(lengths, 4)
+
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert sorted(np.concatenate(batches).tolist()) == list(range(10))
+
+
+def test__batch_indices_bucket_by_length():
+    lengths = np.array([5, 1, 4, 2, 3, 1, 5, 2, 4, 3])
+    model = DummyModel()
+    model._BUCKET_BY_LENGTH = True
+
+    batches = model._batch_indices(lengths, 2)
+
+    assert sorted(np.concatenate(batches).tolist()) == list(range(10))
+    assert sorted(lengths[batch].tolist() for batch in batches) == [
+        [1, 1], [2, 2], [3, 3], [4, 4], [5, 5]
+    ]
+
+
+@pytest.mark.parametrize('segment_size, segment_stride, error', [
+    (2, 0, ValueError),
+    (2, -1, ValueError),
+    (2, '1d', TypeError),
+    ('2d', 2, TypeError),
+    ('2d', '0s', ValueError),
+    ('2d', '-1d', ValueError),
+])
+def test_fit_invalid_segment_stride(segment_size, segment_stride, error):
+    data = pd.DataFrame({
+        'entity': [0, 0, 0, 0],
+        'time': pd.date_range(start='2001-01-01', periods=4, freq='1d'),
+        'data': [1, 2, 3, 4],
+    })
+
+    with pytest.raises(error):
+        DummyModel().fit(data, entity_columns=['entity'], sequence_index='time',
+                         segment_size=segment_size, segment_stride=segment_stride)
+
+
+def test_fit_fit_sequences_without_callbacks():
+    """Models overriding ``fit_sequences`` without ``callbacks`` can be fitted."""
+    class ThreeArgumentModel(DeepEcho):
+
+        def fit_sequences(self, sequences, context_types, data_types):
+            self.fitted_sequences = sequences
+
+    data = pd.DataFrame({'entity': [0, 0, 1], 'data': [1, 2, 3]})
+    model = ThreeArgumentModel()
+    model.fit(data, entity_columns=['entity'])
+
+    assert len(model.fitted_sequences) == 2
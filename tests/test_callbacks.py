@@ -0,0 +1,66 @@
+from unittest.mock import Mock
+
+from deepecho.callbacks import CallbackList, EarlyStopping, TargetLoss, TimeBudget
+
+
+def run_epochs(callbacks, losses, model=None):
+    callbacks = CallbackList(callbacks)
+    callbacks.on_train_begin(model)
+    epochs = 0
+    for epoch, loss in enumerate(losses):
+        epochs += 1
+        if callbacks.on_epoch_end(model, epoch, loss):
+            break
+
+    callbacks.on_train_end(model)
+    return epochs
+
+
+def test_early_stopping():
+    model = Mock()
+    model._get_module_states.side_effect = lambda: {'epoch': model.epoch}
+    callback = EarlyStopping(patience=2, min_delta=0.1)
+
+    losses = [3.0, 2.0, 1.95, 1.5, 1.45, 1.42, 1.0]
+    epochs = 0
+    callback.on_train_begin(model)
+    for epoch, loss in enumerate(losses):
+        model.epoch = epoch
+        epochs += 1
+        if callback.on_epoch_end(model, epoch, loss):
+            break
+
+    callback.on_train_end(model)
+
+    assert epochs == 6
+    assert callback.best_loss == 1.5
+    assert callback.best_epoch == 3
+    assert callback.stopped_epoch == 5
+    model._set_module_states.assert_called_once_with({'epoch': 3})
+
+
+def test_early_stopping_without_restore():
+    model = Mock()
+    callback = EarlyStopping(patience=1, restore_best_weights=False)
+
+    assert run_epochs([callback], [1.0, 2.0, 0.5], model) == 2
+    model._get_module_states.assert_not_called()
+    model._set_module_states.assert_not_called()
+
+
+def test_target_loss():
+    assert run_epochs([TargetLoss(1.0)], [3.0, 2.0, 1.0, 0.5]) == 3
+
+
+def test_time_budget():
+    callback = TimeBudget('20min')
+
+    assert callback.max_time == 1200
+    assert run_epochs([callback], [3.0, 2.0, 1.0]) == 3
+    assert run_epochs([TimeBudget(0)], [3.0, 2.0, 1.0]) == 1
+
+
+def test_callback_list():
+    assert not CallbackList()
+    callbacks = [TargetLoss(2.0), EarlyStopping(patience=5)]
+    assert run_epochs(callbacks, [3.0, 2.0, 1.0], Mock()) == 2
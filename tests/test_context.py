@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+from deepecho.context import ContextStore, _alias_table
+
+
+def test__alias_table():
+    weights = np.array([1, 2, 3, 4])
+    probabilities, aliases = _alias_table(weights)
+
+    # The probability of each index is the chance of drawing it directly plus
+    # the chance of drawing one of the indices that alias it.
+    totals = probabilities.copy()
+    np.add.at(totals, aliases, 1 - probabilities)
+    np.testing.assert_allclose(totals / len(weights), weights / weights.sum())
+
+
+def test_from_data():
+    data = pd.DataFrame({
+        'entity': [0, 0, 0, 1, 1, 2, 3],
+        'context': ['a', 'a', 'a', 'b', 'b', 'a', None],
+        'data': [1, 2, 3, 4, 5, 6, 7],
+    })
+
+    store = ContextStore.from_data(data, ['entity'], ['context'])
+
+    frame = store.to_frame()
+    counts = dict(zip(frame['context'], store.counts))
+    assert counts == {'a': 2, 'b': 1, None: 1}
+
+
+def test_sample():
+    frame = pd.DataFrame({'context': ['a', 'b', 'a', 'a'], 'other': [1, 2, 1, 1]})
+    store = ContextStore.from_frame(frame)
+
+    sampled = store.sample(10000, np.random.RandomState(0))
+
+    assert len(store) == 2
+    assert list(sampled.columns) == ['context', 'other']
+    assert (sampled['other'] == sampled['context'].map({'a': 1, 'b': 2})).all()
+    assert abs((sampled['context'] == 'a').mean() - 0.75) < 0.02
+
+
+def test_merge():
+    store = ContextStore.from_frame(pd.DataFrame({'context': ['a', 'b']}))
+    other = ContextStore.from_frame(pd.DataFrame({'context': ['b', 'c', 'c']}))
+
+    merged = store.merge(other)
+
+    counts = dict(zip(merged.to_frame()['context'], merged.counts))
+    assert counts == {'a': 1, 'b': 2, 'c': 2}
+
+
+def test_to_arrays_from_arrays():
+    frame = pd.DataFrame({
+        'category': ['a', 'b', None],
+        'number': [1, 2, 3],
+        'date': pd.to_datetime(['2020-01-01', None, '2020-01-03']),
+    })
+    store = ContextStore.from_frame(frame)
+
+    header, arrays = store.to_arrays()
+    loaded = ContextStore.from_arrays(header, arrays)
+
+    pd.testing.assert_frame_equal(loaded.to_frame(), store.to_frame())
+    np.testing.assert_array_equal(loaded.counts, store.counts)
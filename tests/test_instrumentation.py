@@ -0,0 +1,42 @@
+import json
+
+import numpy as np
+import pytest
+
+from deepecho.instrumentation import NULL_INSTRUMENTATION, EventLog
+
+
+def test_null_instrumentation():
+    with NULL_INSTRUMENTATION.stage('fit', epochs=3) as stage:
+        stage.update(loss=1.0)
+
+
+def test_event_log(tmp_path):
+    path = str(tmp_path / 'events.jsonl')
+    log = EventLog(path)
+
+    with log.stage('train', epochs=2):
+        for epoch in range(2):
+            with log.stage('epoch', epoch=epoch) as stage:
+                stage.update(loss=np.float32(0.5))
+
+    assert [event['stage'] for event in log.events] == ['epoch', 'epoch', 'train']
+    event = log.events[0]
+    assert event['epoch'] == 0
+    assert event['loss'] == 0.5
+    assert event['wall_time'] >= 0
+    assert event['cpu_time'] >= 0
+    assert event['peak_rss'] > 0
+
+    with open(path) as log_file:
+        assert [json.loads(line) for line in log_file] == log.events
+
+
+def test_event_log_error():
+    log = EventLog()
+
+    with pytest.raises(ValueError):
+        with log.stage('fit'):
+            raise ValueError()
+
+    assert log.events[0]['error'] == 'ValueError'
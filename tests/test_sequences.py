@@ -1,8 +1,10 @@
+import numpy as np
 import pandas as pd
 import pytest
 
 from deepecho.sequences import (
-    assemble_sequences, segment_by_size, segment_by_time, segment_sequence)
+    ColumnSummary, SequenceBatch, assemble_batch, assemble_sequences, segment_by_size,
+    segment_by_time, segment_sequence)
 
 
 def test_segment_by_size():
@@ -31,6 +33,41 @@ def test_segment_by_size():
     }), out[2])
 
 
+def test_segment_by_size_drop_incomplete():
+    """Data points that do not fill a whole segment are discarded."""
+    sequence = pd.DataFrame({
+        'a': [1, 2, 3, 4, 5, 6, 7, 8],
+        'b': [8, 7, 6, 5, 4, 3, 2, 1],
+    })
+
+    out = segment_by_size(sequence, 3)
+
+    assert isinstance(out, list)
+    assert len(out) == 2
+
+    pd.testing.assert_frame_equal(pd.DataFrame({
+        'a': [1, 2, 3],
+        'b': [8, 7, 6],
+    }), out[0])
+    pd.testing.assert_frame_equal(pd.DataFrame({
+        'a': [4, 5, 6],
+        'b': [5, 4, 3],
+    }), out[1])
+
+
+def test_segment_by_size_stride():
+    """If a stride is given, a segment starts every stride data points."""
+    sequence = pd.DataFrame({
+        'a': [1, 2, 3, 4, 5, 6],
+    })
+
+    out = segment_by_size(sequence, 3, 2)
+
+    assert len(out) == 2
+    pd.testing.assert_frame_equal(pd.DataFrame({'a': [1, 2, 3]}), out[0])
+    pd.testing.assert_frame_equal(pd.DataFrame({'a': [3, 4, 5]}), out[1])
+
+
 def test_segment_by_time():
     """The sequence is cut in sequences of the indicated time lenght."""
     sequence = pd.DataFrame({
@@ -59,6 +96,33 @@ def test_segment_by_time():
     }), out[2])
 
 
+def test_segment_by_time_empty_window():
+    """Time windows without data points are returned as empty segments."""
+    sequence = pd.DataFrame({
+        'a': [1, 2, 3, 4],
+        'b': [9, 8, 7, 6],
+    })
+    sequence_index = pd.to_datetime(pd.Series([
+        '2001-01-01', '2001-01-02', '2001-01-07', '2001-01-08'
+    ]))
+
+    segment_size = pd.to_timedelta('3d')
+    out = segment_by_time(sequence, segment_size, sequence_index)
+
+    assert isinstance(out, list)
+    assert len(out) == 3
+
+    pd.testing.assert_frame_equal(pd.DataFrame({
+        'a': [1, 2],
+        'b': [9, 8],
+    }), out[0])
+    assert out[1].empty
+    pd.testing.assert_frame_equal(pd.DataFrame({
+        'a': [3, 4],
+        'b': [7, 6],
+    }), out[2])
+
+
 def test_segment_sequence():
     """If no sequence index is given, segments are not ordered."""
     sequence = pd.DataFrame({
@@ -221,6 +285,19 @@ def test__assemble_sequences_context_error():
         assemble_sequences(data, entity_columns, context_columns, 2, None)
 
 
+def test__assemble_sequences_segment_context_error():
+    """If no entity columns and context is not constant within a segment, raise an error."""
+    entity_columns = []
+    context_columns = ['a']
+
+    data = pd.DataFrame({
+        'a': [1, 1, 2, 2, 2, 2],
+        'b': [1, 2, 3, 4, 5, 6],
+    })
+    with pytest.raises(ValueError):
+        assemble_sequences(data, entity_columns, context_columns, 3, None)
+
+
 def test__assemble_sequences_entity_and_time_segment_size():
     """If entity columns and segment_size, group by and then segment."""
     entity_columns = ['a']
@@ -251,3 +328,308 @@ def test__assemble_sequences_entity_and_time_segment_size():
             ],
         },
     ]
+
+
+def test__assemble_sequences_time_segment_size_empty_window():
+    """Time windows without data points are not used as sequences."""
+    entity_columns = ['a']
+    context_columns = []
+
+    data = pd.DataFrame({
+        'a': [1, 1, 1, 1],
+        'b': [1, 2, 3, 4],
+        'time': pd.to_datetime(['2001-01-01', '2001-01-02', '2001-01-07', '2001-01-08']),
+    })
+    out = assemble_sequences(data, entity_columns, context_columns, pd.to_timedelta('3d'), 'time')
+
+    assert out == [
+        {
+            'context': [],
+            'data': [[1, 2]],
+        },
+        {
+            'context': [],
+            'data': [[3, 4]],
+        },
+    ]
+
+
+def test__assemble_sequences_interleaved_entities():
+    """Rows of each entity are gathered and sorted by the sequence index."""
+    entity_columns = ['a']
+    context_columns = ['b']
+
+    data = pd.DataFrame({
+        'a': [2, 1, 2, 1, 2, 1],
+        'b': [5, 4, 5, 4, 5, 4],
+        'c': [3, 1, 1, 3, 2, 2],
+        'd': [9, 8, 7, 6, 5, 4],
+    })
+    out = assemble_sequences(data, entity_columns, context_columns, None, 'c')
+
+    assert out == [
+        {
+            'context': [4],
+            'data': [[8, 4, 6]],
+        },
+        {
+            'context': [5],
+            'data': [[7, 5, 9]],
+        },
+    ]
+
+
+def test__assemble_sequences_as_arrays():
+    """If as_arrays, context and data values are given as numpy arrays."""
+    entity_columns = ['a']
+    context_columns = ['b']
+
+    data = pd.DataFrame({
+        'a': [1, 1, 1, 2, 2, 2],
+        'b': [7, 7, 7, 8, 8, 8],
+        'c': [1, 2, 3, 4, 5, 6],
+        'd': [9, 8, 7, 6, 5, 4],
+    })
+    out = assemble_sequences(data, entity_columns, context_columns, None, None, as_arrays=True)
+
+    assert len(out) == 2
+    for sequence in out:
+        assert isinstance(sequence['context'], np.ndarray)
+        assert all(isinstance(values, np.ndarray) for values in sequence['data'])
+
+    np.testing.assert_array_equal(out[0]['context'], [7])
+    np.testing.assert_array_equal(out[0]['data'], [[1, 2, 3], [9, 8, 7]])
+    np.testing.assert_array_equal(out[1]['context'], [8])
+    np.testing.assert_array_equal(out[1]['data'], [[4, 5, 6], [6, 5, 4]])
+
+
+def test_sequence_batch_from_sequences():
+    """Sequences are stored as one array per column and their offsets."""
+    sequences = [
+        {
+            'context': [1, 'a'],
+            'data': [[1, 2, 3], ['x', 'y', 'z']],
+        },
+        {
+            'context': [2, 'b'],
+            'data': [[4, 5], ['u', 'v']],
+        },
+    ]
+
+    batch = SequenceBatch.from_sequences(sequences)
+
+    assert len(batch) == 2
+    np.testing.assert_array_equal(batch.lengths, [3, 2])
+    np.testing.assert_array_equal(batch.data[0], [1, 2, 3, 4, 5])
+    assert batch.data[1].dtype == object
+    assert batch.context.shape == (2, 2)
+    assert list(batch[1]['context']) == [2, 'b']
+    assert [list(values) for values in batch[1]['data']] == [[4, 5], ['u', 'v']]
+
+    sliced = batch[1:]
+    assert len(sliced) == 1
+    assert [list(values) for values in sliced.get_data(0)] == [[4, 5], ['u', 'v']]
+
+
+def test_sequence_batch_get_values_gaps():
+    """Values outside the sequences are not returned."""
+    batch = SequenceBatch([np.arange(10)], [0, 4, 8], [3, 7, 10])
+
+    np.testing.assert_array_equal(batch.get_values(0), [0, 1, 2, 4, 5, 6, 8, 9])
+
+
+def test_assemble_batch():
+    """The batch references the segments within the sorted data."""
+    entity_columns = ['a']
+    context_columns = ['b']
+
+    data = pd.DataFrame({
+        'a': [2, 1, 2, 1, 2, 1, 1],
+        'b': [5, 4, 5, 4, 5, 4, 4],
+        'c': [1, 2, 3, 4, 5, 6, 7],
+    })
+    out = assemble_batch(data, entity_columns, context_columns, 2, None)
+
+    assert isinstance(out, SequenceBatch)
+    assert len(out) == 3
+    np.testing.assert_array_equal(out.context, [[4], [4], [5]])
+    assert [list(sequence['data'][0]) for sequence in out] == [[2, 4], [6, 7], [1, 3]]
+
+
+def test__assemble_sequences_n_jobs():
+    """The output does not depend on the number of processes."""
+    entity_columns = ['a']
+    context_columns = ['b']
+
+    data = pd.DataFrame({
+        'a': [3, 2, 1, 3, 2, 1, 3, 2, 1, 4],
+        'b': [6, 5, 4, 6, 5, 4, 6, 5, 4, 7],
+        'c': [1, 2, 3, 4, 5, 6, 7, 8, 9, 10],
+        'd': [5, 5, 1, 4, 4, 2, 3, 3, 3, 1],
+    })
+    expected = assemble_sequences(data, entity_columns, context_columns, 2, 'd')
+    out = assemble_sequences(data, entity_columns, context_columns, 2, 'd', n_jobs=2)
+
+    assert out == expected
+    assert out == [
+        {
+            'context': [4],
+            'data': [[3, 6]],
+        },
+        {
+            'context': [5],
+            'data': [[8, 5]],
+        },
+        {
+            'context': [6],
+            'data': [[7, 4]],
+        },
+    ]
+
+
+def test__assemble_sequences_time_segment_stride():
+    """Time windows can overlap and share the same values."""
+    entity_columns = []
+    context_columns = []
+
+    data = pd.DataFrame({
+        'a': [1, 2, 3, 4],
+        'time': pd.date_range(start='2001-01-01', periods=4, freq='1d'),
+    })
+    out = assemble_sequences(data, entity_columns, context_columns, pd.to_timedelta('2d'),
+                             'time', segment_stride=pd.to_timedelta('1d'))
+
+    assert out == [
+        {'context': [], 'data': [[1, 2]]},
+        {'context': [], 'data': [[2, 3]]},
+        {'context': [], 'data': [[3, 4]]},
+        {'context': [], 'data': [[4]]},
+    ]
+
+
+def test_assemble_batch_segment_stride():
+    """Overlapping segments are not copied."""
+    data = pd.DataFrame({
+        'a': [1, 1, 1, 1, 1, 2, 2, 2],
+        'b': [1, 2, 3, 4, 5, 6, 7, 8],
+    })
+    out = assemble_batch(data, ['a'], [], 3, None, segment_stride=1)
+
+    assert len(out) == 4
+    assert len(out.data[0]) == len(data)
+    assert [list(sequence['data'][0]) for sequence in out] == [
+        [1, 2, 3], [2, 3, 4], [3, 4, 5], [6, 7, 8]
+    ]
+
+
+@pytest.mark.parametrize('segment_stride', [0, -1])
+def test_segment_by_size_invalid_stride(segment_stride):
+    sequence = pd.DataFrame({'a': [1, 2, 3, 4]})
+
+    with pytest.raises(ValueError):
+        segment_by_size(sequence, 2, segment_stride)
+
+
+@pytest.mark.parametrize('segment_stride', [2, '0s', '-1d'])
+def test_segment_by_time_invalid_stride(segment_stride):
+    sequence = pd.DataFrame({'a': [1, 2, 3, 4]})
+    sequence_index = pd.Series(pd.date_range(start='2001-01-01', periods=4, freq='1d'))
+    if isinstance(segment_stride, str):
+        segment_stride = pd.to_timedelta(segment_stride)
+
+    with pytest.raises(ValueError):
+        segment_by_time(sequence, pd.to_timedelta('2d'), sequence_index, segment_stride)
+
+
+def test__assemble_sequences_categorical_entities():
+    """Unobserved categories of the entity columns are ignored."""
+    entity_columns = ['a']
+    context_columns = []
+
+    data = pd.DataFrame({
+        'a': pd.Categorical(['x', 'x', 'z'], categories=['w', 'x', 'y', 'z']),
+        'b': pd.Categorical(['p', 'q', 'q']),
+    })
+    out = assemble_sequences(data, entity_columns, context_columns, None, None)
+
+    assert out == [
+        {'context': [], 'data': [['p', 'q']]},
+        {'context': [], 'data': [['q']]},
+    ]
+
+
+def test_sequence_batch_save_load(tmp_path):
+    """Numerical columns are memory-mapped and other columns decoded when read."""
+    batch = SequenceBatch.from_sequences([
+        {'context': ['a', 1], 'data': [[1.0, None, 3.0], ['x', 'y', None]]},
+        {'context': [None, 2], 'data': [[4.0, 5.0], ['z', 'x']]},
+    ])
+
+    batch.save(str(tmp_path / 'batch'))
+    out = SequenceBatch.load(str(tmp_path / 'batch'))
+
+    assert isinstance(out.data[0], np.memmap)
+    np.testing.assert_array_equal(out.data[0], [1.0, np.nan, 3.0, 4.0, 5.0])
+    assert list(out.get_values(1)) == ['x', 'y', None, 'z', 'x']
+    assert list(out.context[:, 0]) == ['a', None]
+    assert list(out.context[:, 1]) == [1, 2]
+    assert list(out.lengths) == [3, 2]
+
+
+def test_sequence_batch_from_iterable(tmp_path):
+    """Chunks of sequences with different types of values are merged."""
+    def sequences():
+        yield {'context': ['a'], 'data': [[1, 2, 3], [1, 2, 3]]}
+        yield {'context': ['b'], 'data': [[4, 5], ['x', 'y']]}
+        yield SequenceBatch.from_sequences([
+            {'context': ['c'], 'data': [[6.5], [4]]},
+        ])
+
+    out = SequenceBatch.from_iterable(sequences(), str(tmp_path / 'batch'), chunk_size=1)
+
+    assert len(out) == 3
+    assert list(out.lengths) == [3, 2, 1]
+    assert list(out.context[:, 0]) == ['a', 'b', 'c']
+    np.testing.assert_array_equal(out.get_values(0), [1, 2, 3, 4, 5, 6.5])
+    assert list(out.get_values(1)) == [1, 2, 3, 'x', 'y', 4]
+
+
+def test_sequence_batch_take():
+    """The selected sequences share the data arrays."""
+    batch = SequenceBatch([np.arange(6)], [0, 2, 4], [2, 4, 6], np.array([[0], [1], [2]]))
+
+    out = batch.take([2, 0])
+
+    assert out.data[0] is batch.data[0]
+    assert list(out.get_values(0)) == [4, 5, 0, 1]
+    assert list(out.context[:, 0]) == [2, 0]
+
+
+def test_sequence_batch_summarize():
+    """The statistics computed in chunks are the ones of all the values."""
+    values = np.array([1.0, 4.0, np.nan, 2.0, 8.0, 3.0])
+    batch = SequenceBatch(
+        [values, np.array(['b', 'a', None, 'b', 'c', 'a'], dtype=object)],
+        [0, 2, 3], [2, 3, 6], np.array([[1], [2], [3]])
+    )
+
+    context, data = batch.summarize(['continuous'], ['continuous', 'categorical'], chunk_size=2)
+
+    assert context[0].mean == 2
+    assert data[0].nulls
+    assert data[0].count == 5
+    np.testing.assert_allclose(data[0].mean, np.nanmean(values))
+    np.testing.assert_allclose(data[0].std, np.nanstd(values))
+    assert (data[0].min, data[0].max) == (1, 8)
+    assert list(data[1].categories) == ['b', 'a', 'c']
+    assert data[1].nulls
+
+
+def test_column_summary_empty():
+    summary = ColumnSummary()
+
+    summary.update(np.array([None, None], dtype=object))
+
+    assert summary.nulls
+    assert summary.count == 0
+    assert np.isnan(summary.std)
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from deepecho import storage
+
+
+def test_save_load(tmp_path):
+    header = {
+        'map': {
+            0: {'type': 'continuous', 'mu': np.float64(0.5), 'indices': (0, 1, 2)},
+            1: {'type': 'categorical', 'indices': {None: 3, 'a': 4, np.int64(2): 5}},
+            '<TOKEN>': {'type': 'categorical', 'indices': {'<END>': 6}},
+        },
+        'values': [np.nan, pd.Timestamp('2020-01-01'), True],
+    }
+    arrays = {
+        'data': np.arange(6, dtype=np.float32).reshape(3, 2),
+        'context': np.zeros((3, 0), dtype=np.float32),
+    }
+    path = str(tmp_path / 'artifact')
+
+    storage.save(path, header, arrays)
+    loaded_header, loaded_arrays = storage.load(path)
+
+    assert storage.exists(path)
+    assert loaded_header['map'] == header['map']
+    assert loaded_header['values'][0] is np.nan
+    assert loaded_header['values'][1:] == header['values'][1:]
+    assert isinstance(loaded_arrays['data'], np.memmap)
+    np.testing.assert_array_equal(loaded_arrays['data'], arrays['data'])
+    assert loaded_arrays['context'].shape == (3, 0)
+
+
+def test_fingerprint():
+    data = pd.DataFrame({'a': [1, 2, 3], 'b': ['x', 'y', 'z']})
+
+    key = storage.fingerprint(data, segment_size=2)
+
+    assert key == storage.fingerprint(data.copy(), segment_size=2)
+    assert key != storage.fingerprint(data, segment_size=3)
+    assert key != storage.fingerprint(data.rename(columns={'a': 'c'}), segment_size=2)
+    assert key != storage.fingerprint(data.assign(a=[1, 2, 4]), segment_size=2)